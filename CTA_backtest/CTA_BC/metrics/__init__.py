@@ -4,4 +4,6 @@ metrics - 策略绩效评估模块
 包含计算和评估交易策略绩效的功能:
 - cal_indicator.py: 计算各种绩效指标(胜率、盈亏比等)
 - cal_return.py: 计算交易收益(总收益、多空收益等)
+- cal_bootstrap.py: 自助法估计绩效指标的置信区间
+- cal_cost.py: 按品种设置的交易成本模型
 """
@@ -0,0 +1,213 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from .cal_indicator import _day_groups
+from ..preprocess._utils import resolve_n_jobs
+
+# 单个批次重采样索引矩阵的最大元素数，用于控制内存
+_MAX_BATCH_ELEMENTS = 2 * 10**7
+
+# 工作进程中共享的各序列数据，由_init_bootstrap_worker设置
+_BOOTSTRAP_STATE = {}
+
+def _ledger_series(ledger, index):
+    """
+    从交易台账整理每个品种的总体交易收益序列和每日收益
+
+    同一品种在同一根K线上同时平掉的多头和空头合并为一笔总体交易，与cal_metric一致
+
+    参数:
+    ledger (DataFrame): calculate_returns_all(return_ledger=True)返回的交易台账
+    index (DatetimeIndex): 收益序列的时间索引，用于确定交易日
+
+    返回:
+    products (list): 品种列表
+    trade_ret (list): 每个品种按平仓时间排序的总体交易收益
+    trade_ns (list): 对应的平仓时间 (int64纳秒)
+    daily (ndarray): (交易日 × 品种) 每日收益矩阵
+    """
+    products = list(ledger['product'].cat.categories)
+    ret = ledger['ret'].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(ret)
+    code = ledger['product'].cat.codes.to_numpy()[valid].astype(np.int64)
+    exit_ns = pd.DatetimeIndex(ledger['exit_ts']).asi8[valid]
+    ret = ret[valid]
+
+    # 按(品种, 平仓时刻)合并多空收益，排序后每个品种的交易按平仓时间排列
+    order = np.lexsort((exit_ns, code))
+    code, exit_ns, ret = code[order], exit_ns[order], ret[order]
+    first = np.r_[True, (code[1:] != code[:-1]) | (exit_ns[1:] != exit_ns[:-1])] if len(ret) else np.zeros(0, dtype=bool)
+    starts = np.flatnonzero(first)
+    merged = np.add.reduceat(ret, starts) if len(starts) else ret
+    merged_code, merged_ns = code[starts], exit_ns[starts]
+    trade_ret = [merged[merged_code == k] for k in range(len(products))]
+    trade_ns = [merged_ns[merged_code == k] for k in range(len(products))]
+
+    # 按平仓日期汇总每日收益，交易日为时间索引覆盖的自然日
+    _, _, days = _day_groups(index)
+    exit_day = pd.DatetimeIndex(merged_ns).normalize().to_numpy().astype('datetime64[D]')
+    day_pos = np.clip(np.searchsorted(days, exit_day), 0, max(len(days) - 1, 0))
+    daily = np.zeros((len(days), len(products)))
+    np.add.at(daily, (day_pos, merged_code), merged)
+    return products, trade_ret, trade_ns, daily
+
+def _sharpe_rows(daily, annual_days):
+    """
+    计算每行每日收益的年化夏普比率，波动为0时为NaN
+    """
+    std = daily.std(axis=-1, ddof=1) if daily.shape[-1] > 1 else np.full(daily.shape[:-1], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std > 0, daily.mean(axis=-1) / std * np.sqrt(annual_days), np.nan)
+
+def _max_drawdown_rows(ret):
+    """
+    计算每行收益序列按顺序累计后的最大回撤，起点水平为0
+    """
+    if ret.shape[-1] == 0:
+        return np.zeros(ret.shape[:-1])
+    level = np.cumsum(ret, axis=-1)
+    peak = np.maximum.accumulate(level, axis=-1)
+    np.maximum(peak, 0, out=peak)
+    peak -= level
+    return peak.max(axis=-1)
+
+def _block_indices(rng, size, n, block_size):
+    """
+    生成循环块自助法的重采样索引矩阵 (size × n)
+    """
+    n_block = -(-n // block_size)
+    starts = rng.integers(0, n, size=(size, n_block, 1))
+    return ((starts + np.arange(block_size)) % n).reshape(size, -1)[:, :n]
+
+def _init_bootstrap_worker(state):
+    """
+    初始化工作进程，保存各序列的交易收益和每日收益
+    """
+    _BOOTSTRAP_STATE.clear()
+    _BOOTSTRAP_STATE.update(state)
+
+def _bootstrap_batch(task):
+    """
+    对单个序列计算一个批次的重采样统计量
+
+    参数:
+    task (tuple): (序列名, SeedSequence, 本批次重采样次数)
+
+    返回:
+    tuple: (序列名, 统计量字典)，统计量为长度等于重采样次数的数组
+    """
+    key, seed_seq, size = task
+    trades, daily = _BOOTSTRAP_STATE['series'][key]
+    block_size = _BOOTSTRAP_STATE['block_size']
+    annual_days = _BOOTSTRAP_STATE['annual_days']
+    rng = np.random.default_rng(seed_seq)
+    n_trade, n_day = len(trades), len(daily)
+    stats = {}
+
+    # 交易重采样: 有放回抽取交易，估计总利润和胜率的分布
+    if n_trade > 0:
+        sample = trades[rng.integers(0, n_trade, size=(size, n_trade), dtype=np.int32)]
+        stats['all_profit'] = sample.sum(axis=1)
+        stats['all_win_rate'] = (sample > 0).mean(axis=1)
+        # 交易重排: 打乱交易顺序，估计最大回撤的分布
+        stats['max_drawdown'] = _max_drawdown_rows(rng.permuted(np.broadcast_to(trades, (size, n_trade)), axis=1))
+    else:
+        stats['all_profit'] = np.zeros(size)
+        stats['all_win_rate'] = np.full(size, np.nan)
+        stats['max_drawdown'] = np.zeros(size)
+
+    # 块自助法: 按块有放回抽取每日收益，保留收益的短期相关性，估计夏普比率的分布
+    if n_day > 0:
+        stats['sharpe'] = _sharpe_rows(daily[_block_indices(rng, size, n_day, min(block_size, n_day))], annual_days)
+    else:
+        stats['sharpe'] = np.full(size, np.nan)
+    return key, stats
+
+def bootstrap_metrics(ledger, index, n_resamples=10000, block_size=5, alpha=0.05, seed=0, by_product=False,
+                      n_jobs=1, batch_size=1000, annual_days=252, progress=True):
+    """
+    用自助法估计策略绩效指标的置信区间
+
+    - all_profit、all_win_rate: 对交易台账中的总体交易有放回重采样
+    - sharpe: 对每日收益做循环块自助法重采样
+    - max_drawdown: 对交易顺序随机重排
+
+    每个批次的重采样索引一次性生成为矩阵，统计量沿矩阵的轴计算；每个批次使用由seed派生的独立随机数种子，
+    因此结果与n_jobs无关，可复现
+
+    参数:
+    ledger (DataFrame): calculate_returns_all(return_ledger=True)返回的交易台账
+    index (DatetimeIndex): 收益序列的时间索引，用于确定交易日
+    n_resamples (int): 重采样次数，默认为10000
+    block_size (int): 块自助法的块长度(交易日数)，默认为5
+    alpha (float): 置信区间的显著性水平，默认为0.05 (即95%置信区间)
+    seed (int): 随机数种子，默认为0
+    by_product (bool): 是否对每个品种分别计算，默认为False (只计算组合)
+    n_jobs (int): 并行进程数，1为串行，-1为使用全部CPU核心，默认为1
+    batch_size (int): 每个批次的最大重采样次数，默认为1000
+    annual_days (int): 年化夏普比率使用的年交易日数，默认为252
+    progress (bool): 是否显示进度条，默认为True
+
+    返回:
+    DataFrame: 列为product (组合为'portfolio')、metric、method、estimate (原样本上的取值)、
+               mean、std、lower、upper
+    """
+    products, trade_ret, trade_ns, daily = _ledger_series(ledger, index)
+
+    # 组合的交易按平仓时间排列
+    exit_order = np.argsort(np.concatenate(trade_ns or [np.empty(0, dtype=np.int64)]), kind='stable')
+    series = {'portfolio': (np.concatenate(trade_ret or [np.empty(0)])[exit_order], daily.sum(axis=1))}
+    if by_product:
+        series.update({product: (trade_ret[k], daily[:, k]) for k, product in enumerate(products)})
+
+    # 按序列划分批次，批次大小受索引矩阵的元素数限制
+    root = np.random.SeedSequence(seed)
+    tasks = []
+    for key, seq in zip(series, root.spawn(len(series))):
+        trades, day_pnl = series[key]
+        size = max(1, min(batch_size, _MAX_BATCH_ELEMENTS // max(len(trades), len(day_pnl), 1)))
+        sizes = [size] * (n_resamples // size) + ([n_resamples % size] if n_resamples % size else [])
+        tasks.extend((key, child, s) for child, s in zip(seq.spawn(len(sizes)), sizes))
+
+    state = {'series': series, 'block_size': block_size, 'annual_days': annual_days}
+    n_jobs = min(resolve_n_jobs(n_jobs), max(len(tasks), 1))
+    if n_jobs == 1:
+        _init_bootstrap_worker(state)
+        try:
+            results = [_bootstrap_batch(task) for task in tqdm(tasks, desc='Bootstrap', disable=not progress)]
+        finally:
+            _BOOTSTRAP_STATE.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_bootstrap_worker, initargs=(state,)) as executor:
+            results = list(tqdm(executor.map(_bootstrap_batch, tasks), total=len(tasks), desc='Bootstrap', disable=not progress))
+
+    # 汇总各批次的统计量
+    samples = {key: {} for key in series}
+    for key, stats in results:
+        for metric, values in stats.items():
+            samples[key].setdefault(metric, []).append(values)
+
+    methods = {'all_profit': 'trade', 'all_win_rate': 'trade', 'sharpe': 'block', 'max_drawdown': 'reshuffle'}
+    rows = []
+    for key, (trades, day_pnl) in series.items():
+        estimate = {
+            'all_profit': trades.sum(),
+            'all_win_rate': (trades > 0).mean() if len(trades) else np.nan,
+            'sharpe': float(_sharpe_rows(day_pnl[None, :], annual_days)[0]) if len(day_pnl) else np.nan,
+            'max_drawdown': float(_max_drawdown_rows(trades[None, :])[0]),
+        }
+        for metric, method in methods.items():
+            values = np.concatenate(samples[key].get(metric, [np.empty(0)]))
+            finite = values[~np.isnan(values)]
+            rows.append({
+                'product': key,
+                'metric': metric,
+                'method': method,
+                'estimate': estimate[metric],
+                'mean': finite.mean() if len(finite) else np.nan,
+                'std': finite.std(ddof=1) if len(finite) > 1 else np.nan,
+                'lower': np.quantile(finite, alpha / 2) if len(finite) else np.nan,
+                'upper': np.quantile(finite, 1 - alpha / 2) if len(finite) else np.nan,
+            })
+    return pd.DataFrame(rows, columns=['product', 'metric', 'method', 'estimate', 'mean', 'std', 'lower', 'upper'])
@@ -0,0 +1,95 @@
+import pandas as pd
+import numpy as np
+
+class CostModel:
+    """
+    按品种设置的交易成本模型
+
+    单边成本以成交价格的比例表示:
+        比例手续费 + 每手固定手续费 / (价格 × 合约乘数) + 滑点跳数 × 最小变动价位 / 价格
+        + 冲击成本系数 × sqrt(成交金额 / 当根K线成交额)
+    其中成交金额 = 价格 × 合约乘数 × 手数。一笔交易的成本为开仓和平仓两个单边成本之和，
+    与calculate_returns_all中的cost一样直接从该笔交易的收益中扣除
+
+    参数:
+    params (dict/DataFrame): 各品种的参数，dict时为 {品种: {参数名: 取值}}，DataFrame时index为品种、columns为参数名，
+                             未给出的品种或参数使用default
+    default (dict): 所有品种的默认参数
+
+    参数名:
+    fee_ratio (float): 单边比例手续费，默认0
+    fee_per_lot (float): 单边每手固定手续费，默认0
+    tick_size (float): 最小变动价位，默认0
+    slippage_ticks (float): 单边滑点跳数，默认0
+    multiplier (float): 合约乘数，默认1
+    lots (float): 每笔交易手数，默认1
+    impact_coef (float): 冲击成本系数，默认0，需要成交额数据
+    """
+    FIELDS = {
+        'fee_ratio': 0.0,
+        'fee_per_lot': 0.0,
+        'tick_size': 0.0,
+        'slippage_ticks': 0.0,
+        'multiplier': 1.0,
+        'lots': 1.0,
+        'impact_coef': 0.0,
+    }
+
+    def __init__(self, params=None, default=None):
+        if isinstance(params, pd.DataFrame):
+            params = {product: row.dropna().to_dict() for product, row in params.iterrows()}
+        self.params = {product: dict(value) for product, value in (params or {}).items()}
+        self.default = {**self.FIELDS, **(default or {})}
+        unknown = set(self.default).union(*[value.keys() for value in self.params.values()]) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unsupported cost parameters: {sorted(unknown)}")
+
+    def __repr__(self):
+        return f"CostModel(products={len(self.params)}, default={self.default})"
+
+    def param_arrays(self, products):
+        """
+        按品种顺序整理各参数
+
+        参数:
+        products (list): 品种列表
+
+        返回:
+        dict: {参数名: 长度为品种数的数组}
+        """
+        return {name: np.array([self.params.get(product, {}).get(name, default) for product in products], dtype=np.float64)
+                for name, default in self.default.items()}
+
+    def needs_amount(self, products):
+        """
+        是否有品种需要成交额数据计算冲击成本
+        """
+        return bool((self.param_arrays(products)['impact_coef'] != 0).any())
+
+    def side_cost(self, products, price, amt=None, codes=None):
+        """
+        计算成交的单边成本
+
+        各参数按品种整理为一维数组，与 (时间 × 品种) 的价格矩阵广播计算；给出codes时只计算逐笔成交，
+        price为每笔成交的价格，参数按codes取出对应品种的值
+
+        参数:
+        products (list): 品种列表，codes为None时与price各列对应
+        price (ndarray): (时间 × 品种) 价格矩阵，或给出codes时每笔成交的价格
+        amt (ndarray): 与price形状相同的成交额，为None、NaN或不大于0时冲击成本记为0
+        codes (ndarray): 每笔成交的品种编号，对应products中的位置，默认为None
+
+        返回:
+        ndarray: 与price形状相同的单边成本
+        """
+        p = self.param_arrays(products)
+        if codes is not None:
+            p = {name: values[codes] for name, values in p.items()}
+        price = np.asarray(price, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost = p['fee_ratio'] + (p['fee_per_lot'] / p['multiplier'] + p['slippage_ticks'] * p['tick_size']) / price
+            if amt is not None and (p['impact_coef'] != 0).any():
+                amt = np.asarray(amt, dtype=np.float64)
+                impact = p['impact_coef'] * np.sqrt(price * p['multiplier'] * p['lots'] / amt)
+                cost = cost + np.where(amt > 0, impact, 0)
+        return cost
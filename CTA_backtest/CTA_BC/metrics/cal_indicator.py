@@ -6,88 +6,401 @@ import seaborn as sns
 import warnings
 from tqdm import tqdm
 
-def cal_metric(df_all,df_long,df_short):
+# 每天的纳秒数，用于按整数归一化日期
+_NS_PER_DAY = 86400 * 10**9
+
+# cal_metric返回的指标及顺序
+_METRIC_KEYS = ['all_win_rate', 'long_win_rate', 'short_win_rate',
+                'all_ProfitLoss_ratio', 'long_ProfitLoss_ratio', 'short_ProfitLoss_ratio',
+                'MeanRet_all', 'MeanRet_long', 'MeanRet_short',
+                'count_all', 'count_long', 'count_short',
+                'count_all_D', 'count_long_D', 'count_short_D',
+                'all_profit', 'long_profit', 'short_profit']
+
+# 由累计收益曲线计算的风险指标，与收益记账方式(平仓记账或逐K线盯市)有关
+_CURVE_METRIC_KEYS = ['annual_return', 'annual_volatility', 'sharpe', 'sortino',
+                      'max_drawdown', 'max_drawdown_duration', 'calmar']
+
+def _side_stats(values):
+    """
+    计算一组交易收益的充分统计量
+    
+    参数:
+    values (ndarray): 不含NaN的交易收益
+    
+    返回:
+    tuple: (交易次数, 盈利次数, 盈利总和, 亏损总和的绝对值, 收益总和)
+    """
+    win = values > 0
+    profit = values[win].sum()
+    loss = -values[values < 0].sum()
+    return len(values), int(win.sum()), profit, loss, values.sum()
+
+def _summary_metrics(stats, day_len, profits):
+    """
+    由多空及总体的统计量汇总绩效指标
+    
+    参数:
+    stats (dict): 'all'/'long'/'short' 对应的 _side_stats 结果
+    day_len (int): 交易天数
+    profits (dict): 'all'/'long'/'short' 对应的累计收益终值
+    
+    返回:
+    dict: 与cal_metric相同键的绩效指标字典
+    """
+    _dict = {}
+    for name, (count, wins, profit, loss, total) in stats.items():
+        _dict[f'{name}_win_rate'] = wins / count if count > 0 else np.nan              # 胜率
+        _dict[f'{name}_ProfitLoss_ratio'] = profit / loss if loss > 0 else float('inf')  # 盈亏比
+        _dict[f'MeanRet_{name}'] = total / count if count > 0 else 0                     # 平均收益
+        _dict[f'count_{name}'] = count                                                   # 交易次数
+        _dict[f'count_{name}_D'] = count / day_len if day_len > 0 else 0                 # 日均交易次数
+        _dict[f'{name}_profit'] = profits[name]                                          # 总利润
+    return {key: _dict[key] for key in _METRIC_KEYS}
+
+def _risk_metrics(pnl, level, index, annual_days=252):
+    """
+    由总体收益曲线计算风险指标
+    
+    参数:
+    pnl (ndarray): 每根K线的总体收益 (各品种之和)
+    level (ndarray): 累计收益，即pnl的累计和
+    index (DatetimeIndex): 时间索引
+    annual_days (int): 年化使用的年交易日数，默认为252
+    
+    返回:
+    risk (dict): 年化收益、年化波动、夏普、索提诺、最大回撤及其持续交易日数、卡玛比率
+    drawdown (ndarray): 每根K线的回撤 (历史最高累计收益与当前累计收益之差，起点水平为0)
+    day_len (int): 交易天数
+    """
+    order, starts, _ = _day_groups(index)
+    day_len = len(starts)
+    daily = _group_sum(pnl[order], starts)
+    
+    # 回撤及最长回撤持续时间 (从前高所在交易日到恢复或样本结束的交易日数)
+    drawdown = np.maximum.accumulate(np.maximum(level, 0)) - level if len(level) else np.zeros(0)
+    max_drawdown = drawdown.max() if len(drawdown) else 0.0
+    first = np.zeros(len(order), dtype=np.int64)
+    first[starts] = 1
+    day_id = np.empty(len(order), dtype=np.int64)
+    day_id[order] = np.cumsum(first) - 1  # 每根K线所在的交易日序号
+    edges = np.diff(np.r_[0, (drawdown > 0).astype(np.int8), 0])
+    begin, finish = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    duration = day_id[np.minimum(finish, len(level) - 1)] - day_id[np.maximum(begin - 1, 0)]
+    
+    s1, s2 = daily.sum(), (daily ** 2).sum()
+    downside = np.sqrt((np.minimum(daily, 0) ** 2).sum() / day_len) if day_len > 0 else 0.0
+    annual_return = s1 / day_len * annual_days if day_len > 0 else 0.0
+    annual_volatility = np.sqrt(max((s2 - s1 ** 2 / day_len) / (day_len - 1), 0) * annual_days) if day_len > 1 else np.nan
+    risk = {
+        'annual_return': annual_return,                                              # 年化收益
+        'annual_volatility': annual_volatility,                                      # 年化波动
+        'sharpe': float(_sharpe(np.asarray(s1), np.asarray(s2), day_len, annual_days)),  # 夏普比率
+        'sortino': s1 / day_len / downside * np.sqrt(annual_days) if downside > 0 else (float('inf') if s1 > 0 else np.nan),  # 索提诺比率
+        'max_drawdown': max_drawdown,                                                # 最大回撤
+        'max_drawdown_duration': int(duration.max()) if len(duration) else 0,        # 最长回撤持续交易日数
+        'calmar': annual_return / max_drawdown if max_drawdown > 0 else (float('inf') if annual_return > 0 else np.nan),  # 卡玛比率
+    }
+    return risk, drawdown, day_len
+
+def _frame_stats(df_all, df_long, df_short):
+    """
+    从总体、多头和空头收益矩阵中各取出一次非NaN收益，计算统计量和逐K线收益
+    
+    返回:
+    stats (dict): 'all'/'long'/'short' 对应的 _side_stats 结果
+    row_sums (dict): 'return_all'/'return_long'/'return_short' 对应的每根K线所有品种收益之和
+    """
+    stats, row_sums = {}, {}
+    for name, df in (('all', df_all), ('long', df_long), ('short', df_short)):
+        if not df.index.equals(df_all.index):
+            df = df.reindex(df_all.index)
+        values = df.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        stats[name] = _side_stats(values[valid])
+        row_sums[f'return_{name}'] = np.where(valid, values, 0).sum(axis=1)
+    return stats, row_sums
+
+def _metrics_from_stats(stats, pnl, df_pnl, n_product):
+    """
+    由交易统计量和累计收益曲线汇总全部绩效指标
+    
+    参数:
+    stats (dict): 'all'/'long'/'short' 对应的 _side_stats 结果
+    pnl (ndarray): 每根K线的总体收益
+    df_pnl (DataFrame): 累计收益曲线，列为return_all、return_long、return_short
+    n_product (int): 品种数，用于计算换手率
+    
+    返回:
+    _dict (dict): 绩效指标字典
+    drawdown (ndarray): 总体累计收益的回撤序列
+    """
+    profits = {name: df_pnl[f'return_{name}'].iloc[-1] if len(df_pnl) else 0 for name in stats}
+    risk, drawdown, day_len = _risk_metrics(pnl, df_pnl['return_all'].to_numpy(), df_pnl.index)
+    
+    _dict = _summary_metrics(stats, day_len, profits)
+    _dict.update(risk)
+    # 换手率: 每个品种日均开平仓次数
+    _dict['turnover'] = 2 * (stats['long'][0] + stats['short'][0]) / day_len / n_product if day_len > 0 and n_product > 0 else 0
+    return _dict, drawdown
+
+def cal_metric(df_all,df_long,df_short,return_drawdown = False):
     """
     计算策略的各项绩效指标
     
+    每个收益矩阵只取出一次非NaN收益，交易指标基于这些收益计算，风险指标基于同一条累计收益曲线计算
+    
     参数:
     df_all (DataFrame): 总体收益数据，包含多头和空头
     df_long (DataFrame): 多头收益数据
     df_short (DataFrame): 空头收益数据
+    return_drawdown (bool): 是否同时返回总体累计收益的回撤序列，默认为False
+    
+    返回:
+    df_pnl (DataFrame): 累计收益曲线数据
+    _dict (dict): 包含各项绩效指标的字典
+    df_drawdown (DataFrame): 回撤序列，列为drawdown，仅在return_drawdown=True时返回
+    """
+    stats, row_sums = _frame_stats(df_all, df_long, df_short)
+    
+    # 计算累计收益
+    df_pnl = pd.DataFrame(row_sums, index=df_all.index).cumsum()
+    _dict, drawdown = _metrics_from_stats(stats, row_sums['return_all'], df_pnl, df_all.shape[1])
+    
+    if return_drawdown:
+        return df_pnl,_dict,pd.DataFrame({'drawdown': drawdown}, index=df_all.index)
+    return df_pnl,_dict
+
+def cal_metric_ledger(ledger, index, return_drawdown=False):
+    """
+    基于逐笔交易台账计算策略的各项绩效指标，结果与cal_metric一致
+    
+    同一品种在同一根K线上同时平掉的多头和空头合并为一笔总体交易
+    
+    参数:
+    ledger (DataFrame): calculate_returns_all(return_ledger=True)返回的交易台账
+    index (DatetimeIndex): 收益序列的时间索引，用于累计收益曲线和交易天数
+    return_drawdown (bool): 是否同时返回总体累计收益的回撤序列，默认为False
     
     返回:
     df_pnl (DataFrame): 累计收益曲线数据
     _dict (dict): 包含各项绩效指标的字典
+    df_drawdown (DataFrame): 回撤序列，列为drawdown，仅在return_drawdown=True时返回
+    """
+    index = pd.DatetimeIndex(index)
+    ret = ledger['ret'].to_numpy(dtype=np.float64)
+    side = ledger['side'].to_numpy()
+    exit_pos = index.get_indexer(ledger['exit_ts'])
+    valid = ~np.isnan(ret) & (exit_pos >= 0)
+    ret, side, exit_pos = ret[valid], side[valid], exit_pos[valid]
+    product_code = ledger['product'].cat.codes.to_numpy()[valid].astype(np.int64)
+    
+    # 按(品种, 平仓K线)合并多空收益得到总体收益
+    _, group = np.unique(product_code * len(index) + exit_pos, return_inverse=True)
+    stats = {
+        'all': _side_stats(np.bincount(group, weights=ret) if len(ret) else ret),
+        'long': _side_stats(ret[side == 1]),
+        'short': _side_stats(ret[side == -1]),
+    }
+    
+    # 累计收益曲线
+    pnl = np.bincount(exit_pos, weights=ret, minlength=len(index))
+    df_pnl = pd.DataFrame({
+        'return_all': pnl,
+        'return_long': np.bincount(exit_pos, weights=np.where(side == 1, ret, 0), minlength=len(index)),
+        'return_short': np.bincount(exit_pos, weights=np.where(side == -1, ret, 0), minlength=len(index)),
+    }, index=index).cumsum()
+    _dict, drawdown = _metrics_from_stats(stats, pnl, df_pnl, len(ledger['product'].cat.categories))
+    
+    if return_drawdown:
+        return df_pnl, _dict, pd.DataFrame({'drawdown': drawdown}, index=index)
+    return df_pnl, _dict
+
+def _day_groups(index):
+    """
+    将时间索引按自然日分组
+    
+    参数:
+    index (DatetimeIndex): 时间索引
+    
+    返回:
+    order (ndarray): 按日期稳定排序后的行顺序
+    starts (ndarray): 排序后每天第一行的位置
+    days (ndarray): 每天的日期，datetime64[D]
+    """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)  # 按当地日期分组
+    day = index.asi8 // _NS_PER_DAY
+    order = np.argsort(day, kind='stable')
+    day = day[order]
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]]) if len(day) else np.empty(0, dtype=np.int64)
+    return order, starts, day[starts].astype('datetime64[D]')
+
+def _group_sum(values, starts):
+    """
+    按分组起点对二维数组的行求和
+    """
+    if len(starts) == 0:
+        return np.zeros((0,) + values.shape[1:])
+    return np.add.reduceat(values, starts, axis=0)
+
+def cal_daily_pnl(df_ret):
+    """
+    将逐K线收益汇总为每日收益
+    
+    参数:
+    df_ret (DataFrame): 收益数据，index为datetime，NaN表示该K线无收益
+    
+    返回:
+    DataFrame: 每日收益，index为有K线的日期，columns与df_ret相同
+    """
+    order, starts, days = _day_groups(df_ret.index)
+    values = np.nan_to_num(df_ret.to_numpy(dtype=np.float64)[order], nan=0.0)
+    return pd.DataFrame(_group_sum(values, starts), index=pd.DatetimeIndex(days, name='date'), columns=df_ret.columns)
+
+def _sharpe(s1, s2, n, annual_days):
+    """
+    由收益和、收益平方和及天数计算年化夏普比率，样本不足或波动为0时为NaN
+    """
+    n = np.broadcast_to(n, s1.shape).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (s2 - s1 ** 2 / n) / (n - 1)
+        std = np.sqrt(np.maximum(var, 0))
+        return np.where((n > 1) & (std > 0), s1 / n / std * np.sqrt(annual_days), np.nan)
+
+def _trade_ratios(count, wins, profit, loss):
     """
+    计算胜率和盈亏比，无交易时为NaN，无亏损时盈亏比为inf
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        win_rate = np.where(count > 0, wins / count, np.nan)
+        pl_ratio = np.where(count > 0, np.where(loss > 0, profit / loss, np.inf), np.nan)
+    return win_rate, pl_ratio
+
+def _tidy(products, scope, periods, metrics):
+    """
+    将 (时间 × 品种) 的指标矩阵整理为长表
+    """
+    n_period, n_product = len(periods), len(products)
+    frames = [pd.DataFrame({
+        'product': np.tile(products, n_period),
+        'scope': scope,
+        'period': np.repeat(periods, n_product),
+        'metric': name,
+        'value': values.ravel(),
+    }) for name, values in metrics.items()]
+    return pd.concat(frames, ignore_index=True)
+
+def _rolling_max_drawdown(level, width):
+    """
+    计算收益水平在每个长度为width的滑动窗口内的最大回撤，时间和内存都是O(n)
+    
+    把序列切成长度为width的块，任一窗口要么恰好是一整块，要么由某块的后缀和下一块的前缀组成。
+    块内后缀的最大回撤/最高水平和前缀的最大回撤/最低水平都由一次累计最大(最小)扫描得到，窗口的最大回撤为
+    max(后缀最大回撤, 前缀最大回撤, 后缀最高水平 - 前缀最低水平)
+    
+    参数:
+    level (ndarray): (时间 × 品种) 累计收益水平
+    width (int): 窗口包含的水平个数
+    
+    返回:
+    ndarray: (时间 - width + 1) × 品种 的最大回撤，第i行为窗口level[i:i + width]的最大回撤
+    """
+    n, p = level.shape
+    n_block = -(-n // width)
+    # 末尾补齐为整块，补齐的值只会出现在无法构成完整窗口的位置
+    blocks = np.pad(level, ((0, n_block * width - n), (0, 0)), mode='edge').reshape(n_block, width, p)
+    
+    # 块内前缀: 最低水平、最大回撤
+    pre_min = np.minimum.accumulate(blocks, axis=1)
+    pre_mdd = np.maximum.accumulate(np.maximum.accumulate(blocks, axis=1) - blocks, axis=1)
+    # 块内后缀: 最高水平、最大回撤 (峰值在前，谷值为其后的最低水平)
+    flipped = blocks[:, ::-1]
+    suf_max = np.maximum.accumulate(flipped, axis=1)[:, ::-1]
+    suf_mdd = np.maximum.accumulate(flipped - np.minimum.accumulate(flipped, axis=1), axis=1)[:, ::-1]
+    
+    pre_min, pre_mdd, suf_max, suf_mdd = (a.reshape(-1, p) for a in (pre_min, pre_mdd, suf_max, suf_mdd))
+    start = np.arange(n - width + 1)
+    end = start + width - 1
+    cross = np.maximum(np.maximum(suf_mdd[start], pre_mdd[end]), suf_max[start] - pre_min[end])
+    # 起点与块对齐时窗口恰好是一整块
+    return np.where((start % width == 0)[:, None], suf_mdd[start], cross)
+
+def cal_metric_periods(df_all, window=60, freqs=('M', 'Y'), annual_days=252):
+    """
+    计算滚动窗口及按月/年分段的绩效指标
+    
+    先将逐笔收益汇总为每日的收益、收益平方、交易次数、盈利次数、盈利和亏损，
+    滚动窗口上的指标由这些量的累计和相减得到，分段指标由分段求和得到
+    
+    参数:
+    df_all (DataFrame): 总体收益数据，即calculate_returns_all返回的_df_ret_all
+    window (int): 滚动窗口的交易日数，默认为60，为None时不计算滚动指标
+    freqs (tuple): 分段频率，'M'为按月，'Y'为按年，默认为('M', 'Y')
+    annual_days (int): 年化夏普比率使用的年交易日数，默认为252
+    
+    返回:
+    DataFrame: 长表，列为product (品种名，组合为'portfolio')、scope (如'rolling_60D'、'M'、'Y')、
+               period (滚动窗口的最后一天或分段的起始日期)、metric (sharpe、win_rate、ProfitLoss_ratio、
+               max_drawdown、pnl)、value
+    """
+    products = [c[:-4] if str(c).endswith('_all') else str(c) for c in df_all.columns] + ['portfolio']
+    
+    # 逐笔收益的每日汇总量，最后一列为组合
+    order, starts, days = _day_groups(df_all.index)
+    values = df_all.to_numpy(dtype=np.float64)[order]
+    valid = ~np.isnan(values)
+    ret = np.where(valid, values, 0)
+    daily = {
+        'count': _group_sum(valid.astype(np.float64), starts),
+        'wins': _group_sum((values > 0).astype(np.float64), starts),
+        'profit': _group_sum(np.where(ret > 0, ret, 0), starts),
+        'loss': _group_sum(np.where(ret < 0, -ret, 0), starts),
+        'pnl': _group_sum(ret, starts),
+    }
+    daily = {key: np.column_stack((value, value.sum(axis=1))) for key, value in daily.items()}
+    daily['pnl2'] = daily['pnl'] ** 2
+    # 累计收益水平，第0行为首日之前的水平
+    level = np.vstack((np.zeros((1, len(products))), np.cumsum(daily['pnl'], axis=0)))
+    
+    frames = []
+    n_day = len(days)
+    if window is not None and n_day >= window:
+        # 滚动窗口内的求和 = 累计和之差
+        acc = {key: np.vstack((np.zeros((1, len(products))), np.cumsum(value, axis=0))) for key, value in daily.items()}
+        roll = {key: value[window:] - value[:-window] for key, value in acc.items()}
+        win_rate, pl_ratio = _trade_ratios(roll['count'], roll['wins'], roll['profit'], roll['loss'])
+        # 窗口内最大回撤，包含窗口开始前的收益水平
+        max_drawdown = _rolling_max_drawdown(level, window + 1)
+        frames.append(_tidy(products, f'rolling_{window}D', pd.DatetimeIndex(days[window - 1:]), {
+            'sharpe': _sharpe(roll['pnl'], roll['pnl2'], window, annual_days),
+            'win_rate': win_rate,
+            'ProfitLoss_ratio': pl_ratio,
+            'max_drawdown': max_drawdown,
+            'pnl': roll['pnl'],
+        }))
+    
+    for freq in freqs:
+        if freq not in ('M', 'Y'):
+            raise ValueError(f"Unsupported freq: {freq}")
+        key = days.astype(f'datetime64[{freq}]')
+        seg = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if n_day else np.empty(0, dtype=np.int64)
+        total = {name: _group_sum(value, seg) for name, value in daily.items()}
+        n = np.diff(np.r_[seg, n_day])[:, None]
+        win_rate, pl_ratio = _trade_ratios(total['count'], total['wins'], total['profit'], total['loss'])
+        # 分段内最大回撤: 分段内累计最高水平(含分段开始前的水平)与当前水平之差
+        group = np.repeat(np.arange(len(seg)), n.ravel())
+        peak = np.maximum(pd.DataFrame(level[1:]).groupby(group).cummax().to_numpy(), level[seg][group])
+        max_drawdown = pd.DataFrame(peak - level[1:]).groupby(group).max().to_numpy()
+        frames.append(_tidy(products, freq, pd.DatetimeIndex(key[seg]), {
+            'sharpe': _sharpe(total['pnl'], total['pnl2'], n, annual_days),
+            'win_rate': win_rate,
+            'ProfitLoss_ratio': pl_ratio,
+            'max_drawdown': max_drawdown.reshape(len(seg), len(products)),
+            'pnl': total['pnl'],
+        }))
     
-    # 合并总体、多头和空头的收益数据
-    _df_all = pd.DataFrame(df_all.sum(axis = 1),columns = ['return_all'])
-    _df_long = pd.DataFrame(df_long.sum(axis = 1),columns = ['return_long'])
-    _df_short = pd.DataFrame(df_short.sum(axis = 1),columns = ['return_short'])
-
-    df_plot = pd.merge(_df_all,_df_long,on = 'datetime',how = 'left')
-    df_plot = pd.merge(df_plot,_df_short,on = 'datetime',how = 'left')
-    df_pnl = df_plot.cumsum()  # 计算累计收益
-
-    # 计算胜率 (正收益交易占比)
-    all_win_rate = (df_all > 0).sum().sum() / (pd.notnull(df_all)).sum().sum()
-    long_win_rate = (df_long > 0).sum().sum() / (pd.notnull(df_long)).sum().sum()
-    short_win_rate = (df_short > 0).sum().sum() / (pd.notnull(df_short)).sum().sum()
-
-    # 计算盈亏比 (盈利交易总和/亏损交易总和的绝对值)
-    all_profit = df_all[df_all > 0].sum().sum()
-    all_loss = abs(df_all[df_all < 0]).sum().sum()
-    all_ProfitLoss_ratio = all_profit / all_loss if all_loss > 0 else float('inf')
-    
-    long_profit = df_long[df_long > 0].sum().sum()
-    long_loss = abs(df_long[df_long < 0]).sum().sum() 
-    long_ProfitLoss_ratio = long_profit / long_loss if long_loss > 0 else float('inf')
-    
-    short_profit = df_short[df_short > 0].sum().sum()
-    short_loss = abs(df_short[df_short < 0]).sum().sum()
-    short_ProfitLoss_ratio = short_profit / short_loss if short_loss > 0 else float('inf')
-
-    # 计算交易次数
-    count_all = (pd.notnull(df_all)).sum().sum()
-    count_long = (pd.notnull(df_long)).sum().sum()
-    count_short = (pd.notnull(df_short)).sum().sum()
-
-    # 计算平均收益率
-    MeanRet_all = df_all.sum().sum() / count_all if count_all > 0 else 0
-    MeanRet_long = df_long.sum().sum() / count_long if count_long > 0 else 0
-    MeanRet_short = df_short.sum().sum() / count_short if count_short > 0 else 0
-    
-    # 计算交易天数和日均交易次数
-    day_len = len(pd.Series(df_all.index).apply(lambda x: str(x)[:10]).unique())
-    count_all_D = count_all/day_len if day_len > 0 else 0
-    count_long_D = count_long/day_len if day_len > 0 else 0
-    count_short_D = count_short/day_len if day_len > 0 else 0
-
-    # 计算总利润
-    all_profit = df_pnl['return_all'][-1]
-    long_profit = df_pnl['return_long'][-1]
-    short_profit = df_pnl['return_short'][-1]
-
-    # 汇总所有指标到字典
-    _dict = {
-            'all_win_rate': all_win_rate,         # 总体胜率
-            'long_win_rate': long_win_rate,       # 多头胜率
-            'short_win_rate': short_win_rate,     # 空头胜率
-            'all_ProfitLoss_ratio': all_ProfitLoss_ratio,     # 总体盈亏比
-            'long_ProfitLoss_ratio': long_ProfitLoss_ratio,   # 多头盈亏比
-            'short_ProfitLoss_ratio': short_ProfitLoss_ratio, # 空头盈亏比
-            'MeanRet_all': MeanRet_all,           # 总体平均收益
-            'MeanRet_long': MeanRet_long,         # 多头平均收益
-            'MeanRet_short': MeanRet_short,       # 空头平均收益
-            'count_all': count_all,               # 总交易次数
-            'count_long': count_long,             # 多头交易次数
-            'count_short': count_short,           # 空头交易次数
-            'count_all_D': count_all_D,           # 日均总交易次数
-            'count_long_D': count_long_D,         # 日均多头交易次数
-            'count_short_D': count_short_D,       # 日均空头交易次数
-            'all_profit': all_profit,             # 总利润
-            'long_profit': long_profit,           # 多头总利润
-            'short_profit': short_profit          # 空头总利润
-            }
-    
-    return df_pnl,_dict
\ No newline at end of file
+    if not frames:
+        return pd.DataFrame(columns=['product', 'scope', 'period', 'metric', 'value'])
+    return pd.concat(frames, ignore_index=True)
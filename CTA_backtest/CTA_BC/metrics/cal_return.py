@@ -5,6 +5,64 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import warnings
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from ..preprocess._utils import resolve_n_jobs, to_shared_array, from_shared_array
+from .cal_cost import CostModel
+
+def _entry_positions(position):
+    """
+    找出每根平仓K线所平掉的多头和空头开仓位置
+    
+    与逐行遍历的规则一致: 1/-1分别记录最近一次开多/开空的位置(重复开仓以最后一次为准)，
+    0同时平掉此前未平的多头和空头
+    
+    参数:
+    position (ndarray): 仓位标志数组，1为开多，-1为开空，0为平仓
+    
+    返回:
+    long_entry (ndarray): 每根K线平掉的多头开仓位置，无对应多头时为-1
+    short_entry (ndarray): 每根K线平掉的空头开仓位置，无对应空头时为-1
+    """
+    idx = np.arange(len(position))
+    is_close = position == 0
+    last_long = np.maximum.accumulate(np.where(position == 1, idx, -1))  # 最近一次开多位置
+    last_short = np.maximum.accumulate(np.where(position == -1, idx, -1))  # 最近一次开空位置
+    last_close = np.maximum.accumulate(np.where(is_close, idx, -1))
+    prev_close = np.full(len(position), -1)
+    prev_close[1:] = last_close[:-1]  # 当前K线之前最近一次平仓位置
+    long_entry = np.where(is_close & (last_long > prev_close), last_long, -1)
+    short_entry = np.where(is_close & (last_short > prev_close), last_short, -1)
+    return long_entry, short_entry
+
+def _close_returns(price, position, cost):
+    """
+    按平仓K线计算多头和空头收益
+    
+    参数:
+    price (ndarray): 价格数组
+    position (ndarray): 仓位标志数组，1为开多，-1为开空，0为平仓
+    cost (float/ndarray): 交易成本，float时为每笔交易的固定成本，ndarray时为与价格对齐的每根K线单边成本，
+                          每笔交易扣除开仓和平仓两根K线的单边成本之和
+    
+    返回:
+    return_long (ndarray): 多头收益，非平仓K线为NaN
+    return_short (ndarray): 空头收益，非平仓K线为NaN
+    long_entry (ndarray): 每根K线平掉的多头开仓位置，无对应多头时为-1
+    short_entry (ndarray): 每根K线平掉的空头开仓位置，无对应空头时为-1
+    """
+    long_entry, short_entry = _entry_positions(position)
+    # 将开仓价格向前填充到对应的平仓K线
+    long_open_price = np.where(long_entry >= 0, price[long_entry], np.nan)
+    short_open_price = np.where(short_entry >= 0, price[short_entry], np.nan)
+    long_cost, short_cost = cost, cost
+    if np.ndim(cost):
+        # 开仓和平仓的单边成本之和，无对应开仓时收益本身为NaN
+        long_cost = cost[long_entry] + cost
+        short_cost = cost[short_entry] + cost
+    return_long = ((price / long_open_price) - 1) - long_cost  # 平多仓收益 = (平仓价/开仓价-1)-成本
+    return_short = (1 - (price / short_open_price)) - short_cost  # 平空仓收益 = (1-平仓价/开仓价)-成本
+    return return_long, return_short, long_entry, short_entry
 
 def calculate_returns(df,cost):
     """
@@ -17,23 +75,13 @@ def calculate_returns(df,cost):
     返回:
     _df_pnl (DataFrame): 包含多头、空头和总体收益的DataFrame
     """
-    open_prices = {'long': None, 'short': None}
-    for i, row in df.iterrows():
-        if row['position'] == 1:
-            # 开多仓
-            open_prices['long'] = row['price']
-        elif row['position'] == -1:
-            # 开空仓
-            open_prices['short'] = row['price']
-        elif row['position'] == 0:
-            if open_prices['long'] is not None:
-                # 平多仓，计算收益 = (平仓价/开仓价-1)-成本
-                df.at[i, 'return_long'] = ((row['price'] / open_prices['long']) - 1) - cost
-                open_prices['long'] = None
-            if open_prices['short'] is not None:
-                # 平空仓，计算收益 = (1-平仓价/开仓价)-成本
-                df.at[i, 'return_short'] = (1 - (row['price'] / open_prices['short'])) - cost
-                open_prices['short'] = None
+    return_long, return_short, _, _ = _close_returns(
+        price=df['price'].to_numpy(dtype=np.float64),
+        position=df['position'].to_numpy(dtype=np.float64),
+        cost=cost
+    )
+    df['return_long'] = return_long
+    df['return_short'] = return_short
     
     # 提取收益数据并计算总收益
     _df_pnl = df.loc[:,['return_long','return_short']]    
@@ -46,7 +94,217 @@ def calculate_returns(df,cost):
 
 
 
-def calculate_returns_all(df_x,df_y,product_list,cost = 0):
+def _product_returns(price, flag, cost):
+    """
+    计算单个品种在对齐后的价格和信号序列上的收益
+    
+    参数:
+    price (ndarray): 价格序列
+    flag (ndarray): 与价格对齐的信号序列，NaN表示该时刻无信号
+    cost (float/ndarray): 交易成本，ndarray时为有信号的K线上依次的单边成本(见_event_costs)
+    
+    返回:
+    rows (ndarray): 有信号的位置
+    return_long (ndarray): 这些位置上的多头收益
+    return_short (ndarray): 这些位置上的空头收益
+    return_all (ndarray): 这些位置上的总收益，多空均无收益时为NaN
+    trades (tuple): 逐笔交易 (开仓位置, 平仓位置, 方向, 收益)，位置为对齐后序列中的位置，按平仓位置排序
+    """
+    rows = np.flatnonzero(~np.isnan(flag))
+    return_long, return_short, long_entry, short_entry = _close_returns(price[rows], flag[rows], cost)
+    long_missing, short_missing = np.isnan(return_long), np.isnan(return_short)
+    return_all = np.where(long_missing & short_missing, np.nan,
+                          np.where(long_missing, 0, return_long) + np.where(short_missing, 0, return_short))
+    
+    # 整理逐笔交易
+    is_long, is_short = long_entry >= 0, short_entry >= 0
+    entry = rows[np.concatenate((long_entry[is_long], short_entry[is_short]))]
+    exit_ = rows[np.concatenate((np.flatnonzero(is_long), np.flatnonzero(is_short)))]
+    side = np.concatenate((np.ones(is_long.sum(), dtype=np.int8), -np.ones(is_short.sum(), dtype=np.int8)))
+    ret = np.concatenate((return_long[is_long], return_short[is_short]))
+    order = np.lexsort((entry, exit_))
+    trades = (entry[order], exit_[order], side[order], ret[order])
+    return rows, return_long, return_short, return_all, trades
+
+def _build_ledger(index, price, products, trades):
+    """
+    将各品种的逐笔交易整理为交易台账
+    
+    参数:
+    index (DatetimeIndex): 对齐后的时间索引
+    price (ndarray): 对齐后的 (时间 × 品种) 价格矩阵
+    products (list): 与price各列对应的品种列表
+    trades (list): 每个品种的逐笔交易 (开仓位置, 平仓位置, 方向, 收益)
+    
+    返回:
+    DataFrame: 交易台账，每行一笔交易，列为product、side、entry_ts、exit_ts、entry_price、exit_price、ret、holding_bars
+    """
+    product_code = np.concatenate([np.full(len(t[0]), k, dtype=np.int32) for k, t in enumerate(trades)] or [np.empty(0, dtype=np.int32)])
+    entry = np.concatenate([t[0] for t in trades] or [np.empty(0, dtype=np.int64)])
+    exit_ = np.concatenate([t[1] for t in trades] or [np.empty(0, dtype=np.int64)])
+    return pd.DataFrame({
+        'product': pd.Categorical.from_codes(product_code, categories=products),
+        'side': np.concatenate([t[2] for t in trades] or [np.empty(0, dtype=np.int8)]),  # 1为多头，-1为空头
+        'entry_ts': index[entry],
+        'exit_ts': index[exit_],
+        'entry_price': price[entry, product_code],
+        'exit_price': price[exit_, product_code],
+        'ret': np.concatenate([t[3] for t in trades] or [np.empty(0)]),
+        'holding_bars': (exit_ - entry).astype(np.int32),
+    })
+
+# 盯市收益按列分块计算，控制 (时间 × 品种) 中间矩阵的内存
+_MTM_BLOCK = 16
+
+def _mtm_returns(price, flag, cost):
+    """
+    计算多品种逐K线的盯市收益
+    
+    持仓区间与calculate_returns一致: 平仓K线c对应的开仓K线e为上一次平仓之后最近的一次开仓，
+    持仓期为(e, c]。每根持仓K线的收益为 方向 × (p[k]-p[k-1]) / p[e]，在持仓期内累加恰好等于该笔交易的收益，
+    交易成本在平仓K线扣除
+    
+    参数:
+    price (ndarray): (时间 × 品种) 价格矩阵
+    flag (ndarray): 与价格对齐的 (时间 × 品种) 信号矩阵，NaN表示该时刻无信号
+    cost (float/list): 交易成本，list时为每个品种有信号的K线上依次的单边成本(见_event_costs)
+    
+    返回:
+    ret_long (ndarray): 多头逐K线收益，未持有多头时为NaN
+    ret_short (ndarray): 空头逐K线收益，未持有空头时为NaN
+    ret_all (ndarray): 总体逐K线收益，多空均未持有时为NaN
+    """
+    n, p = price.shape
+    ret_long = np.full((n, p), np.nan, order='F')
+    ret_short = np.full((n, p), np.nan, order='F')
+    ret_all = np.full((n, p), np.nan, order='F')
+    if n == 0:
+        return ret_long, ret_short, ret_all
+    
+    idx = np.arange(n)[:, None]
+    for start in range(0, p, _MTM_BLOCK):
+        cols = slice(start, min(start + _MTM_BLOCK, p))
+        price_block, flag_block = price[:, cols], flag[:, cols]
+        m = price_block.shape[1]
+        
+        # 价格向前填充后的逐K线价格变化
+        filled = np.maximum.accumulate(np.where(np.isnan(price_block), -1, idx), axis=0)
+        price_ffill = np.where(filled >= 0, price_block[np.maximum(filled, 0), np.arange(m)], np.nan)
+        change = np.vstack((np.zeros((1, m)), np.diff(price_ffill, axis=0)))
+        
+        # 每根K线之前最近的平仓位置，以及当前及之后最近的平仓位置
+        is_close = flag_block == 0
+        last_close = np.vstack((np.full((1, m), -1), np.maximum.accumulate(np.where(is_close, idx, -1), axis=0)[:-1]))
+        next_close = np.minimum.accumulate(np.where(is_close, idx, n)[::-1], axis=0)[::-1]
+        
+        if isinstance(cost, list):
+            # 本块有信号K线的键 (列 × n + 行)，按品种、时间递增，与各品种的成本数组依次对应
+            event_cols, event_rows = np.nonzero(~np.isnan(flag_block.T))
+            event_keys = event_cols * n + event_rows
+            event_cost = np.concatenate(cost[cols])
+        
+        held_any = np.zeros((n, m), dtype=bool)
+        all_block = np.zeros((n, m))
+        for side, out in ((1, ret_long), (-1, ret_short)):
+            is_open = flag_block == side
+            last_open = np.vstack((np.full((1, m), -1), np.maximum.accumulate(np.where(is_open, idx, -1), axis=0)[:-1]))
+            next_open = np.minimum.accumulate(np.where(is_open, idx, n)[::-1], axis=0)[::-1]
+            # 持仓: 之前最近的开仓晚于之前最近的平仓，且之后先遇到平仓再遇到新的开仓
+            held = (last_open > last_close) & (next_close < next_open) & (next_close < n)
+            entry_price = np.where(held, price_block[np.maximum(last_open, 0), np.arange(m)], np.nan)
+            ret = side * change / entry_price
+            trade_cost = cost
+            if isinstance(cost, list):
+                # 按 (品种, 时间) 在有信号K线的成本中查找开仓和平仓K线的单边成本
+                close_rows, close_cols = np.nonzero(held & is_close)
+                entry = np.searchsorted(event_keys, close_cols * n + last_open[close_rows, close_cols])
+                trade_cost = event_cost[entry] + event_cost[np.searchsorted(event_keys, close_cols * n + close_rows)]
+            ret[held & is_close] -= trade_cost  # 平仓K线扣除交易成本
+            out[:, cols] = np.where(held, ret, np.nan)
+            all_block += np.where(held & ~np.isnan(ret), ret, 0)
+            held_any |= held & ~np.isnan(ret)
+        ret_all[:, cols] = np.where(held_any, all_block, np.nan)
+    return ret_long, ret_short, ret_all
+
+# 工作进程中共享内存上的价格和信号矩阵，由_init_returns_worker设置
+_RETURNS_STATE = {}
+
+def _init_returns_worker(price_spec, flag_spec, cost):
+    """
+    初始化工作进程，挂载共享内存中的价格和信号矩阵
+    """
+    shm_price, price = from_shared_array(price_spec)
+    shm_flag, flag = from_shared_array(flag_spec)
+    _RETURNS_STATE.update(shm=(shm_price, shm_flag), price=price, flag=flag, cost=cost)
+
+def _returns_worker(c):
+    """
+    在工作进程中计算第c个品种的收益，只读取该品种的价格列和信号列
+    """
+    state = _RETURNS_STATE
+    cost = state['cost'][c] if isinstance(state['cost'], list) else state['cost']
+    return _product_returns(state['price'][:, c], state['flag'][:, c], cost)
+
+def _parallel_returns(price, flag, cost, n_jobs, progress):
+    """
+    多进程计算各品种收益，价格和信号矩阵通过共享内存传给工作进程
+    
+    参数:
+    price (ndarray): (时间 × 品种) 价格矩阵
+    flag (ndarray): 与价格对齐的 (时间 × 品种) 信号矩阵
+    cost (float/list): 交易成本，list时为每个品种有信号的K线上的单边成本，只包含成交处，直接随初始化参数传递
+    n_jobs (int): 进程数
+    progress (bool): 是否显示进度条
+    
+    返回:
+    list: 按品种顺序排列的_product_returns结果
+    """
+    shm_price, price_spec = to_shared_array(price)
+    shm_flag, flag_spec = to_shared_array(flag)
+    shms = [shm_price, shm_flag]
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_returns_worker, initargs=(price_spec, flag_spec, cost)) as executor:
+            # map按提交顺序返回结果，保证列顺序确定
+            return list(tqdm(executor.map(_returns_worker, range(price.shape[1])), total=price.shape[1], disable=not progress))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+def _event_costs(cost, products, price, flag, index, df_amt=None):
+    """
+    计算CostModel在每个品种有信号的K线上的单边成本
+    
+    参数:
+    cost (CostModel): 成本模型
+    products (list): 与price各列对应的品种列表
+    price (ndarray): 对齐后的 (时间 × 品种) 价格矩阵
+    flag (ndarray): 与价格对齐的 (时间 × 品种) 信号矩阵，NaN表示该时刻无信号
+    index (DatetimeIndex): 对齐后的时间索引
+    df_amt (DataFrame): 成交额数据，仅在包含冲击成本时使用
+    
+    返回:
+    list: 每个品种一个一维数组，依次为该品种有信号的K线上的单边成本
+    """
+    codes, rows = np.nonzero(~np.isnan(flag.T))  # 按品种、时间排序
+    bounds = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(products)))]  # 每个品种在事件中的起止位置
+    amt = None
+    if cost.needs_amount(products):
+        if df_amt is None:
+            warnings.warn("df_amt is not provided, the impact cost is ignored.")
+        else:
+            # 只取成交K线上的成交额
+            amt = np.full(len(rows), np.nan)
+            amt_rows = df_amt.index.get_indexer(index[rows])
+            for k, product in enumerate(products):
+                if product in df_amt.columns:
+                    sel = slice(bounds[k], bounds[k + 1])
+                    found = amt_rows[sel] >= 0
+                    amt[sel][found] = df_amt[product].to_numpy(dtype=np.float64)[amt_rows[sel][found]]
+    values = cost.side_cost(products, price[rows, codes], amt, codes=codes)
+    return [values[bounds[k]:bounds[k + 1]] for k in range(len(products))]
+
+def calculate_returns_all(df_x,df_y,product_list,cost = 0,progress = True,n_jobs = 1,return_ledger = False,pnl_mode = 'close',df_amt = None):
     """
     计算多品种的总体收益
     
@@ -54,140 +312,348 @@ def calculate_returns_all(df_x,df_y,product_list,cost = 0):
     df_x (DataFrame): 交易信号数据
     df_y (DataFrame): 价格数据
     product_list (list): 品种列表
-    cost (float): 交易成本，默认为0
+    cost (float/CostModel): 交易成本，默认为0。float时每笔交易扣除固定成本；CostModel时按品种计算开仓和平仓K线的单边成本，
+                            每笔交易扣除两者之和，成本只在有信号的K线上计算
+    progress (bool): 是否显示进度条，默认为True
+    n_jobs (int): 并行进程数，1为串行，-1为使用全部CPU核心，默认为1。
+                  并行时价格和信号矩阵放入共享内存，各进程只读取所负责品种的列
+    return_ledger (bool): 是否同时返回逐笔交易台账，默认为False
+    pnl_mode (str): 收益记账方式，默认为'close'
+                    - 'close': 收益记在平仓K线上，每个非NaN值对应一笔交易
+                    - 'mtm': 逐K线盯市，持仓期间每根K线记录 方向 × 价格变化 / 开仓价，成本在平仓K线扣除，
+                             每笔交易的逐K线收益之和等于'close'模式下的收益。整个面板一次向量化计算，不使用n_jobs
+    df_amt (DataFrame): 成交额数据，仅在CostModel包含冲击成本时使用，默认为None
     
     返回:
     _df_ret_all (DataFrame): 所有品种的总体收益
     _df_ret_long (DataFrame): 所有品种的多头收益
     _df_ret_short (DataFrame): 所有品种的空头收益
+    ledger (DataFrame): 逐笔交易台账，仅在return_ledger=True时返回，列为product、side、entry_ts、exit_ts、
+                        entry_price、exit_price、ret、holding_bars
     """
-    _df_ret_long = pd.DataFrame(index=df_y.index)
-    _df_ret_short = pd.DataFrame(index=df_y.index)
-    _df_ret_all = pd.DataFrame(index=df_y.index)
-    
-    # 遍历每个品种计算收益
-    for product in tqdm(product_list):
-        # 获取价格数据
+    # 筛选价格和信号数据都存在的品种 - 信号列兼容直接使用产品名或带_flag后缀
+    calculated, flag_columns = [], []
+    for product in product_list:
         if product not in df_y.columns:
             warnings.warn(f"产品 {product} 在价格数据中不存在，跳过")
             continue
-            
-        base_price = df_y.loc[:,[product]]
-        
-        # 获取信号数据 - 修复：兼容直接使用产品名或带_flag后缀
         flag_column = f"{product}_flag"
         if flag_column in df_x.columns:
-            factor_flag = df_x.loc[:,[flag_column]].dropna()
+            flag_columns.append(flag_column)
         elif product in df_x.columns:
-            factor_flag = df_x.loc[:,[product]].dropna()
+            flag_columns.append(product)
         else:
             warnings.warn(f"产品 {product} 的信号数据不存在 (检查了 '{product}' 和 '{flag_column}')，跳过")
             continue
-        
-        # 过滤日期
-        base_price = base_price[base_price.index >= '2018-01-01']
-        base_price.columns = ['price']
-        factor_flag.columns = ['position']
-        
-        # 确保索引名称一致，以便合并
-        if base_price.index.name != factor_flag.index.name:
-            # 如果索引名称不同，让我们确保至少一个为'datetime'
-            if base_price.index.name != 'datetime':
-                base_price.index.name = 'datetime'
-            if factor_flag.index.name != 'datetime':
-                factor_flag.index.name = 'datetime'
-        
-        # 合并价格和信号数据
-        try:
-            _df = pd.merge(base_price, factor_flag, left_index=True, right_index=True)
-            # _df = pd.merge(base_price, factor_flag, on='datetime', how='right') # 旧代码
-        except Exception as e:
-            warnings.warn(f"合并产品 {product} 的价格和信号数据时出错: {str(e)}，尝试重置索引名称")
-            # 如果合并失败，尝试重置索引名称后再次合并
-            base_price_reset = base_price.reset_index()
-            factor_flag_reset = factor_flag.reset_index()
-            _df = pd.merge(base_price_reset, factor_flag_reset, on=base_price_reset.columns[0], how='right')
-            _df = _df.set_index(base_price_reset.columns[0])
-        
-        _df.sort_index(inplace = True)
+        calculated.append(product)
+    
+    # 过滤日期并按时间排序，将信号对齐到价格的时间索引上
+    base_price = df_y.loc[df_y.index >= '2018-01-01', calculated].sort_index(kind='stable')
+    factor_flag = df_x.loc[:, flag_columns].reindex(base_price.index)
+    price = np.asfortranarray(base_price.to_numpy(dtype=np.float64))
+    flag = np.asfortranarray(factor_flag.to_numpy(dtype=np.float64))
+    out_rows = df_y.index.get_indexer(base_price.index)  # 对齐后的每一行在df_y中的位置
+    
+    if isinstance(cost, CostModel):
+        # 成本只在有信号的K线上计算，不构建 (时间 × 品种) 的成本和成交额矩阵
+        cost = _event_costs(cost, calculated, price, flag, base_price.index, df_amt)
+    
+    # 预分配 (时间 × 品种) 结果矩阵，按列写入后一次性构建DataFrame
+    shape = (len(df_y.index), len(calculated))
+    ret_long = np.full(shape, np.nan, order='F')
+    ret_short = np.full(shape, np.nan, order='F')
+    ret_all = np.full(shape, np.nan, order='F')
+    
+    if pnl_mode not in ('close', 'mtm'):
+        raise ValueError(f"Unsupported pnl_mode: {pnl_mode}")
+    
+    results = None
+    if pnl_mode == 'close' or return_ledger:
+        n_jobs = min(resolve_n_jobs(n_jobs), max(len(calculated), 1))
+        if n_jobs == 1:
+            # 遍历每个品种计算收益
+            results = [_product_returns(price[:, k], flag[:, k], cost[k] if isinstance(cost, list) else cost)
+                       for k in tqdm(range(len(calculated)), disable=not progress)]
+        else:
+            results = _parallel_returns(price, flag, cost, n_jobs, progress)
+    
+    if pnl_mode == 'mtm':
+        # 盯市收益在对齐后的时间轴上整体计算，再写入结果矩阵
+        mtm_long, mtm_short, mtm_all = _mtm_returns(price, flag, cost)
+        ret_long[out_rows] = mtm_long
+        ret_short[out_rows] = mtm_short
+        ret_all[out_rows] = mtm_all
+    else:
+        # 将收益写入结果矩阵的对应列
+        for k, (rows, return_long, return_short, return_all, _) in enumerate(results):
+            rows = out_rows[rows]
+            ret_long[rows, k] = return_long
+            ret_short[rows, k] = return_short
+            ret_all[rows, k] = return_all
+    
+    _df_ret_long = pd.DataFrame(ret_long, index=df_y.index, columns=[f'{product}_long' for product in calculated])
+    _df_ret_short = pd.DataFrame(ret_short, index=df_y.index, columns=[f'{product}_short' for product in calculated])
+    _df_ret_all = pd.DataFrame(ret_all, index=df_y.index, columns=[f'{product}_all' for product in calculated])
+    
+    if return_ledger:
+        ledger = _build_ledger(base_price.index, price, calculated, [result[4] for result in results])
+        return _df_ret_all,_df_ret_long,_df_ret_short,ledger
+    return _df_ret_all,_df_ret_long,_df_ret_short
+
+
+def _side_cost_matrix(cost, products, price, index, df_amt=None):
+    """
+    计算CostModel在给定K线上的单边成本矩阵，cost不是CostModel时返回None
+    """
+    if not isinstance(cost, CostModel):
+        return None
+    amt = None
+    if df_amt is not None and cost.needs_amount(products):
+        amt = df_amt.reindex(index=index, columns=products).to_numpy(dtype=np.float64)
+    return cost.side_cost(products, price, amt)
+
+def _carry_events(items, last_ts):
+    """
+    保留之后仍会影响收益的交易标志
+    
+    最后一次平仓(最后一根已处理K线除外，它可能被重新计算)之前的交易已经结算，之后的开仓、
+    最后一根已处理K线和价格尚未到达的交易标志需要与新的交易标志一起计算
+    
+    参数:
+    items (list): 按时间排序的 (时间, 标志, 报价)，报价为 (价格, 单边成本, 对齐位置)，价格尚未到达时为None
+    last_ts (Timestamp): 最后一根已处理K线的时间
+    
+    返回:
+    list: 需要保留的 (时间, 标志, 报价)
+    """
+    closes = [i for i, (ts, value, q) in enumerate(items) if q is not None and ts != last_ts and value == 0]
+    start = closes[-1] + 1 if closes else 0
+    return [(ts, value, q) for ts, value, q in items[start:] if q is None or ts == last_ts or not np.isnan(value)]
+
+def _stream_return_state(df_y, flag, flag_state, products, cost, df_amt=None):
+    """
+    整理增量计算收益所需的状态
+    
+    参数:
+    df_y (DataFrame): 生成收益时使用的价格数据
+    flag (DataFrame): 与收益对应的交易标志，列名为 PRODUCT_flag
+    flag_state (dict): 与收益对应的交易标志状态，见trade_boll._stream_flag_state
+    products (list): 已计算收益的品种列表
+    cost (float/CostModel): 交易成本
+    df_amt (DataFrame): 成交额数据，仅在CostModel包含冲击成本时使用
+    
+    返回:
+    dict: 包括n_rows(对齐后的价格行数)、frames_end(收益序列的最后时间)、tail(信号截止时间之后的价格)，
+          以及每个品种之后仍会影响收益的交易标志events(见_carry_events)
+    """
+    base = df_y.loc[df_y.index >= '2018-01-01', products].sort_index(kind='stable')
+    cutoff = flag_state['cutoff']
+    frames_end = df_y.index.max() if len(df_y) else None
+    
+    bars = {}
+    for k, product in enumerate(products):
+        last_ts = flag_state['products'][product]['last_ts']
+        col = flag[f'{product}_flag']
+        col = col[col.notna().to_numpy() | (col.index == last_ts)]
+        if last_ts is not None and last_ts not in col.index:
+            col = pd.concat([col, pd.Series([np.nan], index=[last_ts])])
+        rows = base.index.get_indexer(col.index)
+        unpriced = col.index > frames_end if frames_end is not None else np.ones(len(col), dtype=bool)
+        # 价格数据中不存在的K线不参与计算，与calculate_returns_all一致
+        items = [(ts, value, row if row >= 0 else None) for ts, value, row, late in zip(col.index, col.to_numpy(), rows, unpriced)
+                 if row >= 0 or late]
+        kept = []
+        for ts, value, row in _carry_events(items, last_ts):
+            q = None
+            if row is not None:
+                price = base[[product]].iloc[[row]].to_numpy(dtype=np.float64)
+                side_cost = _side_cost_matrix(cost, [product], price, [ts], df_amt)
+                q = (price[0, 0], None if side_cost is None else side_cost[0, 0], row)
+            kept.append((ts, value, q))
+        bars[product] = {'events': kept}
+    tail = base[base.index > cutoff] if cutoff is not None else base
+    return {'n_rows': len(base), 'frames_end': frames_end, 'tail': tail, 'products': bars}
 
-        # 初始化收益列
-        _df['return_long'] = np.nan
-        _df['return_short'] = np.nan
-        # _df.columns = ['price', 'position', 'return_long', 'return_short']
+def _stream_returns(state, new_flag_state, events, df_y_new, products, cost, df_amt=None):
+    """
+    在已有状态上计算新交易标志和新价格带来的收益变化
+    
+    每个品种把保留的交易标志(见_carry_events)和新的交易标志拼成一段短序列计算收益，
+    之前已经结算的收益和交易不受新数据影响；价格晚于信号到达时，交易标志保留到价格到达后再计算
+    
+    参数:
+    state (dict): _stream_return_state或上一次_stream_returns返回的状态
+    new_flag_state (dict): 更新后的交易标志状态
+    events (dict): trade_boll._stream_flags返回的 {品种: 交易标志Series}
+    df_y_new (DataFrame): 追加到收益序列末尾的新价格数据
+    products (list): 已计算收益的品种列表
+    cost (float/CostModel): 交易成本
+    df_amt (DataFrame): 成交额数据，仅在CostModel包含冲击成本时使用
+    
+    返回:
+    ret_long, ret_short, ret_all (ndarray): 新价格数据每一行的 (时间 × 品种) 收益
+    restated (list): 已有收益序列中需要改写的 (时间, 品种位置, 多头收益, 空头收益, 总收益)
+    trades (DataFrame): 新平仓的交易，列与calculate_returns_all的交易台账一致
+    new_state (dict): 更新后的状态
+    """
+    base_new = df_y_new.loc[df_y_new.index >= '2018-01-01'].reindex(columns=products).sort_index(kind='stable')
+    ext = pd.concat([state['tail'], base_new])
+    ext_price = ext.to_numpy(dtype=np.float64)
+    ext_cost = _side_cost_matrix(cost, products, ext_price, ext.index, df_amt)
+    ext_rows = state['n_rows'] - len(state['tail']) + np.arange(len(ext))
+    frames_end = state['frames_end']
+    new_frames_end = df_y_new.index.max() if len(df_y_new) else frames_end
+    
+    shape = (len(df_y_new), len(products))
+    ret_long, ret_short, ret_all = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+    restated, trades = [], []
+    
+    def quote(k, ts):
+        # 取新价格中某根K线的 (价格, 单边成本, 对齐位置)，不存在时为None
+        i = ext.index.get_indexer([ts])[0]
+        if i < 0:
+            return None
+        return ext_price[i, k], None if ext_cost is None else ext_cost[i, k], ext_rows[i]
+    
+    new_bars = {}
+    for k, product in enumerate(products):
+        kept = state['products'][product]['events']
+        seq = events.get(product)
+        if seq is None and all(q is not None for _, _, q in kept):
+            new_bars[product] = state['products'][product]
+            continue
+        last_ts = new_flag_state['products'][product]['last_ts']
         
-        # 计算收益
-        _df_ret = calculate_returns(df=_df, cost=cost)
-
-        # 将收益存入结果DataFrame
-        _df_ret_long[f'{product}_long'] = np.nan
-        _df_ret_short[f'{product}_short'] = np.nan
-        _df_ret_all[f'{product}_all'] = np.nan
-        _df_ret_long.loc[_df_ret.index, f'{product}_long'] = _df_ret['return_long']
-        _df_ret_short.loc[_df_ret.index, f'{product}_short'] = _df_ret['return_short']
-        _df_ret_all.loc[_df_ret.index, f'{product}_all'] = _df_ret['return']
+        # {时间: (标志, 报价, 是否需要写入收益)}，价格刚到达的标志和新的标志需要写入
+        merged = {ts: (value, q, q is None) for ts, value, q in kept}
+        if seq is not None:
+            for ts, value in seq.items():
+                # 最后一根已处理K线即使不再有标志也保留，以撤销之前的强制平仓收益
+                if not np.isnan(value) or ts in merged or ts == last_ts:
+                    merged[ts] = (value, merged[ts][1] if ts in merged else None, True)
+        items = []
+        for ts in sorted(merged):
+            value, q, write = merged[ts]
+            if q is None:
+                q = quote(k, ts)
+                if q is None and new_frames_end is not None and ts <= new_frames_end:
+                    continue  # 价格数据中不存在该K线
+            items.append((ts, value, q, write))
         
-    return _df_ret_all,_df_ret_long,_df_ret_short
+        priced = [item for item in items if item[2] is not None]
+        if any(item[3] for item in priced):
+            stamps = [item[0] for item in priced]
+            price = np.array([item[2][0] for item in priced])
+            rows = np.array([item[2][2] for item in priced])
+            seq_cost = np.array([item[2][1] for item in priced]) if ext_cost is not None else cost
+            return_long, return_short, long_entry, short_entry = _close_returns(price, np.array([item[1] for item in priced], dtype=np.float64), seq_cost)
+            long_missing, short_missing = np.isnan(return_long), np.isnan(return_short)
+            return_all = np.where(long_missing & short_missing, np.nan,
+                                  np.where(long_missing, 0, return_long) + np.where(short_missing, 0, return_short))
+            for i, (ts, _, _, write) in enumerate(priced):
+                if not write:
+                    continue
+                if frames_end is not None and ts <= frames_end:
+                    restated.append((ts, k, return_long[i], return_short[i], return_all[i]))
+                else:
+                    row = df_y_new.index.get_loc(ts)
+                    ret_long[row, k], ret_short[row, k], ret_all[row, k] = return_long[i], return_short[i], return_all[i]
+                for side, entry, ret in ((1, long_entry[i], return_long[i]), (-1, short_entry[i], return_short[i])):
+                    if entry >= 0:
+                        trades.append((k, side, stamps[entry], ts, price[entry], price[i], ret, rows[i] - rows[entry]))
+        new_bars[product] = {'events': _carry_events([item[:3] for item in items], last_ts)}
+    
+    # 与calculate_returns_all的交易台账格式一致，每个品种内按平仓、开仓时间排序
+    trades.sort(key=lambda t: (t[0], t[3], t[2]))
+    columns = list(zip(*trades)) if trades else [[] for _ in range(8)]
+    ledger = pd.DataFrame({
+        'product': pd.Categorical.from_codes(np.asarray(columns[0], dtype=np.int32), categories=products),
+        'side': np.asarray(columns[1], dtype=np.int8),
+        'entry_ts': pd.DatetimeIndex(columns[2]),
+        'exit_ts': pd.DatetimeIndex(columns[3]),
+        'entry_price': np.asarray(columns[4], dtype=np.float64),
+        'exit_price': np.asarray(columns[5], dtype=np.float64),
+        'ret': np.asarray(columns[6], dtype=np.float64),
+        'holding_bars': np.asarray(columns[7], dtype=np.int32),
+    })
+    
+    cutoff = new_flag_state['cutoff']
+    new_state = {
+        'n_rows': state['n_rows'] + len(base_new),
+        'frames_end': new_frames_end,
+        'tail': ext[ext.index > cutoff] if cutoff is not None else ext,
+        'products': new_bars,
+    }
+    return ret_long, ret_short, ret_all, restated, ledger, new_state
 
+def _fold_returns(price, entry_rows, fold):
+    """
+    计算开仓位置之后每个周期的收益贡献
+    
+    参数:
+    price (ndarray): 去除NaN后的价格序列
+    entry_rows (ndarray): 开仓位置
+    fold (int): 周期数
+    
+    返回:
+    ndarray: 长度为fold，第i个元素为各开仓位置第i+1个周期收益 (p[r+i+1]-p[r+i])/p[r] 的和
+    """
+    if len(entry_rows) == 0:
+        return np.zeros(fold)
+    # 价格差序列末尾补NaN，滑动窗口的第r行即为位置r之后fold个周期的价格变化
+    diff = np.concatenate((np.diff(price), np.full(fold, np.nan)))
+    windows = sliding_window_view(diff, fold)
+    forward = windows[entry_rows] / price[entry_rows, None]  # (开仓次数 × 周期数) 的前向收益矩阵
+    return np.nansum(forward, axis=0)
 
-def calculate_returns_folds(df_x,df_y,product_list,fold = 24):
+def calculate_returns_folds(df_x,df_y,product_list,fold = 24,ledger = None):
     """
     计算不同持仓周期的收益分布
     
     参数:
-    df_x (DataFrame): 交易信号数据
+    df_x (DataFrame): 交易信号数据，信号列兼容直接使用产品名或带_flag后缀；提供ledger时可为None
     df_y (DataFrame): 价格数据
     product_list (list): 品种列表
     fold (int): 分析的周期数，默认为24
+    ledger (DataFrame): calculate_returns_all(return_ledger=True)返回的交易台账，
+                        提供时直接使用台账中的开仓时刻，默认为None
     
     返回:
     df_fold (DataFrame): 不同周期的收益贡献分布
     """
-    long_fold = pd.DataFrame()
-    long_fold.index.name = 'fold_num'
-    short_fold = pd.DataFrame()
-    short_fold.index.name = 'fold_num'
-    df_y = df_y.sort_index()
+    df_y = df_y if df_y.index.is_monotonic_increasing else df_y.sort_index(kind='stable')
+    long_fold, short_fold = [np.zeros(fold)], [np.zeros(fold)]
     
     # 遍历每个品种
     for product in product_list:
-        base_data = df_y.loc[:,[product]].dropna()
-
-        # 计算每个周期的收益率
-        for i in range(1,fold+1):
-            base_data[f'fold_{i}'] = (base_data[product].shift(-i) - base_data[product].shift(-i+1))/base_data[product]
-        _fold_data = base_data.loc[:,[f'fold_{i}' for i in range(1,fold+1)]]
-
-        # 分别计算多头和空头持仓的周期收益
-        _f = df_x.loc[:,[product]]
-        _f_long = _fold_data.loc[_f[_f[_f.columns[0]] == 1].index,:]  # 多头开仓点的周期收益
-        _f_short = _fold_data.loc[_f[_f[_f.columns[0]] == -1].index,:]  # 空头开仓点的周期收益
+        base_price = df_y[product].dropna()
+        price = base_price.to_numpy(dtype=np.float64)
         
-        # 计算每个周期的累计收益
-        _t_long = pd.DataFrame(_f_long.sum())
-        _t_short = pd.DataFrame(_f_short.sum()) 
-        _t_short = -_t_short  # 空头收益取负
-        _t_long.index.name = 'fold_num'
-        _t_long.columns = [product]
-        _t_short.index.name = 'fold_num'
-        _t_short.columns = [product]
+        # 多头和空头的开仓时刻
+        if ledger is not None:
+            trades = ledger[ledger['product'] == product]
+            long_ts = trades.loc[trades['side'] == 1, 'entry_ts']
+            short_ts = trades.loc[trades['side'] == -1, 'entry_ts']
+        else:
+            column = f"{product}_flag" if f"{product}_flag" in df_x.columns else product
+            _f = df_x[column]
+            long_ts, short_ts = _f.index[_f == 1], _f.index[_f == -1]
+        long_rows = base_price.index.get_indexer(long_ts)
+        short_rows = base_price.index.get_indexer(short_ts)
         
-        # 合并结果
-        long_fold = pd.merge(long_fold, _t_long, on = 'fold_num',how = 'outer')
-        short_fold = pd.merge(short_fold, _t_short, on = 'fold_num',how = 'outer')
+        # 分别计算多头和空头开仓点的周期收益，空头收益取负
+        long_fold.append(_fold_returns(price, long_rows[long_rows >= 0], fold))
+        short_fold.append(-_fold_returns(price, short_rows[short_rows >= 0], fold))
     
     # 计算多空总收益
-    df_fold = pd.concat([long_fold.sum(axis = 1),short_fold.sum(axis = 1)],axis=1)
-    df_fold.columns = ['long_fold','short_fold']
+    df_fold = pd.DataFrame({
+        'long_fold': np.vstack(long_fold).sum(axis=0),
+        'short_fold': np.vstack(short_fold).sum(axis=0),
+    }, index=np.arange(1, fold + 1))
     df_fold['all_fold'] = df_fold.sum(axis = 1)
     
     # 归一化收益分布
     df_fold = df_fold/abs(df_fold).sum()
     df_fold = round(df_fold * 100, 1)  # 转为百分比
     
-    # 整理索引
-    df_fold.index = [j.split('_')[1] for j in df_fold.index]
-    df_fold.index = df_fold.index.astype(int)
-    df_fold = df_fold.sort_index()
-    
-    return df_fold
\ No newline at end of file
+    return df_fold
@@ -1,10 +1,12 @@
 import pandas as pd
 import numpy as np
 import os
+import re
+import datetime
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.io as pio
-from plotly.offline import iplot
+from plotly.offline import iplot, get_plotlyjs
 import warnings
 
 # 新的qlib风格配置
@@ -60,8 +62,85 @@ def apply_qlib_style(fig):
     )
     return fig
 
-def save_figure_with_template(fig, filename, title):
-    """使用自定义HTML模板保存图表"""
+# 多个HTML报告共用的plotly.js文件名
+PLOTLYJS_FILENAME = 'plotly.min.js'
+
+def write_plotlyjs(directory):
+    """
+    在directory下写出当前plotly版本对应的plotly.js，供多个HTML报告共用；文件已存在且内容一致时不重复写出
+    
+    参数:
+    directory (str): 目录
+    
+    返回:
+    str: plotly.js文件路径
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PLOTLYJS_FILENAME)
+    bundle = get_plotlyjs().encode('utf-8')
+    if not (os.path.exists(path) and os.path.getsize(path) == len(bundle)):
+        with open(path, 'wb') as f:
+            f.write(bundle)
+    return path
+
+def _as_milliseconds(values):
+    """
+    时间序列转换为毫秒时间戳(float64)，None/NaT为NaN；不是时间时返回None
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind != 'M':
+        if arr.dtype != object or not any(isinstance(v, (datetime.datetime, np.datetime64)) for v in arr):
+            return None
+    dates = pd.DatetimeIndex(pd.to_datetime(arr))
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)  # 与直接写出时间字符串一样按当地时间显示
+    return np.where(dates.isna(), np.nan, dates.asi8 / 1e6)
+
+def _binary_figure(fig):
+    """
+    复制图表，把各轨迹的x/y转换为numpy数组，to_json时写成base64编码的二进制类型数组而不是十进制JSON列表
+    
+    时间x转换为毫秒时间戳(float64)，同时把x轴设为date类型；数值y转换为float32；None/NaT为NaN
+    
+    参数:
+    fig (go.Figure): 图表
+    
+    返回:
+    go.Figure: 转换后的图表副本
+    """
+    fig = go.Figure(fig)
+    has_dates = False
+    for trace in fig.data:
+        x, y = getattr(trace, 'x', None), getattr(trace, 'y', None)
+        if x is not None:
+            ms = _as_milliseconds(x)
+            if ms is not None:
+                trace.x = ms
+                has_dates = True
+        if y is not None:
+            try:
+                trace.y = np.asarray(y, dtype=np.float64).astype(np.float32)
+            except (TypeError, ValueError):
+                pass  # 非数值数据保持原样
+    if has_dates:
+        fig.update_xaxes(type='date')
+    return fig
+
+def save_figure_with_template(fig, filename, title, plotlyjs_path=None):
+    """
+    使用自定义HTML模板保存图表
+    
+    参数:
+    fig (go.Figure): 图表
+    filename (str): HTML文件路径
+    title (str): 标题
+    plotlyjs_path (str): 共享的plotly.js文件路径(见write_plotlyjs)，默认None使用模板中的CDN地址；
+                         指定时HTML以相对路径引用该文件，图表数据以base64二进制类型数组写出
+    """
+    plotlyjs_src = None
+    if plotlyjs_path is not None:
+        plotlyjs_src = os.path.relpath(os.path.abspath(plotlyjs_path), os.path.dirname(os.path.abspath(filename))).replace(os.sep, '/')
+        fig = _binary_figure(fig)
     script_dir = os.path.dirname(os.path.abspath(__file__))
     template_path = os.path.join(script_dir, "template.html")
     
@@ -70,7 +149,7 @@ def save_figure_with_template(fig, filename, title):
         # For now, let's assume template.html exists and is correctly formatted
         print(f"Warning: HTML template file not found at {template_path}")
         # Fallback to simple HTML export if template is missing
-        pio.write_html(fig, filename, auto_open=False)
+        pio.write_html(fig, filename, auto_open=False, include_plotlyjs=plotlyjs_src if plotlyjs_src else True)
         print(f"保存交互式图表到 (fallback): {filename}")
         return
 
@@ -91,24 +170,169 @@ def save_figure_with_template(fig, filename, title):
     }});
     """
     html_content = template.replace('// PLOT_DATA将在生成HTML时被替换为实际的图表数据', js_code)
+    if plotlyjs_src:
+        html_content = re.sub(r'<script src="[^"]*plotly[^"]*\.js"></script>', f'<script src="{plotlyjs_src}"></script>', html_content, count=1)
     
     with open(filename, 'w', encoding='utf-8') as f:
         f.write(html_content)
     print(f"保存交互式图表到: {filename}")
 
+# 每条曲线默认保留的最大点数
+DEFAULT_MAX_POINTS = 5000
+# renderer='webgl'时，降采样前长度超过该阈值的序列改用Scattergl绘制
+WEBGL_THRESHOLD = 20000
+RENDERERS = ('svg', 'webgl')
+# 价格图y轴范围两端的留白占价格范围的比例，持仓区间覆盖整个y轴范围
+PRICE_RANGE_PAD = 0.05
+
+# 序列长度不超过max_points的该倍数时不降采样: 点数减少有限，不值得降采样的开销和形状损失
+DOWNSAMPLE_MIN_RATIO = 2
+# 向量化LTTB以上一轮选中点为左侧点重新选点的轮数
+LTTB_REFINE = 3
+
+def _bucket_argmax(px, py, anchor_x, anchor_y, next_x, next_y):
+    """
+    在每个桶内选出与左端点、右端点构成三角形面积最大的点，所有桶一次计算
+    
+    参数:
+    px, py (ndarray): (桶数 × 最大桶长) 的点坐标，较短的桶用桶内第一个点补齐
+    anchor_x, anchor_y (ndarray): 每个桶的左端点
+    next_x, next_y (ndarray): 每个桶的右端点
+    
+    返回:
+    ndarray: 每个桶选中点在桶内的偏移
+    """
+    # 三角形面积的两倍 |(xa-xc)(y-ya) - (xa-x)(yc-ya)| = |u*y + v*x - w|，对每个桶是点坐标的线性函数
+    u, v = anchor_x - next_x, next_y - anchor_y
+    area = py * u[:, None]
+    area += px * v[:, None]
+    area -= (u * anchor_y + v * anchor_x)[:, None]
+    np.abs(area, out=area)
+    return np.argmax(area, axis=1)  # 补齐的点与桶内第一个点相同，并列时argmax取第一个
+
+def _lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets降采样，返回保留点的位置
+    
+    首尾两点始终保留，其余点均分为n_out-2个桶，每个桶保留与左侧点、下一个桶均值点构成三角形面积最大的点，
+    能保留曲线的峰谷形状。原始LTTB以上一个桶的选中点为左侧点，各桶只能依次计算；这里先以上一个桶的均值点为左侧点选点，
+    再以上一轮选出的点为左侧点重新选LTTB_REFINE轮，每一轮都对所有桶一次向量化计算，结果逐轮接近原始LTTB
+    
+    参数:
+    x (ndarray): 横坐标，float
+    y (ndarray): 纵坐标，float，不含NaN
+    n_out (int): 保留点数
+    
+    返回:
+    ndarray: 按顺序排列的保留点位置
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # 首点、n_out-2个中间桶、尾点依次作为一段，每段非空
+    bounds = np.r_[0, (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64) + 1, n]
+    sizes = np.diff(bounds)
+    mean_x, mean_y = np.add.reduceat(x, bounds[:-1]) / sizes, np.add.reduceat(y, bounds[:-1]) / sizes
+    
+    # 中间各桶按最大桶长补齐为 (桶数 × 最大桶长) 的矩阵，各轮共用
+    starts, lengths = bounds[1:-2], sizes[1:-1]
+    offset = np.arange(lengths.max())
+    pos = np.where(offset >= lengths[:, None], starts[:, None], starts[:, None] + offset)
+    px, py = x[pos], y[pos]
+    
+    picked = starts + _bucket_argmax(px, py, mean_x[:-2], mean_y[:-2], mean_x[2:], mean_y[2:])
+    for _ in range(LTTB_REFINE):
+        left = np.r_[0, picked[:-1]]
+        picked = starts + _bucket_argmax(px, py, x[left], y[left], mean_x[2:], mean_y[2:])
+    return np.r_[0, picked, n - 1]
+
+def _downsample_series(series, max_points, keep=None):
+    """
+    用LTTB把序列降采样到约max_points个点
+    
+    参数:
+    series (Series): 以时间为索引的数值序列
+    max_points (int): 保留的最大点数(不含keep)，为None或0时不降采样；序列长度不超过max_points的DOWNSAMPLE_MIN_RATIO倍时也不降采样
+    keep (Index): 始终保留的时间点，例如开平仓K线
+    
+    返回:
+    Series: 降采样后的序列，始终包含首尾点和全局最高、最低点，NaN点不参与降采样
+    """
+    if not max_points or len(series) <= DOWNSAMPLE_MIN_RATIO * max_points:
+        return series
+    y = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    index = series.index
+    x = (index.asi8 - index.asi8[0]).astype(np.float64) if isinstance(index, pd.DatetimeIndex) else np.arange(len(series), dtype=np.float64)
+    rows = valid[_lttb_indices(x[valid], y[valid], max_points)]
+    if len(valid):
+        # LTTB不保证全局最高点和最低点入选，单独补上
+        rows = np.union1d(rows, valid[[np.argmin(y[valid]), np.argmax(y[valid])]])
+    if keep is not None and len(keep):
+        keep_rows = index.get_indexer(keep)
+        rows = np.union1d(rows, keep_rows[keep_rows >= 0])
+    return series.iloc[rows]
+
+def _region_trace(regions, y_low, y_high, fillcolor, name):
+    """
+    把持仓区间画成一条填充的Scatter轨迹，每个区间是一个矩形，矩形之间用None分隔
+    
+    代替逐个区间调用add_vrect: 图形(shape)的布局和序列化开销随区间数急剧增长，单条轨迹的开销是线性的
+    
+    参数:
+    regions (list): (开始时间, 结束时间) 列表
+    y_low (float): 矩形下边界
+    y_high (float): 矩形上边界
+    fillcolor (str): 填充颜色
+    name (str): 轨迹名称
+    
+    返回:
+    go.Scatter: 填充轨迹，不显示图例和悬停信息
+    """
+    x, y = [], []
+    for r_start, r_end in regions:
+        x += [r_start, r_start, r_end, r_end, r_start, None]
+        y += [y_low, y_high, y_high, y_low, y_low, None]
+    return go.Scatter(x=x, y=y, name=name, mode='lines', fill='toself', fillcolor=fillcolor, line=dict(width=0),
+                      hoverinfo='skip', showlegend=False)
+
+def _webgl_trace(trace, threshold, n_points=None):
+    """
+    点数超过阈值的线/点轨迹转换为Scattergl，由浏览器的WebGL绘制
+    
+    填充轨迹(持仓区间、回撤)保持SVG，WebGL对None分隔的多边形填充支持不完整
+    
+    参数:
+    trace: plotly轨迹
+    threshold (int): 点数阈值
+    n_points (int): 与阈值比较的点数，默认为轨迹自身的点数；降采样后的轨迹应传入降采样前的序列长度
+    
+    返回:
+    原轨迹或对应的go.Scattergl
+    """
+    if not isinstance(trace, go.Scatter) or trace.fill not in (None, 'none'):
+        return trace
+    if n_points is None:
+        n_points = 0 if trace.x is None else len(trace.x)
+    if n_points <= threshold:
+        return trace
+    props = trace.to_plotly_json()
+    props.pop('type', None)
+    return go.Scattergl(**props)
+
 # --- Helper Function 1: Price Chart with Signals (Single Product) ---
-def _create_price_signal_plot_single(df_price_product, df_signal_product):
+def _create_price_signal_plot_single(df_price_product, df_signal_product, max_points=None):
     fig = go.Figure()
     price_data = df_price_product.copy()
     signal_data = df_signal_product.copy()
     common_index = price_data.index.intersection(signal_data.index)
     price_data = price_data.loc[common_index]
     signal_data = signal_data.loc[common_index]
-    fig.add_trace(go.Scatter(x=price_data.index, y=price_data, name="价格", line=dict(width=1.8)))
+    # 开平仓K线强制保留在降采样后的价格线上，交易点标记与价格线重合
+    price_line = _downsample_series(price_data, max_points, keep=signal_data.index[signal_data.notna().to_numpy()])
     buy_regions, sell_regions = [], []
     current_state, start_idx = 0, None
-    for idx, val in signal_data.items():
-        if pd.isna(val): continue
+    for idx, val in signal_data.dropna().items():
         if val == 1 and current_state != 1: start_idx, current_state = idx, 1
         elif val == -1 and current_state != -1: start_idx, current_state = idx, -1
         elif val == 0 and current_state != 0:
@@ -119,8 +343,16 @@ def _create_price_signal_plot_single(df_price_product, df_signal_product):
         end_idx = price_data.index[-1]
         if current_state == 1: buy_regions.append((start_idx, end_idx))
         elif current_state == -1: sell_regions.append((start_idx, end_idx))
-    for r_start, r_end in buy_regions: fig.add_vrect(x0=r_start, x1=r_end, fillcolor="green", opacity=0.15, layer="below", line_width=0)
-    for r_start, r_end in sell_regions: fig.add_vrect(x0=r_start, x1=r_end, fillcolor="red", opacity=0.15, layer="below", line_width=0)
+    # 持仓区间先于价格线加入，绘制在价格线下方。y轴范围固定为价格范围两端各留5%(与自动范围的留白一致)，
+    # 区间矩形覆盖整个y轴范围，与原来按子图高度绘制的vrect外观一致
+    y_low, y_high = price_data.min(), price_data.max()
+    if np.isfinite(y_low) and np.isfinite(y_high):
+        pad = (y_high - y_low) * PRICE_RANGE_PAD or abs(y_high) * PRICE_RANGE_PAD or 1.0
+        y_low, y_high = y_low - pad, y_high + pad
+        fig.update_yaxes(range=[y_low, y_high])
+    if buy_regions: fig.add_trace(_region_trace(buy_regions, y_low, y_high, "rgba(0, 128, 0, 0.15)", "多头持仓"))
+    if sell_regions: fig.add_trace(_region_trace(sell_regions, y_low, y_high, "rgba(255, 0, 0, 0.15)", "空头持仓"))
+    fig.add_trace(go.Scatter(x=price_line.index, y=price_line, name="价格", line=dict(width=1.8)))
     buy_points = signal_data[signal_data == 1].index
     sell_points = signal_data[signal_data == -1].index
     if not buy_points.empty: fig.add_trace(go.Scatter(x=buy_points, y=price_data.loc[buy_points], mode='markers', marker=dict(symbol='triangle-up', size=8, color='lime'), name="买入点"))
@@ -128,10 +360,10 @@ def _create_price_signal_plot_single(df_price_product, df_signal_product):
     return fig
 
 # --- Helper Function 2 (New): Turnover Chart --- 
-def _create_turnover_plot_single(df_turnover_product_series):
+def _create_turnover_plot_single(df_turnover_product_series, max_points=None):
     fig = go.Figure()
     if df_turnover_product_series is not None and not df_turnover_product_series.empty:
-        turnover_data = pd.to_numeric(df_turnover_product_series, errors='coerce')
+        turnover_data = _downsample_series(pd.to_numeric(df_turnover_product_series, errors='coerce'), max_points)
         fig.add_trace(go.Scatter(x=turnover_data.index, y=turnover_data, name="换手率/成交量", 
                                   line=dict(width=1.2, color=qlib_template_config['colorway'][4]), marker=dict(size=3)))
                                   # Using 5th color from colorway for distinction
@@ -139,22 +371,23 @@ def _create_turnover_plot_single(df_turnover_product_series):
     return fig
 
 # --- Helper Function 3 (Original 2): Raw Signal Chart (Single Product) ---
-def _create_raw_signal_plot_single(df_signal_product_series):
+def _create_raw_signal_plot_single(df_signal_product_series, max_points=None):
     fig = go.Figure()
-    signal_data = pd.to_numeric(df_signal_product_series, errors='coerce')
+    signal_data = _downsample_series(pd.to_numeric(df_signal_product_series, errors='coerce'), max_points)
     fig.add_trace(go.Scatter(x=signal_data.index, y=signal_data, name="策略信号值",
                               line=dict(width=1.5, shape='hv'), marker=dict(size=3)))
     return fig # Y-axis range will be set in combined plot
 
 # --- Helper Function 4 (Original 3): Cumulative PnL Chart (Single Product) ---
-def _create_cumulative_pnl_plot_single(df_cumulative_pnl_product, metrics_product):
+def _create_cumulative_pnl_plot_single(df_cumulative_pnl_product, metrics_product, max_points=None):
     fig = go.Figure()
     for pnl_type in df_cumulative_pnl_product.columns:
         if 'pnl' in pnl_type.lower() or 'return' in pnl_type.lower(): 
             display_name = pnl_type.replace("_pnl", " PnL").replace("all", "总").replace("long", "多头").replace("short", "空头")
             if "return" in pnl_type.lower(): 
                  display_name = pnl_type.replace("return_", "").replace("all", "总").replace("long", "多头").replace("short", "空头") + " 回报"
-            fig.add_trace(go.Scatter(x=df_cumulative_pnl_product.index, y=df_cumulative_pnl_product[pnl_type], name=display_name))
+            pnl_line = _downsample_series(df_cumulative_pnl_product[pnl_type], max_points)
+            fig.add_trace(go.Scatter(x=pnl_line.index, y=pnl_line, name=display_name))
 
     textstr_lines = []
     if metrics_product:
@@ -167,23 +400,29 @@ def _create_cumulative_pnl_plot_single(df_cumulative_pnl_product, metrics_produc
     return fig, textstr_lines 
 
 # --- Helper Function 5 (Original 4): Drawdown Chart (Single Product) ---
-def _create_drawdown_plot_single(df_cumulative_pnl_product):
+def _create_drawdown_plot_single(df_cumulative_pnl_product, drawdown=None, max_points=None):
     fig = go.Figure()
-    pnl_col_name = 'all_pnl' 
-    if pnl_col_name not in df_cumulative_pnl_product.columns:
-        pnl_cols = [col for col in df_cumulative_pnl_product.columns if 'pnl' in col.lower() or 'return' in col.lower()] 
-        if not pnl_cols: return fig 
-        all_pnl_cols = [col for col in pnl_cols if 'all' in col.lower()]
-        if all_pnl_cols:
-            pnl_col_name = all_pnl_cols[0]
-        else:
-            pnl_col_name = pnl_cols[0] 
-        warnings.warn(f"计算回撤时首选'all_pnl'列未找到，使用 '{pnl_col_name}' 代替。")
-
-    cumulative_pnl = df_cumulative_pnl_product[pnl_col_name]
-    peak = cumulative_pnl.cummax()
-    drawdown = peak - cumulative_pnl 
+    if drawdown is not None:
+        # 直接使用 cal_metric(return_drawdown=True) 已计算好的回撤序列
+        if isinstance(drawdown, pd.DataFrame):
+            drawdown = drawdown['drawdown'] if 'drawdown' in drawdown.columns else drawdown.iloc[:, 0]
+    else:
+        pnl_col_name = 'all_pnl' 
+        if pnl_col_name not in df_cumulative_pnl_product.columns:
+            pnl_cols = [col for col in df_cumulative_pnl_product.columns if 'pnl' in col.lower() or 'return' in col.lower()] 
+            if not pnl_cols: return fig 
+            all_pnl_cols = [col for col in pnl_cols if 'all' in col.lower()]
+            if all_pnl_cols:
+                pnl_col_name = all_pnl_cols[0]
+            else:
+                pnl_col_name = pnl_cols[0] 
+            warnings.warn(f"计算回撤时首选'all_pnl'列未找到，使用 '{pnl_col_name}' 代替。")
+
+        cumulative_pnl = df_cumulative_pnl_product[pnl_col_name]
+        peak = cumulative_pnl.cummax()
+        drawdown = peak - cumulative_pnl 
     
+    drawdown = _downsample_series(drawdown, max_points) # 最大回撤所在的K线始终保留
     fig.add_trace(go.Scatter(x=drawdown.index, y=-drawdown, name="回撤", # Drawdown as negative values
                               fill='tozeroy', line=dict(color=qlib_template_config['colorway'][3]), opacity=0.7))
     return fig
@@ -199,13 +438,53 @@ def generate_report_for_product(
     metrics_for_this_product, 
     strategy_name_overall, 
     output_dir_for_product_charts=None, 
-    initial_window_days=365
+    initial_window_days=365,
+    drawdown_for_this_product=None, # 可选: 预先计算的回撤序列，避免重复计算
+    max_points=DEFAULT_MAX_POINTS,
+    renderer='svg',
+    webgl_threshold=WEBGL_THRESHOLD,
+    shared_plotlyjs_dir=None
 ):
-    content_fig1_price = _create_price_signal_plot_single(df_price_product_series, df_signal_product_series)
-    content_fig2_turnover = _create_turnover_plot_single(df_turnover_product_series) # New turnover plot
-    content_fig3_raw_signal = _create_raw_signal_plot_single(df_raw_signal_product_series) 
-    content_fig4_pnl, pnl_metrics_text = _create_cumulative_pnl_plot_single(df_cumulative_pnl_for_this_product, metrics_for_this_product)
-    content_fig5_drawdown = _create_drawdown_plot_single(df_cumulative_pnl_for_this_product)
+    """
+    生成单个品种的五行综合报告: 价格与交易点、换手率/成交量、策略信号、累计收益、回撤
+    
+    参数:
+    product_name (str): 品种名
+    df_price_product_series (Series): 价格
+    df_signal_product_series (Series): 处理后的交易标志 (1/-1/0)
+    df_raw_signal_product_series (Series): 原始策略信号
+    df_turnover_product_series (Series): 成交额，可为None
+    df_cumulative_pnl_for_this_product (DataFrame): 累计收益，列为all_pnl、long_pnl、short_pnl
+    metrics_for_this_product (dict): 绩效指标
+    strategy_name_overall (str): 策略名
+    output_dir_for_product_charts (str): HTML保存目录，默认None(在Jupyter中直接显示)
+    initial_window_days (int): 初始显示的天数，默认365
+    drawdown_for_this_product (Series/DataFrame): 可选，预先计算的回撤序列，避免重复计算
+    max_points (int): 每条曲线用LTTB降采样后的最大点数，默认5000，None为不降采样；交易点始终完整保留
+    renderer (str): 'svg'或'webgl'，默认'svg'。'webgl'时第1-4行中原始序列长度超过webgl_threshold的行，
+                    其线和点轨迹改用Scattergl；持仓区间等填充轨迹和带范围滑块的第5行回撤图始终使用SVG
+    webgl_threshold (int): 切换为WebGL的序列长度阈值，默认20000。比较的是降采样之前的序列长度，
+                           因此与max_points相互独立: 默认设置下超过20000根K线的序列降采样到约5000点后仍用WebGL绘制；
+                           max_points=None时WebGL绘制全部点
+    shared_plotlyjs_dir (str): 共享plotly.js所在目录，指定时HTML引用该目录下的plotly.min.js并以二进制类型数组写出数据
+    
+    返回:
+    go.Figure: 综合报告图表
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unsupported renderer: {renderer}, expected one of {RENDERERS}")
+    # 第5行回撤图带有范围滑块，滑块预览不绘制WebGL轨迹，始终使用SVG
+    if renderer == 'webgl':
+        to_renderer = lambda trace, n_points: _webgl_trace(trace, webgl_threshold, n_points)
+    else:
+        to_renderer = lambda trace, n_points: trace
+    # 按降采样前的序列长度决定每一行是否使用WebGL
+    n_source = lambda series: 0 if series is None else len(series)
+    content_fig1_price = _create_price_signal_plot_single(df_price_product_series, df_signal_product_series, max_points)
+    content_fig2_turnover = _create_turnover_plot_single(df_turnover_product_series, max_points) # New turnover plot
+    content_fig3_raw_signal = _create_raw_signal_plot_single(df_raw_signal_product_series, max_points) 
+    content_fig4_pnl, pnl_metrics_text = _create_cumulative_pnl_plot_single(df_cumulative_pnl_for_this_product, metrics_for_this_product, max_points)
+    content_fig5_drawdown = _create_drawdown_plot_single(df_cumulative_pnl_for_this_product, drawdown_for_this_product, max_points)
 
     combined_fig = make_subplots(
         rows=5, cols=1, shared_xaxes=True,
@@ -222,20 +501,20 @@ def generate_report_for_product(
     combined_fig = apply_qlib_style(combined_fig)
 
     # Row 1: Price and Trade Signals
-    for trace in content_fig1_price.data: combined_fig.add_trace(trace, row=1, col=1)
+    for trace in content_fig1_price.data: combined_fig.add_trace(to_renderer(trace, n_source(df_price_product_series)), row=1, col=1)
     for shape in content_fig1_price.layout.shapes: combined_fig.add_shape(shape, row=1, col=1)
     
     # Row 2: Turnover
     if content_fig2_turnover.data:
-        for trace in content_fig2_turnover.data: combined_fig.add_trace(trace, row=2, col=1)
+        for trace in content_fig2_turnover.data: combined_fig.add_trace(to_renderer(trace, n_source(df_turnover_product_series)), row=2, col=1)
     else:
         combined_fig.add_annotation(text="无换手率数据", xref="x2 domain", yref="y2 domain", x=0.5, y=0.5, showarrow=False, row=2, col=1)
 
     # Row 3: Raw Strategy Signal
-    for trace in content_fig3_raw_signal.data: combined_fig.add_trace(trace, row=3, col=1)
+    for trace in content_fig3_raw_signal.data: combined_fig.add_trace(to_renderer(trace, n_source(df_raw_signal_product_series)), row=3, col=1)
     
     # Row 4: Cumulative PnL and Metrics
-    for trace in content_fig4_pnl.data: combined_fig.add_trace(trace, row=4, col=1)
+    for trace in content_fig4_pnl.data: combined_fig.add_trace(to_renderer(trace, n_source(df_cumulative_pnl_for_this_product)), row=4, col=1)
     if pnl_metrics_text:
         combined_fig.add_annotation(xref='paper', yref='y4 domain', x=0.02, y=0.96, text="<br>".join(pnl_metrics_text),
                            showarrow=False, align="left", bgcolor="rgba(35, 39, 51, 0.88)",
@@ -272,7 +551,7 @@ def generate_report_for_product(
          combined_fig.update_xaxes(rangeslider=dict(visible=True, thickness=0.035, bgcolor="#1A1E28"), row=5, col=1)
 
     # Y-axis titles and ranges
-    combined_fig.update_yaxes(title_text="价格", fixedrange=False, row=1, col=1)
+    combined_fig.update_yaxes(title_text="价格", range=content_fig1_price.layout.yaxis.range, fixedrange=False, row=1, col=1)
     combined_fig.update_yaxes(title_text="换手率/成交量", fixedrange=False, row=2, col=1)
     combined_fig.update_yaxes(title_text="信号值", range=[-1.5, 1.5], fixedrange=False, row=3, col=1) 
     combined_fig.update_yaxes(title_text="累计 PnL", fixedrange=False, row=4, col=1)
@@ -294,7 +573,8 @@ def generate_report_for_product(
     if output_dir_for_product_charts:
         os.makedirs(output_dir_for_product_charts, exist_ok=True)
         combined_html_path = os.path.join(output_dir_for_product_charts, f"{product_name}_combined_report.html")
-        save_figure_with_template(combined_fig, combined_html_path, f"{strategy_name_overall} - {product_name} 综合报告")
+        plotlyjs_path = write_plotlyjs(shared_plotlyjs_dir) if shared_plotlyjs_dir else None
+        save_figure_with_template(combined_fig, combined_html_path, f"{strategy_name_overall} - {product_name} 综合报告", plotlyjs_path)
     else:
         print(f"Displaying combined report for {product_name}...")
         iplot(combined_fig)
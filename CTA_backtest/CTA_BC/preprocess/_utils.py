@@ -1,3 +1,18 @@
+import os
+import sys
+import time
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+try:
+   import resource  # 仅Unix可用
+except ImportError:
+   resource = None
+try:
+   import psutil  # 可选依赖，用于非Unix平台的内存统计
+except ImportError:
+   psutil = None
+
 def get_clean_product():
    """
    获取可交易的品种列表
@@ -32,3 +47,162 @@ def get_group_product():
                    '债券': ['TS', 'TL', 'T', 'TF'],
                    '黑色系': ['HC', 'JM', 'I', 'J', 'RB']}
    return product_dict
+
+def resolve_n_jobs(n_jobs):
+   """
+   将n_jobs参数转换为实际使用的进程数
+   
+   参数:
+   n_jobs (int): 进程数，1为串行，-1为使用全部CPU核心，-2为保留一个核心，以此类推
+   
+   返回:
+   int: 实际进程数，至少为1
+   """
+   cpu_count = os.cpu_count() or 1
+   if n_jobs is None or n_jobs == 0:
+      return 1
+   if n_jobs < 0:
+      return max(cpu_count + 1 + n_jobs, 1)
+   return n_jobs
+
+def to_shared_array(arr):
+   """
+   将数组复制到共享内存，供工作进程零拷贝读取
+   
+   参数:
+   arr (ndarray): 需要共享的数组
+   
+   返回:
+   shm (SharedMemory): 共享内存对象，使用完毕后需调用close()和unlink()
+   spec (tuple): (共享内存名称, 形状, 数据类型)，传给from_shared_array在工作进程中重建数组
+   """
+   shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+   view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, order='F')
+   view[...] = arr
+   del view  # 释放对共享内存缓冲区的引用，保证之后可以close
+   return shm, (shm.name, arr.shape, arr.dtype.str)
+
+def from_shared_array(spec):
+   """
+   在工作进程中根据to_shared_array返回的spec重建数组视图
+   
+   参数:
+   spec (tuple): (共享内存名称, 形状, 数据类型)
+   
+   返回:
+   shm (SharedMemory): 共享内存对象，需在数组使用期间保持引用
+   arr (ndarray): 共享内存上的数组视图(Fortran顺序)
+   """
+   name, shape, dtype = spec
+   shm = shared_memory.SharedMemory(name=name)
+   return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, order='F')
+
+# timed_phase重置内核记录的峰值之前观察到的最大值(MB)，Linux上ru_maxrss会随之重置
+_RESET_PEAK_MB = [0.0]
+
+def peak_rss_mb():
+   """
+   获取当前进程在整个生命周期内的内存峰值(MB)
+   
+   优先使用resource模块(Unix)，否则使用psutil(Windows为峰值工作集，其他平台为当前RSS)。
+   该值从进程启动起单调不减，不能反映某一阶段的峰值，阶段峰值见timed_phase
+   
+   返回:
+   float: 内存峰值(MB)，无法获取时为None
+   """
+   peak = None
+   if resource is not None:
+      peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      peak = peak / 2**20 if sys.platform == 'darwin' else peak / 1024  # macOS单位为字节，Linux为KB
+   elif psutil is not None:
+      info = psutil.Process().memory_info()
+      peak = getattr(info, 'peak_wset', info.rss) / 2**20
+   if peak is None:
+      return None
+   return max(peak, _RESET_PEAK_MB[0])
+
+def _proc_status_mb(field):
+   """
+   读取/proc/self/status中的内存字段(MB)，非Linux平台返回None
+   """
+   try:
+      with open('/proc/self/status') as f:
+         for line in f:
+            if line.startswith(field + ':'):
+               return int(line.split()[1]) / 1024  # 单位为kB
+   except OSError:
+      pass
+   return None
+
+def current_rss_mb():
+   """
+   获取当前进程的常驻内存(MB)
+   
+   返回:
+   float: 当前RSS(MB)，无法获取时为None
+   """
+   rss = _proc_status_mb('VmRSS')
+   if rss is None and psutil is not None:
+      rss = psutil.Process().memory_info().rss / 2**20
+   return rss
+
+def _reset_peak_rss():
+   """
+   将Linux内核记录的进程内存峰值(VmHWM)重置为当前RSS，成功时返回True
+   """
+   _RESET_PEAK_MB[0] = max(_RESET_PEAK_MB[0], _proc_status_mb('VmHWM') or 0)  # 保留进程生命周期的峰值
+   try:
+      with open('/proc/self/clear_refs', 'w') as f:
+         f.write('5')
+      return True
+   except OSError:
+      return False
+
+# 正在进行的阶段，内层阶段重置峰值前把已达到的峰值记入外层阶段
+_OPEN_PHASES = []
+
+@contextmanager
+def timed_phase(timings, name, logger=None):
+   """
+   记录一个计算阶段的耗时和内存
+   
+   Linux上阶段开始时重置内核记录的内存峰值(写/proc/self/clear_refs)，结束时读取VmHWM，得到该阶段内的RSS峰值；
+   嵌套的阶段会把内层的峰值计入外层。其他平台无法重置峰值，阶段峰值记为None，只记录RSS变化和进程峰值
+   
+   参数:
+   timings (dict): 保存结果的字典，键为阶段名称，值为:
+                   - 'seconds': 耗时(秒)
+                   - 'peak_rss_mb': 该阶段内的RSS峰值(MB)，无法测量时为None
+                   - 'rss_delta_mb': 阶段结束与开始时的RSS之差(MB)
+                   - 'process_peak_rss_mb': 阶段结束时进程整个生命周期的内存峰值(MB)
+   name (str): 阶段名称
+   logger (Logger): 日志记录器，为None时只记录不输出
+   """
+   if _OPEN_PHASES:
+      # 重置前外层阶段已达到的峰值
+      hwm = _proc_status_mb('VmHWM')
+      for phase in _OPEN_PHASES:
+         phase['peak'] = max(phase['peak'], hwm or 0)
+   phase = {'peak': 0, 'reset': _reset_peak_rss()}
+   _OPEN_PHASES.append(phase)
+   rss_before = current_rss_mb()
+   start = time.perf_counter()
+   try:
+      yield
+   finally:
+      seconds = time.perf_counter() - start
+      _OPEN_PHASES.remove(phase)
+      peak = None
+      if phase['reset']:
+         peak = max(phase['peak'], _proc_status_mb('VmHWM') or 0)
+         _RESET_PEAK_MB[0] = max(_RESET_PEAK_MB[0], peak)
+         for outer in _OPEN_PHASES:
+            outer['peak'] = max(outer['peak'], peak)
+      rss_after = current_rss_mb()
+      delta = None if rss_before is None or rss_after is None else rss_after - rss_before
+      timings[name] = {'seconds': seconds, 'peak_rss_mb': peak, 'rss_delta_mb': delta,
+                       'process_peak_rss_mb': peak_rss_mb()}
+      if logger is not None:
+         logger.info("%s: %.3fs, phase peak RSS %s MB, RSS change %s MB", name, seconds,
+                     'n/a' if peak is None else f"{peak:.1f}",
+                     'n/a' if delta is None else f"{delta:+.1f}")
@@ -7,4 +7,6 @@ trade - 交易信号生成模块
   - trade_factor_mean: 因子均值化交易
   - trade_ori_amtclean: 考虑成交量的交易
   - trade_factor_mean_amtclean: 考虑成交量的因子均值化交易
+  - clear_signal_ma_cache / set_signal_ma_cache_limit: 释放signal_ma缓存 / 设置缓存的内存上限(默认64MB)
+- flag_store.py: 交易标志的紧凑存储(稀疏事件列表或int8矩阵)
 """
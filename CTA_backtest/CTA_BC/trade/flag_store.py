@@ -0,0 +1,163 @@
+import pandas as pd
+import numpy as np
+
+class FlagStore:
+    """
+    交易标志的紧凑存储
+
+    create_trade_flag生成的 (时间 × 品种) float64标志矩阵几乎全是NaN，只有开平仓K线有值。支持两种存储方式:
+    - 'sparse': 事件列表 (行位置int32, 品种编号int16, 动作int8)，按行、品种排序，内存与事件数成正比
+    - 'int8': (时间 × 品种) int8矩阵，1/-1/0为标志，MISSING(-128)表示该K线无标志
+    两种方式都可以无损还原为列名为 PRODUCT_flag 的DataFrame
+
+    参数:
+    index (DatetimeIndex): 标志的时间索引
+    products (list): 品种列表
+    rows (ndarray): 每个事件所在的行位置
+    codes (ndarray): 每个事件的品种编号，对应products中的位置
+    actions (ndarray): 每个事件的动作，1为开多，-1为开空，0为平仓
+    storage (str): 存储方式，'sparse'或'int8'，默认'sparse'
+    """
+    MISSING = -128
+    STORAGES = ('sparse', 'int8')
+
+    def __init__(self, index, products, rows, codes, actions, storage='sparse'):
+        if storage not in self.STORAGES:
+            raise ValueError(f"Unsupported flag storage: {storage}")
+        self.index = index
+        self.products = list(products)
+        self.storage = storage
+        self._set_events(np.asarray(rows), np.asarray(codes), np.asarray(actions))
+
+    @classmethod
+    def from_frame(cls, flag, storage='sparse'):
+        """
+        从列名为 PRODUCT_flag 的交易标志DataFrame创建
+
+        参数:
+        flag (DataFrame): create_trade_flag生成的交易标志
+        storage (str): 存储方式，'sparse'或'int8'
+
+        返回:
+        FlagStore: 紧凑存储的交易标志
+        """
+        products = [column[:-len('_flag')] if column.endswith('_flag') else column for column in flag.columns]
+        values = flag.to_numpy(dtype=np.float64)
+        rows, codes = np.nonzero(~np.isnan(values))
+        return cls(flag.index, products, rows, codes, values[rows, codes], storage=storage)
+
+    def __repr__(self):
+        return f"FlagStore(storage='{self.storage}', rows={len(self.index)}, products={len(self.products)}, events={len(self.events()[0])})"
+
+    def _set_events(self, rows, codes, actions):
+        """
+        按存储方式保存事件
+        """
+        if self.storage == 'int8':
+            self._matrix = np.full((len(self.index), len(self.products)), self.MISSING, dtype=np.int8)
+            self._matrix[rows, codes] = actions
+        else:
+            order = np.lexsort((codes, rows))
+            self._rows = rows[order].astype(np.int32)
+            self._codes = codes[order].astype(np.int16)
+            self._actions = actions[order].astype(np.int8)
+
+    def events(self):
+        """
+        返回全部事件
+
+        返回:
+        rows (ndarray): 事件所在的行位置
+        codes (ndarray): 事件的品种编号
+        actions (ndarray): 事件动作，1为开多，-1为开空，0为平仓
+        """
+        if self.storage == 'int8':
+            rows, codes = np.nonzero(self._matrix != self.MISSING)
+            return rows, codes, self._matrix[rows, codes]
+        return self._rows, self._codes, self._actions
+
+    @property
+    def nbytes(self):
+        """
+        事件数据和时间索引占用的字节数
+        """
+        data = self._matrix.nbytes if self.storage == 'int8' else self._rows.nbytes + self._codes.nbytes + self._actions.nbytes
+        return data + self.index.nbytes
+
+    def to_frame(self, index=None):
+        """
+        还原为列名为 PRODUCT_flag 的float64交易标志DataFrame
+
+        参数:
+        index (Index): 只还原这些时间上的标志，默认为None(全部时间)；不在存储索引中的时间为NaN
+
+        返回:
+        DataFrame: 交易标志，1为开多，-1为开空，0为平仓，其余为NaN
+        """
+        rows, codes, actions = self.events()
+        if index is None:
+            index = self.index
+        else:
+            # 将事件所在行映射到目标索引上的位置，不在目标索引中的事件丢弃
+            target = pd.Index(index).get_indexer(self.index)[rows]
+            keep = target >= 0
+            rows, codes, actions = target[keep], codes[keep], actions[keep]
+        values = np.full((len(index), len(self.products)), np.nan)
+        values[rows, codes] = actions
+        return pd.DataFrame(values, index=index, columns=[f'{product}_flag' for product in self.products])
+
+    def positions(self):
+        """
+        每根K线收盘后的持仓方向
+
+        返回:
+        DataFrame: (时间 × 品种) int8持仓矩阵，1为多头，-1为空头，0为空仓，列名为品种名
+        """
+        held = self.to_frame().ffill().fillna(0).to_numpy().astype(np.int8)
+        return pd.DataFrame(held, index=self.index, columns=self.products)
+
+    def assign(self, index, product, values):
+        """
+        改写单个品种在已有时间上的标志
+
+        参数:
+        index (Index): 需要改写的时间，必须在存储索引中
+        product (str): 品种名
+        values (ndarray): 新的标志，NaN表示无标志
+        """
+        rows = self.index.get_indexer(index)
+        if (rows < 0).any():
+            raise ValueError("Some timestamps are not in the flag index")
+        code = self.products.index(product)
+        values = np.asarray(values, dtype=np.float64)
+        if self.storage == 'int8':
+            self._matrix[rows, code] = np.where(np.isnan(values), self.MISSING, values).astype(np.int8)
+            return
+        # 删除这些单元格上原有的事件，再加入新的事件
+        old_rows, old_codes, old_actions = self.events()
+        keep = ~((old_codes == code) & np.isin(old_rows, rows))
+        valid = ~np.isnan(values)
+        self._set_events(np.concatenate((old_rows[keep], rows[valid])),
+                         np.concatenate((old_codes[keep], np.full(valid.sum(), code))),
+                         np.concatenate((old_actions[keep], values[valid])))
+
+    def append(self, flag):
+        """
+        在末尾追加新的时间行
+
+        参数:
+        flag (DataFrame): 新的交易标志，列名为 PRODUCT_flag，时间必须晚于已有的时间
+        """
+        if len(flag) == 0:
+            return
+        if len(self.index) and flag.index[0] <= self.index[-1]:
+            raise ValueError("Appended flags must start after the last stored timestamp")
+        columns = [f'{product}_flag' for product in self.products]
+        values = flag.reindex(columns=columns).to_numpy(dtype=np.float64)
+        new_rows, new_codes = np.nonzero(~np.isnan(values))
+        old_rows, old_codes, old_actions = self.events()
+        rows = np.concatenate((old_rows, new_rows + len(self.index)))
+        codes = np.concatenate((old_codes, new_codes))
+        actions = np.concatenate((old_actions, values[new_rows, new_codes]))
+        self.index = self.index.append(flag.index)
+        self._set_events(rows, codes, actions)
@@ -6,9 +6,170 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from tqdm import tqdm
 import warnings
+import hashlib
+from collections import OrderedDict
 warnings.filterwarnings('ignore', category=FutureWarning)
+try:
+    from numba import njit  # 可选依赖，用于编译交易标志生成内核
+except ImportError:
+    njit = None
 
-def trade_ori(df, open_thre=2, close_thre=0.8, len_ma=500):
+def _next_true_index(mask, default):
+    """
+    对每个位置k，返回k及其之后第一个mask为True的位置
+    
+    参数:
+    mask (ndarray): 布尔数组
+    default (int): 之后不存在True时的返回值
+    
+    返回:
+    ndarray: 与mask等长的整数位置数组
+    """
+    idx = np.where(mask, np.arange(len(mask)), default)
+    return np.minimum.accumulate(idx[::-1])[::-1]
+
+def _position_state_machine(signal_values, long_threshold, short_threshold, close_long_threshold, close_short_threshold, open_mask=None, position=0, start=1):
+    """
+    空仓/多头/空头三态的持仓状态机，线性时间生成交易标志
+    
+    先向量化地计算每个位置之后最近的开仓点和平仓点，再只在开平仓事件之间跳转，
+    结果与原先逐点的双重循环完全一致:
+    - 首根K线不开仓，平仓K线本身不能再开仓
+    - 多头条件优先于空头条件
+    - 开仓当根即满足平仓条件时标志为0
+    - 序列末尾仍有持仓时强制平仓
+    
+    参数:
+    signal_values (ndarray): 信号值
+    long_threshold (ndarray): 开多仓阈值
+    short_threshold (ndarray): 开空仓阈值
+    close_long_threshold (ndarray): 平多仓阈值
+    close_short_threshold (ndarray): 平空仓阈值
+    open_mask (ndarray): 允许开仓的位置，默认为None(不限制)
+    position (int): 序列开始前已持有的仓位，1为多头，-1为空头，默认为0(空仓)，用于接续之前的计算
+    start (int): 空仓时允许开仓的第一个位置，默认为1(首根K线不开仓)
+    
+    返回:
+    ndarray: 交易标志数组，1为开多，-1为开空，0为平仓，其余为NaN
+    """
+    n = len(signal_values)
+    flags = np.full(n, np.nan)
+    if n == 0:
+        return flags
+    
+    long_open = signal_values > long_threshold
+    short_open = signal_values < short_threshold
+    if open_mask is not None:
+        long_open &= open_mask
+        short_open &= open_mask
+    
+    next_open = _next_true_index(long_open | short_open, n)
+    next_close_long = _next_true_index(signal_values < close_long_threshold, n - 1)  # 找不到平仓点则在末尾强制平仓
+    next_close_short = _next_true_index(signal_values > close_short_threshold, n - 1)
+    
+    if position != 0:
+        # 接续已有持仓，其开仓标志在之前的序列中
+        j = next_close_long[0] if position == 1 else next_close_short[0]
+        flags[j] = 0
+        i = next_open[j + 1] if j + 1 < n else n
+    else:
+        i = next_open[start] if n > start else n
+    while i < n:
+        if long_open[i]:
+            flags[i] = 1  # 开多仓
+            j = next_close_long[i]
+        else:
+            flags[i] = -1  # 开空仓
+            j = next_close_short[i]
+        flags[j] = 0  # 平仓
+        i = next_open[j + 1] if j + 1 < n else n
+    return flags
+
+def _state_machine_loop(signal_values, long_threshold, short_threshold, close_long_threshold, close_short_threshold, open_mask, position, start):
+    """
+    逐K线推进的持仓状态机，供numba编译使用，结果与_position_state_machine一致
+    
+    参数:
+    signal_values (ndarray): 信号值，float64
+    long_threshold (ndarray): 开多仓阈值，float64
+    short_threshold (ndarray): 开空仓阈值，float64
+    close_long_threshold (ndarray): 平多仓阈值，float64
+    close_short_threshold (ndarray): 平空仓阈值，float64
+    open_mask (ndarray): 允许开仓的位置，bool
+    position (int): 序列开始前已持有的仓位
+    start (int): 空仓时允许开仓的第一个位置
+    
+    返回:
+    ndarray: 交易标志数组，1为开多，-1为开空，0为平仓，其余为NaN
+    """
+    n = signal_values.shape[0]
+    flags = np.full(n, np.nan)
+    entry = -1  # 开仓位置，-1表示开仓在之前的序列中
+    for k in range(n):
+        if position == 0:
+            if k < start or not open_mask[k]:
+                continue
+            if signal_values[k] > long_threshold[k]:
+                position = 1
+                entry = k
+            elif signal_values[k] < short_threshold[k]:
+                position = -1
+                entry = k
+            else:
+                continue
+        if position == 1:
+            closed = signal_values[k] < close_long_threshold[k]
+        else:
+            closed = signal_values[k] > close_short_threshold[k]
+        if closed or k == n - 1:
+            if entry >= 0:
+                flags[entry] = position
+            flags[k] = 0
+            position = 0
+    return flags
+
+_state_machine_jit = njit(cache=True)(_state_machine_loop) if njit is not None else None
+
+def _run_state_machine(signal_values, long_threshold, short_threshold, close_long_threshold, close_short_threshold, open_mask=None, backend='numpy', position=0, start=1):
+    """
+    按指定后端生成交易标志
+    
+    参数:
+    signal_values (ndarray): 信号值
+    long_threshold (ndarray): 开多仓阈值
+    short_threshold (ndarray): 开空仓阈值
+    close_long_threshold (ndarray): 平多仓阈值
+    close_short_threshold (ndarray): 平空仓阈值
+    open_mask (ndarray): 允许开仓的位置，默认为None(不限制)
+    backend (str): 计算后端，'numpy'或'numba'，未安装numba时回退到'numpy'
+    position (int): 序列开始前已持有的仓位，默认为0(空仓)
+    start (int): 空仓时允许开仓的第一个位置，默认为1
+    
+    返回:
+    ndarray: 交易标志数组，1为开多，-1为开空，0为平仓，其余为NaN
+    """
+    if backend not in ('numpy', 'numba'):
+        raise ValueError(f"Unsupported backend: {backend}")
+    if backend == 'numba':
+        if _state_machine_jit is not None:
+            if open_mask is None:
+                open_mask = np.ones(len(signal_values), dtype=bool)
+            return _state_machine_jit(
+                np.ascontiguousarray(signal_values, dtype=np.float64),
+                np.ascontiguousarray(long_threshold, dtype=np.float64),
+                np.ascontiguousarray(short_threshold, dtype=np.float64),
+                np.ascontiguousarray(close_long_threshold, dtype=np.float64),
+                np.ascontiguousarray(close_short_threshold, dtype=np.float64),
+                np.ascontiguousarray(open_mask, dtype=np.bool_),
+                int(position),
+                int(start)
+            )
+        warnings.warn("numba is not installed, falling back to the numpy backend.")
+    return _position_state_machine(signal_values, long_threshold, short_threshold,
+                                   close_long_threshold, close_short_threshold, open_mask=open_mask,
+                                   position=position, start=start)
+
+def trade_ori(df, open_thre=2, close_thre=0.8, len_ma=500, backend='numpy'):
     """
     基础交易信号生成函数，根据信号强度开平仓
     
@@ -17,6 +178,7 @@ def trade_ori(df, open_thre=2, close_thre=0.8, len_ma=500):
     open_thre (float): 开仓阈值系数，默认为2
     close_thre (float): 平仓阈值系数，默认为0.8
     len_ma (int): 移动平均窗口长度，默认为500
+    backend (str): 状态机计算后端，'numpy'或'numba'，默认为'numpy'
     
     返回:
     DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
@@ -41,50 +203,14 @@ def trade_ori(df, open_thre=2, close_thre=0.8, len_ma=500):
     close_long_threshold = _df['close_long_threshold'].values
     close_short_threshold = _df['close_short_threshold'].values
     
-    flags = np.full(len(_df), np.nan)  # 初始化交易标志数组
-    close_num = 0  # 记录最近一次平仓位置
-    
-    # 循环生成交易标志
-    for i in range(len(signal_values)):
-        if i <= close_num:
-            continue  # 跳过已处理的位置
-            
-        # 开多仓条件：信号值大于开多仓阈值
-        if signal_values[i] > long_threshold[i]:
-            for j in range(i, len(signal_values)):
-                # 平多仓条件：信号值小于平多仓阈值
-                if signal_values[j] < close_long_threshold[j]:
-                    flags[i] = 1  # 开多仓
-                    flags[j] = 0  # 平多仓
-                    close_num = j
-                    break
-                # 到达序列末尾，强制平仓
-                elif j == len(signal_values) - 1:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                    
-        # 开空仓条件：信号值小于开空仓阈值
-        elif signal_values[i] < short_threshold[i]:
-            for j in range(i, len(signal_values)):
-                # 平空仓条件：信号值大于平空仓阈值
-                if signal_values[j] > close_short_threshold[j]:
-                    flags[i] = -1  # 开空仓
-                    flags[j] = 0  # 平空仓
-                    close_num = j
-                    break
-                # 到达序列末尾，强制平仓
-                elif j == len(signal_values) - 1:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
+    # 单次线性扫描的持仓状态机生成交易标志
+    flags = _run_state_machine(signal_values, long_threshold, short_threshold,
+                               close_long_threshold, close_short_threshold, backend=backend)
     
     _df['flag'] = flags
     return _df.loc[:,['flag']]
 
-def trade_factor_mean(df,open_thre,close_thre,len_ma):
+def trade_factor_mean(df,open_thre,close_thre,len_ma,backend='numpy'):
     """
     因子均值化交易信号生成函数，先对信号均值中心化再生成交易标志
     
@@ -93,6 +219,7 @@ def trade_factor_mean(df,open_thre,close_thre,len_ma):
     open_thre (float): 开仓阈值系数
     close_thre (float): 平仓阈值系数
     len_ma (int): 移动平均窗口长度
+    backend (str): 状态机计算后端，'numpy'或'numba'，默认为'numpy'
     
     返回:
     DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
@@ -116,47 +243,15 @@ def trade_factor_mean(df,open_thre,close_thre,len_ma):
     close_long_threshold = _df['close_long_threshold'].values
     close_short_threshold = _df['close_short_threshold'].values
     
-    flags = np.full(len(_df), np.nan)
-    close_num = 0
-    
-    # 使用向量化操作
-    for i in range(len(signal_values)):
-        if i <= close_num:
-            continue
-            
-        # 开多仓条件
-        if signal_values[i] > long_threshold[i]:
-            for j in range(i, len(signal_values)):
-                if signal_values[j] < close_long_threshold[j]:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                elif j == len(signal_values) - 1:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                    
-        # 开空仓条件
-        elif signal_values[i] < short_threshold[i]:
-            for j in range(i, len(signal_values)):
-                if signal_values[j] > close_short_threshold[j]:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                elif j == len(signal_values) - 1:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
+    # 单次线性扫描的持仓状态机生成交易标志
+    flags = _run_state_machine(signal_values, long_threshold, short_threshold,
+                               close_long_threshold, close_short_threshold, backend=backend)
     
     _df['flag'] = flags
     return _df.loc[:,['flag']]
 
 
-def trade_ori_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , amt_threshold = 20 * 1e8):
+def trade_ori_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , amt_threshold = 20 * 1e8, backend='numpy'):
     """
     考虑成交量的交易信号生成函数，只在成交量超过阈值时开仓
     
@@ -167,6 +262,7 @@ def trade_ori_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , am
     close_thre (float): 平仓阈值系数，默认为0.8
     len_ma (int): 移动平均窗口长度，默认为500
     amt_threshold (float): 成交量阈值，默认为20*1e8
+    backend (str): 状态机计算后端，'numpy'或'numba'，默认为'numpy'
     
     返回:
     DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
@@ -196,46 +292,15 @@ def trade_ori_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , am
     _df = pd.merge(_df,_amt,on = 'datetime',how = 'left')
     amt_ma22 = _df['amt_ma22'].values
     
-    flags = np.full(len(_df), np.nan)
-    close_num = 0
-    
-    # 使用向量化操作
-    for i in range(len(signal_values)):
-        if i <= close_num:
-            continue
-            
-        # 开多仓条件
-        if (signal_values[i] > long_threshold[i]) and (amt_ma22[i] > amt_threshold):
-            for j in range(i, len(signal_values)):
-                if signal_values[j] < close_long_threshold[j]:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                elif j == len(signal_values) - 1:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                    
-        # 开空仓条件
-        elif (signal_values[i] < short_threshold[i]) and (amt_ma22[i] > amt_threshold):
-            for j in range(i, len(signal_values)):
-                if signal_values[j] > close_short_threshold[j]:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                elif j == len(signal_values) - 1:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
+    # 单次线性扫描的持仓状态机生成交易标志
+    flags = _run_state_machine(signal_values, long_threshold, short_threshold,
+                               close_long_threshold, close_short_threshold,
+                               open_mask=amt_ma22 > amt_threshold, backend=backend)
 
     _df['flag'] = flags
     return _df.loc[:,['flag']]
 
-def trade_factor_mean_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , amt_threshold = 20 * 1e8):
+def trade_factor_mean_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , amt_threshold = 20 * 1e8, backend='numpy'):
     """
     考虑成交量的因子均值化交易信号生成函数，综合了均值中心化和成交量过滤
     
@@ -246,6 +311,7 @@ def trade_factor_mean_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=
     close_thre (float): 平仓阈值系数，默认为0.8
     len_ma (int): 移动平均窗口长度，默认为500
     amt_threshold (float): 成交量阈值，默认为20*1e8
+    backend (str): 状态机计算后端，'numpy'或'numba'，默认为'numpy'
     
     返回:
     DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
@@ -276,47 +342,216 @@ def trade_factor_mean_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=
     _df = pd.merge(_df,_amt,on = 'datetime',how = 'left')
     amt_ma22 = _df['amt_ma22'].values
     
-    flags = np.full(len(_df), np.nan)
-    close_num = 0
-    
-    # 使用向量化操作
-    for i in range(len(signal_values)):
-        if i <= close_num:
-            continue
-            
-        # 开多仓条件
-        if (signal_values[i] > long_threshold[i]) and (amt_ma22[i] > amt_threshold):
-            for j in range(i, len(signal_values)):
-                if signal_values[j] < close_long_threshold[j]:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                elif j == len(signal_values) - 1:
-                    flags[i] = 1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                    
-        # 开空仓条件
-        elif (signal_values[i] < short_threshold[i]) and (amt_ma22[i] > amt_threshold):
-            for j in range(i, len(signal_values)):
-                if signal_values[j] > close_short_threshold[j]:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
-                elif j == len(signal_values) - 1:
-                    flags[i] = -1
-                    flags[j] = 0
-                    close_num = j
-                    break
+    # 单次线性扫描的持仓状态机生成交易标志
+    flags = _run_state_machine(signal_values, long_threshold, short_threshold,
+                               close_long_threshold, close_short_threshold,
+                               open_mask=amt_ma22 > amt_threshold, backend=backend)
 
     _df['flag'] = flags
     return _df.loc[:,['flag']]
 
 
-def create_trade_flag(df, product_list, begin_date='2018-01-01', end_date='2024-08-04', mode='trade_ori', ratio=1, df_amt=None, amt_threshold=20 * 1e8):
+# 各交易模式的面板计算配置: (是否对信号做均值中心化, 是否使用成交量过滤)
+_PANEL_MODES = {
+    'trade_ori': (False, False),
+    'trade_factor_mean': (True, False),
+    'trade_ori_amtclean': (False, True),
+    'trade_factor_amtclean': (True, True),
+}
+
+def _compact_columns(values, valid):
+    """
+    将每列的有效值按原顺序移到该列顶部，其余位置填NaN
+    
+    参数:
+    values (ndarray): (时间 × 品种) 数据矩阵
+    valid (ndarray): 与values同形状的有效位置布尔矩阵
+    
+    返回:
+    ndarray: 压缩后的矩阵，第c列前valid[:, c].sum()行为有效值
+    """
+    compact = np.full(values.shape, np.nan, order='F')
+    for c in range(values.shape[1]):
+        col = values[valid[:, c], c]
+        compact[:len(col), c] = col
+    return compact
+
+def _prepare_signal_panel(df, product_list, begin_date, end_date):
+    """
+    截取日期范围内的信号面板，并逐列剔除缺失值后压缩，等价于逐品种dropna
+    
+    参数:
+    df (DataFrame): 信号数据，每列对应一个品种的信号
+    product_list (list): 品种列表
+    begin_date (str): 开始日期
+    end_date (str): 结束日期
+    
+    返回:
+    index (DatetimeIndex): 日期范围内的时间索引
+    compact (ndarray): 压缩后的信号矩阵
+    valid (ndarray): 原始信号矩阵的有效位置
+    counts (ndarray): 每列有效值个数
+    """
+    signal = df.loc[:, list(product_list)]
+    signal = signal[(signal.index >= begin_date) & (signal.index <= end_date)]
+    values = signal.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    return signal.index, _compact_columns(values, valid), valid, valid.sum(axis=0)
+
+def _pre_signal_panel(compact, counts, demean=False):
+    """
+    计算压缩面板的前移信号pre_signal，可选地逐列做均值中心化
+    
+    参数:
+    compact (ndarray): 压缩后的信号矩阵
+    counts (ndarray): 每列有效值个数
+    demean (bool): 是否减去各列pre_signal的均值
+    
+    返回:
+    ndarray: pre_signal矩阵，超出各列有效长度的位置为NaN
+    """
+    pre = np.full(compact.shape, np.nan, order='F')
+    pre[1:] = compact[:-1]  # 信号前移一位，用于下一时刻交易
+    pre[np.arange(len(pre))[:, None] >= counts[None, :]] = np.nan
+    if demean:
+        for c in range(pre.shape[1]):
+            # 逐列使用Series.mean，保证与单品种计算的浮点结果一致
+            pre[:, c] -= pd.Series(pre[:counts[c], c]).mean()
+    return pre
+
+def _signal_ma_panel(pre, len_ma):
+    """
+    一次性计算所有品种信号绝对值的移动平均
+    
+    参数:
+    pre (ndarray): pre_signal矩阵
+    len_ma (int): 移动平均窗口长度
+    
+    返回:
+    ndarray: signal_ma矩阵
+    """
+    return np.asfortranarray(pd.DataFrame(np.abs(pre)).rolling(len_ma).mean().to_numpy())
+
+# signal_ma的LRU缓存，键为(品种, 窗口长度, pre_signal指纹)，值为该品种有效区间内的signal_ma
+# 缓存是模块级的，fit返回后仍然占用内存，因此按占用的字节数而不是条目数限制大小
+_SIGNAL_MA_CACHE = OrderedDict()
+_SIGNAL_MA_CACHE_MAX_BYTES = 64 * 1024 ** 2
+
+def clear_signal_ma_cache():
+    """
+    清空signal_ma缓存，释放其占用的内存
+    """
+    _SIGNAL_MA_CACHE.clear()
+
+def set_signal_ma_cache_limit(max_bytes):
+    """
+    设置signal_ma缓存占用内存的上限，超出部分按最久未使用的顺序淘汰
+    
+    参数:
+    max_bytes (int): 缓存的最大字节数，默认为64MB；0表示不再缓存
+    """
+    global _SIGNAL_MA_CACHE_MAX_BYTES
+    if max_bytes < 0:
+        raise ValueError("max_bytes must be non-negative")
+    _SIGNAL_MA_CACHE_MAX_BYTES = int(max_bytes)
+    _evict_signal_ma_cache()
+
+def signal_ma_cache_nbytes():
+    """
+    返回signal_ma缓存当前占用的字节数
+    """
+    return sum(values.nbytes for values in _SIGNAL_MA_CACHE.values())
+
+def _evict_signal_ma_cache():
+    """
+    按最久未使用的顺序淘汰缓存条目，直到总字节数不超过上限
+    """
+    nbytes = signal_ma_cache_nbytes()
+    while _SIGNAL_MA_CACHE and nbytes > _SIGNAL_MA_CACHE_MAX_BYTES:
+        _, values = _SIGNAL_MA_CACHE.popitem(last=False)
+        nbytes -= values.nbytes
+
+def _signal_fingerprint(values):
+    """
+    计算信号序列的指纹，用作缓存键
+    """
+    return hashlib.blake2b(np.ascontiguousarray(values).tobytes(), digest_size=16).hexdigest()
+
+def _cached_signal_ma_panel(pre, counts, product_list, len_ma):
+    """
+    带缓存的signal_ma面板计算，只对缓存未命中的品种计算移动平均
+    
+    参数:
+    pre (ndarray): pre_signal矩阵
+    counts (ndarray): 每列有效值个数
+    product_list (list): 与pre各列对应的品种列表
+    len_ma (int): 移动平均窗口长度
+    
+    返回:
+    ndarray: signal_ma矩阵
+    """
+    signal_ma = np.full(pre.shape, np.nan, order='F')
+    keys = [(product, len_ma, _signal_fingerprint(pre[:counts[c], c])) for c, product in enumerate(product_list)]
+    missing = []
+    for c, key in enumerate(keys):
+        cached = _SIGNAL_MA_CACHE.get(key)
+        if cached is None:
+            missing.append(c)
+        else:
+            _SIGNAL_MA_CACHE.move_to_end(key)
+            signal_ma[:counts[c], c] = cached
+    
+    if missing:
+        # 未命中的品种一次性计算
+        computed = _signal_ma_panel(pre[:, missing], len_ma)
+        for j, c in enumerate(missing):
+            signal_ma[:counts[c], c] = computed[:counts[c], j]
+            if computed[:counts[c], j].nbytes <= _SIGNAL_MA_CACHE_MAX_BYTES:  # 单个品种就超过上限时不缓存
+                _SIGNAL_MA_CACHE[keys[c]] = computed[:counts[c], j].copy()
+                _SIGNAL_MA_CACHE.move_to_end(keys[c])
+        _evict_signal_ma_cache()
+    return signal_ma
+
+def _flag_panel(pre, signal_ma, valid, open_thre, close_thre, amt=None, amt_threshold=20 * 1e8, backend='numpy'):
+    """
+    根据面板阈值逐列运行持仓状态机，并将标志还原到原始时间位置
+    
+    参数:
+    pre (ndarray): pre_signal矩阵
+    signal_ma (ndarray): signal_ma矩阵
+    valid (ndarray): 原始信号矩阵的有效位置
+    open_thre (float): 开仓阈值系数
+    close_thre (float): 平仓阈值系数
+    amt (ndarray): 压缩后的成交量矩阵，默认为None(不过滤)
+    amt_threshold (float): 成交量阈值
+    backend (str): 状态机计算后端，'numpy'或'numba'
+    
+    返回:
+    flags (ndarray): (时间 × 品种) 交易标志矩阵
+    in_result (ndarray): 每个时间点是否至少有一个品种参与计算
+    """
+    n, p = pre.shape
+    flags = np.full((n, p), np.nan, order='F')
+    in_result = np.zeros(n, dtype=bool)
+    open_band = np.asfortranarray(signal_ma * open_thre)  # 开仓阈值带宽
+    close_band = np.asfortranarray(signal_ma * close_thre)  # 平仓阈值带宽
+    ready = np.asfortranarray(~np.isnan(pre) & ~np.isnan(signal_ma))
+    for c in range(p):
+        rows = np.flatnonzero(ready[:, c])
+        if len(rows) == 0:
+            continue
+        if rows[-1] - rows[0] + 1 == len(rows):
+            rows = slice(rows[0], rows[-1] + 1)  # 有效区间连续时使用切片视图，避免复制
+        col_open, col_close = open_band[:, c][rows], close_band[:, c][rows]
+        open_mask = None if amt is None else amt[:, c][rows] > amt_threshold
+        col_flags = _run_state_machine(pre[:, c][rows], col_open, -col_open, -col_close, col_close,
+                                       open_mask=open_mask, backend=backend)
+        orig_rows = np.flatnonzero(valid[:, c])[rows]
+        flags[orig_rows, c] = col_flags
+        in_result[orig_rows] = True
+    return flags, in_result
+
+def create_trade_flag(df, product_list, begin_date='2018-01-01', end_date='2024-08-04', mode='trade_ori', ratio=1, df_amt=None, amt_threshold=20 * 1e8, backend='numpy', panel=True, close_thre=0.8, len_ma=500, use_cache=True):
     """
     根据选定模式为多品种创建交易标志
     
@@ -329,13 +564,51 @@ def create_trade_flag(df, product_list, begin_date='2018-01-01', end_date='2024-
     ratio (float): 信号比例调整因子，默认为1
     df_amt (DataFrame): 成交量数据，仅在需要考虑成交量的模式下使用
     amt_threshold (float): 成交量阈值，仅在需要考虑成交量的模式下使用
+    backend (str): 状态机计算后端，'numpy'或'numba'(需安装numba，未安装时回退到'numpy')，默认为'numpy'
+    panel (bool): 是否以(时间 × 品种)矩阵整体计算，默认为True；False时逐品种计算
+    close_thre (float): 平仓阈值系数，默认为0.8
+    len_ma (int): 移动平均窗口长度，默认为500
+    use_cache (bool): 是否使用signal_ma缓存(仅panel模式)，默认为True。缓存为模块级LRU，
+                      总大小不超过set_signal_ma_cache_limit设置的上限(默认64MB)，可用clear_signal_ma_cache释放
     
     返回:
-    DataFrame: 包含所有品种交易标志的DataFrame
+    DataFrame: 包含所有品种交易标志的DataFrame，列名为 PRODUCT_flag
     """
-    _df = pd.DataFrame()
     open_thre = 2 * ratio  # 根据ratio调整开仓阈值
-    close_thre = 0.8  # 保持平仓阈值不变
+
+    if not panel:
+        return _create_trade_flag_loop(df, product_list, begin_date, end_date, mode, open_thre, close_thre, len_ma, df_amt, amt_threshold, backend)
+    if mode not in _PANEL_MODES:
+        raise ValueError(f"Unsupported mode: {mode}")
+    if len(product_list) == 0:
+        return pd.DataFrame()
+
+    demean, use_amt = _PANEL_MODES[mode]
+    index, compact, valid, counts = _prepare_signal_panel(df, product_list, begin_date, end_date)
+    pre = _pre_signal_panel(compact, counts, demean=demean)
+    if use_cache:
+        signal_ma = _cached_signal_ma_panel(pre, counts, product_list, len_ma)
+    else:
+        signal_ma = _signal_ma_panel(pre, len_ma)
+
+    amt = None
+    if use_amt:
+        amt_values = df_amt.loc[:, list(product_list)].reindex(index).to_numpy(dtype=np.float64)
+        amt = _compact_columns(amt_values, valid)
+
+    flags, in_result = _flag_panel(pre, signal_ma, valid, open_thre, close_thre, amt=amt, amt_threshold=amt_threshold, backend=backend)
+
+    # 一次性组装结果
+    return pd.DataFrame(flags[in_result], index=index[in_result], columns=[f'{product}_flag' for product in product_list])
+
+def _create_trade_flag_loop(df, product_list, begin_date, end_date, mode, open_thre, close_thre, len_ma, df_amt, amt_threshold, backend):
+    """
+    逐品种调用交易函数生成交易标志，参数同create_trade_flag
+    
+    返回:
+    DataFrame: 包含所有品种交易标志的DataFrame，列名为 PRODUCT_flag
+    """
+    frames = []
 
     # 遍历每个品种生成交易标志
     for product in tqdm(product_list):
@@ -346,20 +619,125 @@ def create_trade_flag(df, product_list, begin_date='2018-01-01', end_date='2024-
 
         # 根据指定的模式生成交易标志
         if mode == 'trade_ori_old':
-            df_trade = trade_ori_old(df=signal_data, open_thre=open_thre, close_thre=close_thre, len_ma=500)
+            df_trade = trade_ori_old(df=signal_data, open_thre=open_thre, close_thre=close_thre, len_ma=len_ma)
         elif mode == 'trade_factor_mean':
-            df_trade = trade_factor_mean(df=signal_data, open_thre=open_thre, close_thre=close_thre, len_ma=500)
+            df_trade = trade_factor_mean(df=signal_data, open_thre=open_thre, close_thre=close_thre, len_ma=len_ma, backend=backend)
         elif mode == 'trade_ori':
-            df_trade = trade_ori(df=signal_data, open_thre=open_thre, close_thre=close_thre, len_ma=500)
+            df_trade = trade_ori(df=signal_data, open_thre=open_thre, close_thre=close_thre, len_ma=len_ma, backend=backend)
         elif mode == 'trade_ori_amtclean':
-            df_trade = trade_ori_amtclean(df=signal_data, df_amt=df_amt, open_thre=open_thre, close_thre=close_thre, len_ma=500, amt_threshold=amt_threshold)
+            df_trade = trade_ori_amtclean(df=signal_data, df_amt=df_amt, open_thre=open_thre, close_thre=close_thre, len_ma=len_ma, amt_threshold=amt_threshold, backend=backend)
         elif mode == 'trade_factor_amtclean':
-            df_trade = trade_factor_mean_amtclean(df=signal_data, df_amt=df_amt, open_thre=open_thre, close_thre=close_thre, len_ma=500, amt_threshold=amt_threshold)
+            df_trade = trade_factor_mean_amtclean(df=signal_data, df_amt=df_amt, open_thre=open_thre, close_thre=close_thre, len_ma=len_ma, amt_threshold=amt_threshold, backend=backend)
         else:
             raise ValueError(f"Unsupported mode: {mode}")
 
-        # 将结果添加到总DataFrame中
-        df_trade.columns = [f'{signal_data.columns[0]}']
-        _df = pd.concat([_df, df_trade], axis=1)
+        df_trade.columns = [f'{signal_data.columns[0]}_flag']
+        frames.append(df_trade)
+
+    # 一次性合并所有品种的结果
+    return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+
+# 可以增量更新的交易模式，factor_mean类模式使用全样本均值中心化，新数据会改变历史信号
+_STREAM_MODES = ('trade_ori', 'trade_ori_amtclean')
 
-    return _df
\ No newline at end of file
+def _stream_flag_state(df, flag, product_list, begin_date, end_date, len_ma):
+    """
+    整理增量更新交易标志所需的每个品种状态
+    
+    参数:
+    df (DataFrame): 已排序的信号数据，与生成flag时使用的数据一致
+    flag (DataFrame): create_trade_flag生成的交易标志，列名为 PRODUCT_flag
+    product_list (list): 品种列表
+    begin_date (str): 开始日期
+    end_date (str): 结束日期
+    len_ma (int): 移动平均窗口长度
+    
+    返回:
+    dict: {'cutoff': 已处理信号的截止时间, 'products': {品种: 状态}}，状态包括
+          tail(最近len_ma+1个有效信号)、n_raw(有效信号个数)、last_ts(最后一根已处理K线的时间)、
+          position和entry_ts(最后一根已处理K线之前的持仓方向及其开仓时间)
+    """
+    signal = df.loc[:, list(product_list)]
+    signal = signal[(signal.index >= begin_date) & (signal.index <= end_date)]
+    products = {}
+    for product in product_list:
+        raw = signal[product].dropna()
+        state = {'tail': raw.iloc[-(len_ma + 1):], 'n_raw': len(raw), 'last_ts': None, 'position': 0, 'entry_ts': None}
+        if len(raw) > len_ma:
+            # 前len_ma个有效信号用于计算signal_ma，之后的K线才参与交易
+            state['last_ts'] = raw.index[-1]
+            col = flag[f'{product}_flag']
+            values = col.to_numpy(dtype=np.float64)[:col.index.searchsorted(state['last_ts'])]
+            events = np.flatnonzero(~np.isnan(values))
+            if len(events) and values[events[-1]] != 0:
+                state['position'] = int(values[events[-1]])
+                state['entry_ts'] = col.index[events[-1]]
+        products[product] = state
+    return {'cutoff': signal.index.max() if len(signal) else None, 'products': products}
+
+def _stream_flags(state, df_new, mode, open_thre, close_thre, len_ma, df_amt=None, amt_threshold=20 * 1e8, backend='numpy'):
+    """
+    在已有状态上接续计算新信号的交易标志
+    
+    每个品种从最后一根已处理K线开始重新运行状态机: 该K线在之前的计算中可能被强制平仓，
+    有了新数据后需要按正常规则重新判断，其余历史标志保持不变
+    
+    参数:
+    state (dict): _stream_flag_state或上一次_stream_flags返回的状态
+    df_new (DataFrame): 截止时间之后的已排序新信号数据
+    mode (str): 交易模式，仅支持_STREAM_MODES
+    open_thre (float): 开仓阈值系数
+    close_thre (float): 平仓阈值系数
+    len_ma (int): 移动平均窗口长度
+    df_amt (DataFrame): 成交量数据，仅'trade_ori_amtclean'模式使用
+    amt_threshold (float): 成交量阈值
+    backend (str): 状态机计算后端，'numpy'或'numba'
+    
+    返回:
+    events (dict): {品种: 交易标志Series}，从最后一根已处理K线(或第一根可交易K线)开始
+    new_state (dict): 更新后的状态
+    """
+    if mode not in _STREAM_MODES:
+        raise ValueError(f"Mode {mode} does not support incremental updates")
+    events, products = {}, {}
+    for product, st in state['products'].items():
+        new = df_new[product].dropna() if product in df_new.columns else None
+        if new is None or len(new) == 0:
+            products[product] = st
+            continue
+        ext = pd.concat([st['tail'], new])
+        pre = ext.shift(1)
+        signal_ma = pre.abs().rolling(len_ma).mean().to_numpy()
+        pre = pre.to_numpy(dtype=np.float64)
+        new_state = {'tail': ext.iloc[-(len_ma + 1):], 'n_raw': st['n_raw'] + len(new),
+                     'last_ts': st['last_ts'], 'position': st['position'], 'entry_ts': st['entry_ts']}
+        products[product] = new_state
+        
+        if st['last_ts'] is not None:
+            # 重新计算最后一根已处理K线，若它是第一根可交易K线则仍不能开仓
+            s = len(st['tail']) - 1
+            position, start = st['position'], int(st['n_raw'] - 1 == len_ma)
+        else:
+            s, position, start = len_ma, 0, 1
+        if s >= len(ext):
+            continue
+        
+        open_band, close_band = signal_ma[s:] * open_thre, signal_ma[s:] * close_thre
+        open_mask = None
+        if mode == 'trade_ori_amtclean':
+            open_mask = df_amt[product].reindex(ext.index[s:]).to_numpy(dtype=np.float64) > amt_threshold
+        flags = _run_state_machine(pre[s:], open_band, -open_band, -close_band, close_band,
+                                   open_mask=open_mask, backend=backend, position=position, start=start)
+        index = ext.index[s:]
+        events[product] = pd.Series(flags, index=index)
+        
+        # 新的最后一根K线之前的持仓状态
+        prior = np.flatnonzero(~np.isnan(flags[:-1]))
+        if len(prior):
+            last = flags[prior[-1]]
+            new_state['position'] = int(last)
+            new_state['entry_ts'] = index[prior[-1]] if last != 0 else None
+        new_state['last_ts'] = index[-1]
+    cutoff = df_new.index.max() if len(df_new) else state['cutoff']
+    return events, {'cutoff': cutoff, 'products': products}
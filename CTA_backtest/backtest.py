@@ -1,19 +1,50 @@
 import pandas as pd  
 import numpy as np 
 import os 
+import hashlib
 import matplotlib.pyplot as plt
 plt.rcParams['font.sans-serif'] = ['SimHei']  # 设置中文字体
 plt.rcParams['axes.unicode_minus'] = False    # 解决保存图像是负号'-'显示为方块的问题
 import seaborn as sns
 import warnings
+import logging
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 from .CTA_BC.preprocess._plot import _plot_pnl            # 导入绘图函数
-from .CTA_BC.preprocess._plot_pro import generate_report_for_product    # 导入单个产品报告生成函数
-from .CTA_BC.trade.trade_boll import trade_ori,create_trade_flag  # 导入交易信号生成函数
-from .CTA_BC.metrics.cal_return import calculate_returns_all,calculate_returns_folds  # 导入收益率计算函数
-from .CTA_BC.metrics.cal_indicator import cal_metric      # 导入绩效指标计算函数
+from .CTA_BC.preprocess._plot_pro import generate_report_for_product, write_plotlyjs, DEFAULT_MAX_POINTS, RENDERERS    # 导入单个产品报告生成函数
+from .CTA_BC.trade.trade_boll import trade_ori,create_trade_flag,_STREAM_MODES,_stream_flag_state,_stream_flags  # 导入交易信号生成函数
+from .CTA_BC.trade.flag_store import FlagStore                # 导入交易标志紧凑存储
+from .CTA_BC.metrics.cal_return import calculate_returns_all,calculate_returns_folds,_stream_return_state,_stream_returns  # 导入收益率计算函数
+from .CTA_BC.metrics.cal_indicator import cal_metric,_CURVE_METRIC_KEYS,_frame_stats,_side_stats,_metrics_from_stats      # 导入绩效指标计算函数
+from .CTA_BC.preprocess._utils import timed_phase,resolve_n_jobs          # 导入阶段计时和并行工具
 from sklearn.utils.validation import check_is_fitted      # 导入模型检查工具
 
+logger = logging.getLogger(__name__)
+
+def _sorted(df):
+    """
+    按时间排序，索引已单调递增时直接返回原数据，避免复制
+    """
+    return df if df.index.is_monotonic_increasing else df.sort_index()
+
+def _frame_fingerprint(df, n_sample=4096):
+    """
+    计算价格数据的轻量指纹: 形状、列名、索引首尾以及均匀抽取的至多n_sample行数值的哈希
+    
+    用于判断report之后传入report_html的是否仍是同样的数据，不遍历全部数值
+    """
+    rows = np.unique(np.linspace(0, len(df) - 1, min(len(df), n_sample)).astype(np.int64))
+    sample = np.ascontiguousarray(df.iloc[rows].to_numpy(dtype=np.float64))
+    ends = (df.index[0], df.index[-1]) if len(df) else (None, None)
+    return df.shape, tuple(df.columns), ends, hashlib.blake2b(sample.tobytes(), digest_size=16).hexdigest()
+
+def _render_product_report(kwargs):
+    """
+    在工作进程中生成单个品种的HTML报告，只写出文件，不返回图表对象
+    """
+    generate_report_for_product(**kwargs)
+    return kwargs['product_name']
+
 class BackTest:
     """
     CTA策略回测框架主类
@@ -23,8 +54,35 @@ class BackTest:
         self.df_x_input = None # 保存原始策略信号
         self.df_amt_input = None # 保存成交量数据
         self._fitted = False # 标记是否已执行回测
+        self.timings = {} # 各计算阶段的耗时和内存
+        self.flag_storage = 'frame' # 交易标志的存储方式
+        self._flag_store = None # 交易标志，DataFrame或FlagStore
 
-    def fit(self, df_x, product_list, name, begin_date='2018-01-01', end_date='2024-08-04', cost=0, mode='trade_ori', ratio=1, df_amt=None, amt_threshold=20*1e8):
+    @property
+    def flag(self):
+        """
+        交易标志DataFrame，列名为 PRODUCT_flag；紧凑存储时每次访问按需还原
+        """
+        if isinstance(self._flag_store, FlagStore):
+            return self._flag_store.to_frame()
+        return self._flag_store
+
+    @flag.setter
+    def flag(self, value):
+        if self.flag_storage == 'frame' or value is None:
+            self._flag_store = value
+        else:
+            self._flag_store = FlagStore.from_frame(value, storage=self.flag_storage)
+
+    def _flag_frame(self, index):
+        """
+        取给定时间上的交易标志DataFrame，紧凑存储时只还原这些行
+        """
+        if isinstance(self._flag_store, FlagStore):
+            return self._flag_store.to_frame(index)
+        return self._flag_store.loc[index]
+
+    def fit(self, df_x, product_list, name, begin_date='2018-01-01', end_date='2024-08-04', cost=0, mode='trade_ori', ratio=1, df_amt=None, amt_threshold=20*1e8, backend='numpy', close_thre=0.8, len_ma=500, copy=True, flag_storage='frame'):
         """
         执行回测主函数
         
@@ -34,42 +92,81 @@ class BackTest:
         name (str): 策略名称
         begin_date (str): 回测开始日期，默认'2018-01-01'
         end_date (str): 回测结束日期，默认'2024-08-04'
-        cost (float): 交易成本，默认0
+        cost (float/CostModel): 交易成本，默认0。可传入CostModel按品种设置手续费、滑点和冲击成本
         mode (str): 交易模式，可选'trade_ori'/'trade_factor_mean'/'trade_ori_amtclean'等
         ratio (float): 信号比例调整因子，默认1
         df_amt (DataFrame): 成交量数据，仅在需要考虑成交量的模式下使用
         amt_threshold (float): 成交量阈值，仅在需要考虑成交量的模式下使用
+        backend (str): 交易标志计算后端，'numpy'或'numba'，默认'numpy'
+        close_thre (float): 平仓阈值系数，默认0.8
+        len_ma (int): 信号绝对值移动平均的窗口长度，默认500
+        copy (bool): 是否复制df_x和df_amt，默认True。False时只保存引用以节省内存，回测不会修改传入的数据，
+                     但调用方在回测之后修改数据会影响update和report_html
+        flag_storage (str): 交易标志的存储方式，默认'frame'
+                            - 'frame': float64的DataFrame
+                            - 'sparse': 开平仓事件列表 (行位置, 品种编号, 动作)，见FlagStore
+                            - 'int8': (时间 × 品种) int8矩阵
+                            紧凑存储时self.flag按需还原为DataFrame，self.flag_positions()返回int8持仓矩阵
+        
+        各阶段的耗时、阶段内的RSS峰值和RSS变化记录在self.timings中(见timed_phase)，并通过logging输出(logger名为本模块名)
+        
+        create_trade_flag会把各品种的signal_ma缓存在模块级的LRU缓存中，以便用相同信号和窗口长度重复回测时复用。
+        缓存在fit返回后仍占用内存，总大小受CTA_BC.trade.trade_boll.set_signal_ma_cache_limit限制(默认64MB)；
+        回测结束后可调用CTA_BC.trade.trade_boll.clear_signal_ma_cache()释放
         """
-        self.df_x_input = df_x.copy() 
-        if df_amt is not None:
-            self.df_amt_input = df_amt.copy()
-        else:
-            self.df_amt_input = None
+        if flag_storage not in ('frame',) + FlagStore.STORAGES:
+            raise ValueError(f"Unsupported flag storage: {flag_storage}")
+        self.flag_storage = flag_storage
+        self.timings = {}
+        with timed_phase(self.timings, 'fit.prepare', logger):
+            self.df_x_input = df_x.copy() if copy else df_x
+            if df_amt is not None:
+                self.df_amt_input = df_amt.copy() if copy else df_amt
+            else:
+                self.df_amt_input = None
+            _df_x_sorted = _sorted(df_x)
         
-        _df_x_sorted = df_x.sort_index()  
         self.product_list = product_list  
         self.name = name  
         self.cost = cost  
         self.begin_date = begin_date  
         self.end_date = end_date  
+        # 保存信号参数，供update接续计算
+        self.mode = mode
+        self.ratio = ratio
+        self.amt_threshold = amt_threshold
+        self.backend = backend
+        self.close_thre = close_thre
+        self.len_ma = len_ma
+        self._flag_state = None
+        self._return_state = None
+        self._df_y_report = None
+        self._df_y_report_key = None
+        self._product_metrics = {}
         
         # 生成交易信号，create_trade_flag 应返回列名为 PRODUCT_flag 的 DataFrame
-        self.flag = create_trade_flag(
-            df=_df_x_sorted, 
-            product_list=self.product_list, # 传递干净的产品名列表
-            begin_date=self.begin_date, 
-            end_date=self.end_date, 
-            mode=mode, 
-            ratio=ratio, 
-            df_amt=self.df_amt_input, 
-            amt_threshold=amt_threshold
-        )
-        print('flag is here')
-        print(self.flag)
+        with timed_phase(self.timings, 'fit.create_trade_flag', logger):
+            self.flag = create_trade_flag(
+                df=_df_x_sorted, 
+                product_list=self.product_list, # 传递干净的产品名列表
+                begin_date=self.begin_date, 
+                end_date=self.end_date, 
+                mode=mode, 
+                ratio=ratio, 
+                df_amt=self.df_amt_input, 
+                amt_threshold=amt_threshold,
+                backend=backend,
+                close_thre=close_thre,
+                len_ma=len_ma
+            )
+        logger.info("Strategy '%s': trade flags %d rows x %d products (%s storage)", self.name,
+                    len(self._flag_store.index), len(self.product_list), self.flag_storage)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Strategy '%s' trade flags:\n%s", self.name, self.flag)
         
         self._fitted = True  
 
-    def report(self,df_y,fold = 24,path = None):
+    def report(self,df_y,fold = 24,path = None,pnl_mode = 'close'):
         """
         生成回测报告和可视化结果
         
@@ -77,15 +174,25 @@ class BackTest:
         df_y (DataFrame): 价格数据，index为datetime，columns为品种名称
         fold (int): 周期收益分析的周期数，默认24
         path (str): 结果保存路径，默认None (不保存)
+        pnl_mode (str): 累计收益曲线的记账方式，'close'为平仓记账，'mtm'为逐K线盯市，默认'close'。
+                        交易统计指标始终基于平仓收益，'mtm'时累计收益曲线、回撤等风险指标基于盯市收益
         """
         check_is_fitted(self,attributes=['_fitted'])
+        # 保存报告使用的数据和参数，供update增量更新
+        self._df_y_report = df_y
+        self._df_y_report_key = _frame_fingerprint(df_y)
+        self._report_fold = fold
+        self._report_pnl_mode = pnl_mode
+        self._return_state = None
+        self._metric_stats = None
+        self._product_metrics = {}
         
         filtered_df_y = df_y[(df_y.index>=self.begin_date)&(df_y.index<=self.end_date)]
         
         # self.flag 的列名应为 PRODUCT_flag 格式
         # 过滤 self.flag 的日期，使其与 filtered_df_y 的日期对齐
-        common_index = filtered_df_y.index.intersection(self.flag.index)
-        filtered_flag = self.flag.loc[common_index]
+        common_index = filtered_df_y.index.intersection(self._flag_store.index)
+        filtered_flag = self._flag_frame(common_index)
         
         # 从 self.product_list (干净的产品名列表) 中筛选出在 filtered_flag 中实际存在的信号
         products_to_calculate = []
@@ -98,64 +205,313 @@ class BackTest:
             self._df_ret_all = pd.DataFrame()
             self._df_ret_long = pd.DataFrame()
             self._df_ret_short = pd.DataFrame()
+            self.ledger = pd.DataFrame()
+            self.df_fold = pd.DataFrame()
             self.df_pnl = pd.DataFrame()
             self._dict = {}
             self.clean_product_list = []
             return
         
-        # 计算总体、多头和空头的收益
-        self._df_ret_all,self._df_ret_long,self._df_ret_short = calculate_returns_all(
-            df_x=filtered_flag, # 应包含 PRODUCT_flag 列
-            df_y=filtered_df_y,
-            product_list=products_to_calculate, # 干净的产品名列表
-            cost=self.cost
-        )
+        # 计算总体、多头和空头的收益，同时生成逐笔交易台账
+        with timed_phase(self.timings, 'report.returns', logger):
+            self._df_ret_all,self._df_ret_long,self._df_ret_short,self.ledger = calculate_returns_all(
+                df_x=filtered_flag, # 应包含 PRODUCT_flag 列
+                df_y=filtered_df_y,
+                product_list=products_to_calculate, # 干净的产品名列表
+                cost=self.cost,
+                return_ledger=True,
+                df_amt=self.df_amt_input
+            )
 
         # calculate_returns_all 返回的 DataFrame 列名是干净的产品名
         self.clean_product_list = list(self._df_ret_all.columns)
         
         # 计算绩效指标
-        self.df_pnl,self._dict = cal_metric(
-            df_all=self._df_ret_all,
-            df_long=self._df_ret_long,
-            df_short=self._df_ret_short
-        )
+        with timed_phase(self.timings, 'report.metrics', logger):
+            self.df_pnl,self._dict = cal_metric(
+                df_all=self._df_ret_all,
+                df_long=self._df_ret_long,
+                df_short=self._df_ret_short
+            )
+        
+        if pnl_mode == 'mtm':
+            # 累计收益曲线和风险指标改用逐K线盯市收益，反映持仓期间的浮动盈亏
+            with timed_phase(self.timings, 'report.mtm', logger):
+                df_mtm_all,df_mtm_long,df_mtm_short = calculate_returns_all(
+                    df_x=filtered_flag,
+                    df_y=filtered_df_y,
+                    product_list=products_to_calculate,
+                    cost=self.cost,
+                    pnl_mode='mtm',
+                    df_amt=self.df_amt_input
+                )
+                self.df_pnl,_dict_mtm = cal_metric(df_all=df_mtm_all,df_long=df_mtm_long,df_short=df_mtm_short)
+                self._dict.update({key: _dict_mtm[key] for key in _CURVE_METRIC_KEYS})
+        elif pnl_mode != 'close':
+            raise ValueError(f"Unsupported pnl_mode: {pnl_mode}")
+        
+        # 基于交易台账中的开仓时刻计算周期收益分布
+        with timed_phase(self.timings, 'report.folds', logger):
+            self.df_fold = calculate_returns_folds(
+                df_x=filtered_flag,
+                df_y=filtered_df_y,
+                product_list=products_to_calculate,
+                fold=fold,
+                ledger=self.ledger
+            )
             
-    def report_html(self,df_y,fold = 24,path = None):
+    def flag_positions(self):
+        """
+        每根K线收盘后各品种的持仓方向
+        
+        返回:
+        DataFrame: (时间 × 品种) int8持仓矩阵，1为多头，-1为空头，0为空仓，列名为品种名
+        """
+        check_is_fitted(self,attributes=['_fitted'])
+        store = self._flag_store
+        if not isinstance(store, FlagStore):
+            store = FlagStore.from_frame(store)
+        return store.positions()
+    
+    def update(self,df_x_new,df_y_new = None,df_amt_new = None):
+        """
+        追加新的K线数据，只计算新K线上的交易标志；已执行report时同时增量更新收益、交易台账和绩效指标
+        
+        'trade_ori'/'trade_ori_amtclean'模式保存每个品种最近len_ma+1个信号、最后一根K线之前的持仓和开仓价格，
+        以及交易统计量和累计收益曲线，只重新计算最后一根已处理K线(之前可能在该K线被强制平仓)和新K线，
+        结果与用全部数据重新执行fit和report一致(浮点误差范围内)。价格数据落后于信号时，尚无价格的交易标志保留在状态中，
+        价格到达后再计算收益。factor_mean类模式以全样本均值中心化信号，
+        新数据会改变历史信号，report使用'mtm'时盯市收益也需要完整价格，这些情况下用全部数据重新计算
+        
+        参数:
+        df_x_new (DataFrame): 新的策略信号数据，只使用时间晚于已有信号的行
+        df_y_new (DataFrame): 新的价格数据，只使用时间晚于已有收益序列的行，已执行report时必须提供
+        df_amt_new (DataFrame): 新的成交量数据，只使用时间晚于已有成交量数据的行
+        
+        注意: 回测结束日期更新为 max(end_date, 最新信号时间)；周期收益分布df_fold不做增量更新，需要时重新执行report
+        """
+        check_is_fitted(self,attributes=['_fitted'])
+        reported = self._return_state is not None or self._df_y_report is not None
+        if reported and df_y_new is None:
+            raise ValueError("df_y_new is required to update a reported backtest")
+        stream = self.mode in _STREAM_MODES
+        
+        # 在追加数据之前整理已有结果的状态
+        calculated = [column[:-len('_all')] for column in getattr(self, '_df_ret_all', pd.DataFrame()).columns]
+        incremental = stream and reported and calculated and self._report_pnl_mode == 'close'
+        flag = None
+        if stream and self._flag_state is None:
+            flag = self.flag
+            self._flag_state = _stream_flag_state(_sorted(self.df_x_input), flag, self.product_list,
+                                                  self.begin_date, self.end_date, self.len_ma)
+        if incremental and self._return_state is None:
+            filtered_df_y = self._df_y_report[(self._df_y_report.index>=self.begin_date)&(self._df_y_report.index<=self.end_date)]
+            self._return_state = _stream_return_state(filtered_df_y, self.flag if flag is None else flag, self._flag_state,
+                                                      calculated, self.cost, self.df_amt_input)
+            # 晚于结束日期的价格在结束日期延后时使用
+            self._return_state['pending'] = self._df_y_report[self._df_y_report.index > self.end_date]
+            self._metric_stats, _ = _frame_stats(self._df_ret_all, self._df_ret_long, self._df_ret_short)
+        
+        # 追加原始数据，只保留晚于已有数据的行
+        self.df_x_input = pd.concat([self.df_x_input, df_x_new[df_x_new.index > self.df_x_input.index.max()]])
+        if df_amt_new is not None:
+            if self.df_amt_input is None:
+                self.df_amt_input = df_amt_new.copy()
+            else:
+                self.df_amt_input = pd.concat([self.df_amt_input, df_amt_new[df_amt_new.index > self.df_amt_input.index.max()]])
+        end_date = max(pd.Timestamp(self.end_date), self.df_x_input.index.max())
+        
+        if not stream or (reported and not incremental):
+            # 无法增量计算时用全部数据重新计算
+            if not stream:
+                warnings.warn(f"Mode {self.mode} demeans signals with the full-sample mean, recomputing on all data.")
+            self.end_date = end_date
+            self.flag = create_trade_flag(
+                df=_sorted(self.df_x_input),
+                product_list=self.product_list,
+                begin_date=self.begin_date,
+                end_date=self.end_date,
+                mode=self.mode,
+                ratio=self.ratio,
+                df_amt=self.df_amt_input,
+                amt_threshold=self.amt_threshold,
+                backend=self.backend,
+                close_thre=self.close_thre,
+                len_ma=self.len_ma
+            )
+            self._flag_state = None
+            if reported:
+                df_y = pd.concat([self._df_y_report, df_y_new[df_y_new.index > self._df_y_report.index.max()]])
+                self.report(df_y, fold=self._report_fold, pnl_mode=self._report_pnl_mode)
+            return
+        
+        # 接续计算新K线的交易标志
+        cutoff = self._flag_state['cutoff']
+        df_new = self.df_x_input[(self.df_x_input.index >= self.begin_date) & (self.df_x_input.index <= end_date)]
+        if cutoff is not None:
+            df_new = df_new[df_new.index > cutoff]
+        events, flag_state = _stream_flags(self._flag_state, _sorted(df_new), self.mode, 2 * self.ratio, self.close_thre,
+                                           self.len_ma, df_amt=self.df_amt_input, amt_threshold=self.amt_threshold, backend=self.backend)
+        new_flags = {}
+        for product, seq in events.items():
+            column = f"{product}_flag"
+            restated = seq.index <= cutoff if cutoff is not None else np.zeros(len(seq), dtype=bool)
+            if restated.any():
+                # 最后一根已处理K线按新数据重新判断
+                if isinstance(self._flag_store, FlagStore):
+                    self._flag_store.assign(seq.index[restated], product, seq.to_numpy()[restated])
+                else:
+                    self._flag_store.loc[seq.index[restated], column] = seq.to_numpy()[restated]
+            new_flags[column] = seq[~restated]
+        if new_flags:
+            df_flag_new = pd.DataFrame(new_flags).reindex(columns=[f"{product}_flag" for product in self.product_list]).sort_index()
+            if isinstance(self._flag_store, FlagStore):
+                self._flag_store.append(df_flag_new)
+            else:
+                self._flag_store = pd.concat([self._flag_store, df_flag_new])
+        self._flag_state = flag_state
+        self.end_date = end_date
+        if not reported:
+            return
+        
+        # 增量计算收益
+        frames_end, pending = self._return_state['frames_end'], self._return_state['pending']
+        if len(pending):
+            df_y_new = pd.concat([pending, df_y_new[df_y_new.index > pending.index.max()]])
+        pending = df_y_new[df_y_new.index > self.end_date]
+        df_y_new = df_y_new[(df_y_new.index >= self.begin_date) & (df_y_new.index <= self.end_date)]
+        if frames_end is not None:
+            df_y_new = df_y_new[df_y_new.index > frames_end]
+        ret_long, ret_short, ret_all, restated, trades, self._return_state = _stream_returns(
+            self._return_state, flag_state, events, df_y_new, calculated, self.cost, self.df_amt_input)
+        self._return_state['pending'] = pending
+        
+        stats = self._metric_stats
+        def accumulate(name, values, sign):
+            # 交易统计量可加，撤销旧收益时减去其统计量
+            values = np.asarray(values, dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if len(values):
+                stats[name] = tuple(a + sign * b for a, b in zip(stats[name], _side_stats(values)))
+        
+        # 改写已有收益序列中重新计算的K线，累计收益曲线从该K线起整体平移
+        frames = {'all': self._df_ret_all, 'long': self._df_ret_long, 'short': self._df_ret_short}
+        pnl_values = self.df_pnl.to_numpy(dtype=np.float64)
+        removed = np.zeros(len(self.ledger), dtype=bool)
+        exit_ts = pd.DatetimeIndex(self.ledger['exit_ts'])
+        codes = self.ledger['product'].cat.codes.to_numpy()
+        for ts, k, value_long, value_short, value_all in restated:
+            row = self._df_ret_all.index.get_loc(ts)
+            for j, (name, value) in enumerate((('all', value_all), ('long', value_long), ('short', value_short))):
+                old = frames[name].iat[row, k]
+                accumulate(name, [old], -1)
+                accumulate(name, [value], 1)
+                frames[name].iat[row, k] = value
+                pnl_values[row:, j] += np.nan_to_num(value) - np.nan_to_num(old)
+            removed |= (codes == k) & (exit_ts == ts)
+        self.df_pnl = pd.DataFrame(pnl_values, index=self.df_pnl.index, columns=self.df_pnl.columns)
+        
+        # 追加新K线的收益和累计收益曲线
+        new_frames = {}
+        for name, values in (('all', ret_all), ('long', ret_long), ('short', ret_short)):
+            accumulate(name, values, 1)
+            new_frames[name] = pd.DataFrame(values, index=df_y_new.index, columns=frames[name].columns)
+        self._df_ret_all = pd.concat([self._df_ret_all, new_frames['all']])
+        self._df_ret_long = pd.concat([self._df_ret_long, new_frames['long']])
+        self._df_ret_short = pd.concat([self._df_ret_short, new_frames['short']])
+        df_pnl_new = pd.DataFrame({f'return_{name}': np.nansum(values, axis=1) if values.shape[1] else np.zeros(len(values))
+                                   for name, values in (('all', ret_all), ('long', ret_long), ('short', ret_short))},
+                                  index=df_y_new.index).cumsum()
+        last_level = self.df_pnl.iloc[-1] if len(self.df_pnl) else 0
+        self.df_pnl = pd.concat([self.df_pnl, df_pnl_new + last_level])
+        
+        # 更新交易台账，保持每个品种内按平仓时间排序
+        ledger = pd.concat([self.ledger[~removed], trades], ignore_index=True)
+        order = np.lexsort((ledger['entry_ts'].to_numpy(), ledger['exit_ts'].to_numpy(), ledger['product'].cat.codes.to_numpy()))
+        self.ledger = ledger.iloc[order].reset_index(drop=True)
+        
+        pnl = np.diff(self.df_pnl['return_all'].to_numpy(), prepend=0.0)
+        self._dict, _ = _metrics_from_stats(stats, pnl, self.df_pnl, len(calculated))
+        # 收益已不再对应单个价格数据
+        self._df_y_report = None
+        self._product_metrics = {}
+            
+    def report_html(self,df_y,fold = 24,path = None,n_jobs = 1,max_points = DEFAULT_MAX_POINTS,renderer = 'svg',shared_plotlyjs = False):
         """
         为每个产品生成交互式HTML格式的回测报告和可视化结果
         
+        df_y与最近一次report使用的是同一个对象且指纹(形状、列名、索引首尾和抽样行的哈希)未变时，直接取report计算的收益列，
+        各品种的绩效指标也只计算一次并缓存；否则所有品种的收益在整个面板上一次计算。之后逐个品种绘图，
+        n_jobs大于1且指定path时在进程池中并行绘图和写出HTML
+        
+        注意: 指纹只抽样部分行，report之后原地修改df_y的个别数值可能检测不到，此时报告使用的仍是修改前的收益。
+        修改价格数据后请传入新的DataFrame或重新执行report
+        
         参数:
         df_y (DataFrame): 价格数据，index为datetime，columns为品种名称
         fold (int): 周期收益分析的周期数，默认24 (此参数在此方法中未直接使用，但保持接口一致性)
-        path (str): 结果保存路径的根目录，默认None (不保存，直接Jupyter显示)
+        path (str): 结果保存路径的根目录，默认None (不保存，直接Jupyter显示，此时始终串行)
+        n_jobs (int): 并行绘图的进程数，1为串行，-1为使用全部CPU核心，默认为1
+        max_points (int): 每条曲线用LTTB降采样后保留的最大点数，默认5000，None为绘制全部点；序列不超过max_points的2倍时不降采样，
+                          开平仓点始终完整保留
+        renderer (str): 'svg'或'webgl'，'webgl'时降采样前超过20000根K线的序列改用WebGL(Scattergl)绘制(与max_points无关)，
+                        回撤图和范围滑块保持SVG，默认'svg'
+        shared_plotlyjs (bool): 为True且指定path时，在 path/result/策略名/ 下写出一份plotly.min.js供所有品种的报告引用，
+                                图表数据以base64二进制类型数组(float32)写出，默认False(模板中的CDN地址，数据为JSON列表)
         """
         check_is_fitted(self,attributes=['_fitted'])
+        if renderer not in RENDERERS:
+            raise ValueError(f"Unsupported renderer: {renderer}, expected one of {RENDERERS}")
         df_y_filtered = df_y[(df_y.index>=self.begin_date)&(df_y.index<=self.end_date)]
         
         # self.flag 的列名应为 PRODUCT_flag 格式, 按日期过滤
-        common_index_flag = df_y_filtered.index.intersection(self.flag.index)
-        actual_flag_df_filtered_by_date = self.flag.loc[common_index_flag]
+        common_index_flag = df_y_filtered.index.intersection(self._flag_store.index)
+        actual_flag_df_filtered_by_date = self._flag_frame(common_index_flag)
 
-        # 使用 self.product_list (干净品种名列表) 进行迭代
-        for product_name in tqdm(self.product_list, desc=f"Generating reports for {self.name}"):
-            price_series_product = df_y_filtered.get(product_name)
-            raw_signal_series_product = self.df_x_input.get(product_name) 
-            turnover_series_product = None
-            if self.df_amt_input is not None:
-                turnover_series_product = self.df_amt_input.get(product_name)
-            
+        # 使用 self.product_list (干净品种名列表) 筛选可以生成报告的品种
+        products = []
+        for product_name in self.product_list:
             expected_signal_col_in_flag = f"{product_name}_flag" # 例如 "AP_flag"
-
-            if price_series_product is None:
+            if df_y_filtered.get(product_name) is None:
                 warnings.warn(f"Price data for {product_name} not found. Skipping this product for HTML report.")
                 continue
-            
             if expected_signal_col_in_flag not in actual_flag_df_filtered_by_date.columns:
                 warnings.warn(f"Processed signal column '{expected_signal_col_in_flag}' not found for product {product_name} in self.flag. Skipping this product for HTML report.")
                 continue
-            
-            signal_series_product = actual_flag_df_filtered_by_date[expected_signal_col_in_flag]
+            products.append(product_name)
+        
+        # 复用report计算的收益，否则整个面板一次计算所有品种的日收益 (all, long, short)
+        cached = self._df_y_report is df_y and all(f"{product_name}_all" in self._df_ret_all.columns for product_name in products)
+        if cached and _frame_fingerprint(df_y) != self._df_y_report_key:
+            warnings.warn("df_y was modified after report(), recomputing returns for the HTML report.")
+            cached = False
+            self._product_metrics = {}
+        if cached:
+            df_ret_all, df_ret_long, df_ret_short = self._df_ret_all, self._df_ret_long, self._df_ret_short
+        else:
+            df_ret_all, df_ret_long, df_ret_short = calculate_returns_all(
+                df_x=actual_flag_df_filtered_by_date,
+                df_y=df_y_filtered,
+                product_list=products,
+                cost=self.cost,
+                progress=False,
+                df_amt=self.df_amt_input
+            )
+        
+        # 共享的plotly.js在主进程中写出一次，各品种的报告只引用
+        shared_plotlyjs_dir = None
+        if path and shared_plotlyjs:
+            shared_plotlyjs_dir = os.path.join(path, "result", self.name)
+            write_plotlyjs(shared_plotlyjs_dir)
+        
+        tasks = []
+        for product_name in products:
+            price_series_product = df_y_filtered.get(product_name)
+            signal_series_product = actual_flag_df_filtered_by_date[f"{product_name}_flag"]
+            raw_signal_series_product = self.df_x_input.get(product_name) 
+            turnover_series_product = None
+            if self.df_amt_input is not None:
+                turnover_series_product = self.df_amt_input.get(product_name)
 
             if raw_signal_series_product is None:
                 warnings.warn(f"Raw strategy signal data for {product_name} not found in df_x_input. Plotting without raw signal.")
@@ -173,36 +529,31 @@ class BackTest:
             if turnover_series_product is not None and isinstance(turnover_series_product, pd.DataFrame):
                 turnover_series_product = turnover_series_product.squeeze() if turnover_series_product.shape[1] == 1 else turnover_series_product.iloc[:,0]
 
-            # 为单个产品计算日收益 (all, long, short)
-            # df_x_single_product 需要包含带 _flag 后缀的列名
-            df_x_single_product = pd.DataFrame({expected_signal_col_in_flag: signal_series_product})
-            df_y_single_product = pd.DataFrame({product_name: price_series_product})
-
-            df_ret_all_prod, df_ret_long_prod, df_ret_short_prod = calculate_returns_all(
-                df_x=df_x_single_product, 
-                df_y=df_y_single_product, 
-                product_list=[product_name], # 干净的产品名
-                cost=self.cost
-            )
-            
-            df_pnl_product, metrics_product = cal_metric(
-                df_all=df_ret_all_prod, 
-                df_long=df_ret_long_prod, 
-                df_short=df_ret_short_prod
-            )
-            
-            df_pnl_product = df_pnl_product.rename(columns={
-                'return_all': 'all_pnl',
-                'return_long': 'long_pnl',
-                'return_short': 'short_pnl'
-            })
+            # 取出该品种的收益列计算绩效指标，复用report的收益时缓存结果
+            if cached and product_name in self._product_metrics:
+                df_pnl_product, metrics_product, df_drawdown_product = self._product_metrics[product_name]
+            else:
+                df_pnl_product, metrics_product, df_drawdown_product = cal_metric(
+                    df_all=df_ret_all[[f"{product_name}_all"]], 
+                    df_long=df_ret_long[[f"{product_name}_long"]], 
+                    df_short=df_ret_short[[f"{product_name}_short"]],
+                    return_drawdown=True
+                )
+                
+                df_pnl_product = df_pnl_product.rename(columns={
+                    'return_all': 'all_pnl',
+                    'return_long': 'long_pnl',
+                    'return_short': 'short_pnl'
+                })
+                if cached:
+                    self._product_metrics[product_name] = (df_pnl_product, metrics_product, df_drawdown_product)
 
             product_output_dir = None
             if path:
                 product_output_dir = os.path.join(path, "result", self.name, product_name)
                 os.makedirs(product_output_dir, exist_ok=True)
 
-            generate_report_for_product(
+            tasks.append(dict(
                 product_name=product_name,
                 df_price_product_series=price_series_product,
                 df_signal_product_series=signal_series_product, # 这是处理后的信号 (0,1,-1)
@@ -211,7 +562,21 @@ class BackTest:
                 df_cumulative_pnl_for_this_product=df_pnl_product,
                 metrics_for_this_product=metrics_product,
                 strategy_name_overall=self.name,
-                output_dir_for_product_charts=product_output_dir
-            )
+                output_dir_for_product_charts=product_output_dir,
+                drawdown_for_this_product=df_drawdown_product,
+                max_points=max_points,
+                renderer=renderer,
+                shared_plotlyjs_dir=shared_plotlyjs_dir
+            ))
+        
+        # 直接显示时需要在主进程中绘图
+        n_jobs = min(resolve_n_jobs(n_jobs), max(len(tasks), 1)) if path else 1
+        desc = f"Generating reports for {self.name}"
+        if n_jobs == 1:
+            for task in tqdm(tasks, desc=desc):
+                generate_report_for_product(**task)
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                list(tqdm(executor.map(_render_product_report, tasks), total=len(tasks), desc=desc))
         
-        print(f"HTML reports generation for all products of strategy '{self.name}' completed.")
\ No newline at end of file
+        print(f"HTML reports generation for all products of strategy '{self.name}' completed.")
@@ -0,0 +1,175 @@
+import pandas as pd
+import numpy as np
+import itertools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from .CTA_BC.trade.trade_boll import _PANEL_MODES, _prepare_signal_panel, _pre_signal_panel, _signal_ma_panel, _compact_columns, _flag_panel  # 导入面板交易标志计算函数
+from .CTA_BC.metrics.cal_return import calculate_returns_all  # 导入收益率计算函数
+from .CTA_BC.metrics.cal_indicator import cal_metric      # 导入绩效指标计算函数
+from .CTA_BC.preprocess._utils import resolve_n_jobs
+
+# 参数网格中每个参数点的默认取值
+_GRID_DEFAULTS = {'open_thre': 2, 'close_thre': 0.8, 'len_ma': 500, 'mode': 'trade_ori'}
+
+# 工作进程中共享的预计算数据，由_init_sweep_worker设置
+_SWEEP_STATE = {}
+
+def _expand_grid(grid):
+    """
+    将参数网格整理为参数点列表
+
+    参数:
+    grid (dict/list/DataFrame): dict时对各参数取值做笛卡尔积，list时每个元素为一个参数点(dict)，
+                                DataFrame时每行为一个参数点
+
+    返回:
+    list: 参数点列表，每个元素包含open_thre、close_thre、len_ma、mode
+    """
+    if isinstance(grid, pd.DataFrame):
+        points = grid.to_dict('records')
+    elif isinstance(grid, dict):
+        keys = list(grid.keys())
+        values = [v if isinstance(v, (list, tuple, np.ndarray, pd.Index)) else [v] for v in grid.values()]
+        points = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    else:
+        points = [dict(point) for point in grid]
+
+    unknown = set().union(*[point.keys() for point in points]) - set(_GRID_DEFAULTS) if points else set()
+    if unknown:
+        raise ValueError(f"Unsupported grid parameters: {sorted(unknown)}")
+    points = [{**_GRID_DEFAULTS, **point} for point in points]
+    for point in points:
+        if point['mode'] not in _PANEL_MODES:
+            raise ValueError(f"Unsupported mode: {point['mode']}")
+        point['len_ma'] = int(point['len_ma'])
+    return points
+
+def _init_sweep_worker(state):
+    """
+    初始化工作进程，保存共享的预计算数据
+    """
+    _SWEEP_STATE.clear()
+    _SWEEP_STATE.update(state)
+
+def _sweep_point(point):
+    """
+    计算单个参数点的绩效指标
+
+    参数:
+    point (dict): 参数点，包含open_thre、close_thre、len_ma、mode
+
+    返回:
+    dict: 参数及cal_metric返回的各项绩效指标
+    """
+    state = _SWEEP_STATE
+    demean, use_amt = _PANEL_MODES[point['mode']]
+    flags, in_result = _flag_panel(
+        pre=state['pre'][demean],
+        signal_ma=state['signal_ma'][(demean, point['len_ma'])],
+        valid=state['valid'],
+        open_thre=point['open_thre'],
+        close_thre=point['close_thre'],
+        amt=state['amt'] if use_amt else None,
+        amt_threshold=state['amt_threshold'],
+        backend=state['backend']
+    )
+    rows = in_result & state['in_price']
+    df_flag = pd.DataFrame(flags[rows], index=state['index'][rows], columns=[f'{product}_flag' for product in state['product_list']])
+
+    result = dict(point)
+    df_ret_all, df_ret_long, df_ret_short = calculate_returns_all(
+        df_x=df_flag,
+        df_y=state['df_y'],
+        product_list=state['product_list'],
+        cost=state['cost'],
+        progress=False,
+        df_amt=state['df_amt']
+    )
+    if df_ret_all.shape[1] == 0:
+        return result
+    _, _dict = cal_metric(df_all=df_ret_all, df_long=df_ret_long, df_short=df_ret_short)
+    result.update(_dict)
+    return result
+
+def param_sweep(df_x, df_y, product_list, grid, begin_date='2018-01-01', end_date='2024-08-04', cost=0, df_amt=None, amt_threshold=20*1e8, backend='numpy', n_jobs=1):
+    """
+    对open_thre / close_thre / len_ma / mode参数网格批量回测
+
+    信号面板的整理、每个不同窗口长度的signal_ma以及价格数据的日期对齐都只计算一次，
+    各参数点之间共享，参数点可以分配到多个进程并行计算
+
+    参数:
+    df_x (DataFrame): 策略信号数据，index为datetime，columns为品种名称
+    df_y (DataFrame): 价格数据，index为datetime，columns为品种名称
+    product_list (list): 要回测的品种列表
+    grid (dict/list/DataFrame): 参数网格，dict时对各参数取值做笛卡尔积，如
+                                {'open_thre': [1.5, 2], 'close_thre': [0.5, 0.8], 'len_ma': [250, 500], 'mode': ['trade_ori']}
+                                未给出的参数使用默认值(open_thre=2, close_thre=0.8, len_ma=500, mode='trade_ori')
+    begin_date (str): 回测开始日期，默认'2018-01-01'
+    end_date (str): 回测结束日期，默认'2024-08-04'
+    cost (float/CostModel): 交易成本，默认0，CostModel时各参数点共用同一成本模型
+    df_amt (DataFrame): 成交量数据，在需要考虑成交量的模式下以及CostModel计算冲击成本时使用
+    amt_threshold (float): 成交量阈值，仅在需要考虑成交量的模式下使用
+    backend (str): 交易标志计算后端，'numpy'或'numba'，默认'numpy'
+    n_jobs (int): 并行进程数，1为串行，-1为使用全部CPU核心，默认1
+
+    返回:
+    DataFrame: 每行对应一个参数点，包含参数及cal_metric返回的各项绩效指标
+    """
+    points = _expand_grid(grid)
+    if not points:
+        return pd.DataFrame(columns=list(_GRID_DEFAULTS))
+    df_x = df_x if df_x.index.is_monotonic_increasing else df_x.sort_index()
+
+    # 信号面板只整理一次
+    index, compact, valid, counts = _prepare_signal_panel(df_x, product_list, begin_date, end_date)
+    demeans = sorted({_PANEL_MODES[point['mode']][0] for point in points})
+    pre = {demean: _pre_signal_panel(compact, counts, demean=demean) for demean in demeans}
+
+    # 每个不同的(是否中心化, 窗口长度)只计算一次移动平均
+    signal_ma = {}
+    for demean, len_ma in sorted({(_PANEL_MODES[point['mode']][0], point['len_ma']) for point in points}):
+        signal_ma[(demean, len_ma)] = _signal_ma_panel(pre[demean], len_ma)
+
+    amt = None
+    if any(_PANEL_MODES[point['mode']][1] for point in points):
+        if df_amt is None:
+            raise ValueError("df_amt is required for the amtclean modes.")
+        amt_values = df_amt.loc[:, list(product_list)].reindex(index).to_numpy(dtype=np.float64)
+        amt = _compact_columns(amt_values, valid)
+
+    # 价格数据的日期过滤与对齐只做一次
+    filtered_df_y = df_y[(df_y.index >= begin_date) & (df_y.index <= end_date)]
+    missing = [product for product in product_list if product not in filtered_df_y.columns]
+    if missing:
+        warnings.warn(f"Price data for {missing} not found. These products are skipped in the sweep.")
+    filtered_df_y = filtered_df_y.loc[:, [product for product in product_list if product in filtered_df_y.columns]]
+
+    state = {
+        'index': index,
+        'valid': valid,
+        'pre': pre,
+        'signal_ma': signal_ma,
+        'amt': amt,
+        'amt_threshold': amt_threshold,
+        'backend': backend,
+        'in_price': index.isin(filtered_df_y.index),
+        'df_y': filtered_df_y,
+        'product_list': list(product_list),
+        'cost': cost,
+        'df_amt': df_amt,
+    }
+
+    n_jobs = min(resolve_n_jobs(n_jobs), len(points))
+    if n_jobs == 1:
+        _init_sweep_worker(state)
+        try:
+            results = [_sweep_point(point) for point in tqdm(points, desc='Parameter sweep')]
+        finally:
+            _SWEEP_STATE.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_sweep_worker, initargs=(state,)) as executor:
+            results = list(tqdm(executor.map(_sweep_point, points), total=len(points), desc='Parameter sweep'))
+
+    return pd.DataFrame(results)
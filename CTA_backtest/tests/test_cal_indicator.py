@@ -0,0 +1,154 @@
+"""
+绩效指标的回归测试
+
+以重构前逐项扫描收益矩阵的cal_metric(原样保留在本文件中)作为参考，检查:
+- cal_metric的18项交易指标的键、顺序和取值与旧实现一致，累计收益曲线一致，包括某一方向没有交易的情况
+- 基于交易台账的cal_metric_ledger与cal_metric的指标、累计收益曲线和回撤一致
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from CTA_backtest.CTA_BC.metrics.cal_indicator import _METRIC_KEYS, cal_metric, cal_metric_ledger
+from CTA_backtest.CTA_BC.metrics.cal_return import calculate_returns_all
+from CTA_backtest.tests.test_cal_return import SEEDS, _make_prices_flags
+
+PRODUCTS = ['AA', 'BB', 'CC', 'DD']
+
+
+# ---------------------------------------------------------------------------
+# 旧实现，原样保留作为参考
+# ---------------------------------------------------------------------------
+
+def legacy_cal_metric(df_all,df_long,df_short):
+    """
+    计算策略的各项绩效指标
+
+    参数:
+    df_all (DataFrame): 总体收益数据，包含多头和空头
+    df_long (DataFrame): 多头收益数据
+    df_short (DataFrame): 空头收益数据
+
+    返回:
+    df_pnl (DataFrame): 累计收益曲线数据
+    _dict (dict): 包含各项绩效指标的字典
+    """
+
+    # 合并总体、多头和空头的收益数据
+    _df_all = pd.DataFrame(df_all.sum(axis = 1),columns = ['return_all'])
+    _df_long = pd.DataFrame(df_long.sum(axis = 1),columns = ['return_long'])
+    _df_short = pd.DataFrame(df_short.sum(axis = 1),columns = ['return_short'])
+
+    df_plot = pd.merge(_df_all,_df_long,on = 'datetime',how = 'left')
+    df_plot = pd.merge(df_plot,_df_short,on = 'datetime',how = 'left')
+    df_pnl = df_plot.cumsum()  # 计算累计收益
+
+    # 计算胜率 (正收益交易占比)
+    all_win_rate = (df_all > 0).sum().sum() / (pd.notnull(df_all)).sum().sum()
+    long_win_rate = (df_long > 0).sum().sum() / (pd.notnull(df_long)).sum().sum()
+    short_win_rate = (df_short > 0).sum().sum() / (pd.notnull(df_short)).sum().sum()
+
+    # 计算盈亏比 (盈利交易总和/亏损交易总和的绝对值)
+    all_profit = df_all[df_all > 0].sum().sum()
+    all_loss = abs(df_all[df_all < 0]).sum().sum()
+    all_ProfitLoss_ratio = all_profit / all_loss if all_loss > 0 else float('inf')
+
+    long_profit = df_long[df_long > 0].sum().sum()
+    long_loss = abs(df_long[df_long < 0]).sum().sum()
+    long_ProfitLoss_ratio = long_profit / long_loss if long_loss > 0 else float('inf')
+
+    short_profit = df_short[df_short > 0].sum().sum()
+    short_loss = abs(df_short[df_short < 0]).sum().sum()
+    short_ProfitLoss_ratio = short_profit / short_loss if short_loss > 0 else float('inf')
+
+    # 计算交易次数
+    count_all = (pd.notnull(df_all)).sum().sum()
+    count_long = (pd.notnull(df_long)).sum().sum()
+    count_short = (pd.notnull(df_short)).sum().sum()
+
+    # 计算平均收益率
+    MeanRet_all = df_all.sum().sum() / count_all if count_all > 0 else 0
+    MeanRet_long = df_long.sum().sum() / count_long if count_long > 0 else 0
+    MeanRet_short = df_short.sum().sum() / count_short if count_short > 0 else 0
+
+    # 计算交易天数和日均交易次数
+    day_len = len(pd.Series(df_all.index).apply(lambda x: str(x)[:10]).unique())
+    count_all_D = count_all/day_len if day_len > 0 else 0
+    count_long_D = count_long/day_len if day_len > 0 else 0
+    count_short_D = count_short/day_len if day_len > 0 else 0
+
+    # 计算总利润
+    all_profit = df_pnl['return_all'].iloc[-1]
+    long_profit = df_pnl['return_long'].iloc[-1]
+    short_profit = df_pnl['return_short'].iloc[-1]
+
+    # 汇总所有指标到字典
+    _dict = {
+            'all_win_rate': all_win_rate,         # 总体胜率
+            'long_win_rate': long_win_rate,       # 多头胜率
+            'short_win_rate': short_win_rate,     # 空头胜率
+            'all_ProfitLoss_ratio': all_ProfitLoss_ratio,     # 总体盈亏比
+            'long_ProfitLoss_ratio': long_ProfitLoss_ratio,   # 多头盈亏比
+            'short_ProfitLoss_ratio': short_ProfitLoss_ratio, # 空头盈亏比
+            'MeanRet_all': MeanRet_all,           # 总体平均收益
+            'MeanRet_long': MeanRet_long,         # 多头平均收益
+            'MeanRet_short': MeanRet_short,       # 空头平均收益
+            'count_all': count_all,               # 总交易次数
+            'count_long': count_long,             # 多头交易次数
+            'count_short': count_short,           # 空头交易次数
+            'count_all_D': count_all_D,           # 日均总交易次数
+            'count_long_D': count_long_D,         # 日均多头交易次数
+            'count_short_D': count_short_D,       # 日均空头交易次数
+            'all_profit': all_profit,             # 总利润
+            'long_profit': long_profit,           # 多头总利润
+            'short_profit': short_profit          # 空头总利润
+            }
+
+    return df_pnl,_dict
+
+
+def _returns(seed, pnl_mode='close', long_only=False):
+    """
+    在合成的价格和交易标志上计算收益和交易台账，long_only=True时去掉空头开仓
+    """
+    df_y, df_x = _make_prices_flags(seed)
+    if long_only:
+        df_x = df_x.mask(df_x == -1)
+    return calculate_returns_all(df_x, df_y, PRODUCTS, cost=0.0003, progress=False, return_ledger=True, pnl_mode=pnl_mode)
+
+
+# ---------------------------------------------------------------------------
+# cal_metric
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('long_only', [False, True])
+@pytest.mark.parametrize('pnl_mode', ['close', 'mtm'])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_cal_metric_matches_legacy(seed, pnl_mode, long_only):
+    df_all, df_long, df_short, _ = _returns(seed, pnl_mode, long_only)
+    with np.errstate(invalid='ignore'):
+        expected_pnl, expected = legacy_cal_metric(df_all, df_long, df_short)
+    df_pnl, _dict = cal_metric(df_all, df_long, df_short)
+
+    assert list(expected) == _METRIC_KEYS
+    assert list(_dict)[:len(_METRIC_KEYS)] == _METRIC_KEYS  # 18项交易指标在前，顺序不变
+    assert {key: _dict[key] for key in _METRIC_KEYS} == pytest.approx(expected, rel=1e-12, nan_ok=True)
+    assert np.isnan(_dict['short_win_rate']) == long_only
+    pd.testing.assert_frame_equal(df_pnl, expected_pnl, check_exact=False, rtol=1e-12)
+
+
+# ---------------------------------------------------------------------------
+# cal_metric_ledger
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('long_only', [False, True])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_cal_metric_ledger_matches_cal_metric(seed, long_only):
+    df_all, df_long, df_short, ledger = _returns(seed, long_only=long_only)
+    df_pnl, _dict, df_drawdown = cal_metric(df_all, df_long, df_short, return_drawdown=True)
+    ledger_pnl, ledger_dict, ledger_drawdown = cal_metric_ledger(ledger, df_all.index, return_drawdown=True)
+
+    assert list(ledger_dict) == list(_dict)
+    assert ledger_dict == pytest.approx(_dict, rel=1e-12, nan_ok=True)
+    pd.testing.assert_frame_equal(ledger_pnl, df_pnl, check_exact=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(ledger_drawdown, df_drawdown, check_exact=False, rtol=1e-12, atol=1e-12)
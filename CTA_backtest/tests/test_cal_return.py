@@ -0,0 +1,206 @@
+"""
+收益计算的回归测试
+
+以向量化之前逐行遍历的calculate_returns/calculate_returns_all(原样保留在本文件中)作为参考，在固定随机种子的合成数据上检查:
+- 单品种calculate_returns与旧实现完全一致，包括重复开仓、非1/-1/0的标志、NaN仓位和NaN价格
+- calculate_returns_all在有无交易成本、串行和多进程(n_jobs>1)下与旧实现完全一致
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from tqdm import tqdm
+
+from CTA_backtest.CTA_BC.metrics.cal_return import calculate_returns, calculate_returns_all
+
+SEEDS = [0, 1, 2]
+
+
+# ---------------------------------------------------------------------------
+# 旧实现: 逐行遍历，原样保留作为参考
+# ---------------------------------------------------------------------------
+
+def legacy_calculate_returns(df,cost):
+    """
+    计算单个品种的交易收益
+
+    参数:
+    df (DataFrame): 包含价格和仓位数据的DataFrame
+    cost (float): 交易成本
+
+    返回:
+    _df_pnl (DataFrame): 包含多头、空头和总体收益的DataFrame
+    """
+    open_prices = {'long': None, 'short': None}
+    for i, row in df.iterrows():
+        if row['position'] == 1:
+            # 开多仓
+            open_prices['long'] = row['price']
+        elif row['position'] == -1:
+            # 开空仓
+            open_prices['short'] = row['price']
+        elif row['position'] == 0:
+            if open_prices['long'] is not None:
+                # 平多仓，计算收益 = (平仓价/开仓价-1)-成本
+                df.at[i, 'return_long'] = ((row['price'] / open_prices['long']) - 1) - cost
+                open_prices['long'] = None
+            if open_prices['short'] is not None:
+                # 平空仓，计算收益 = (1-平仓价/开仓价)-成本
+                df.at[i, 'return_short'] = (1 - (row['price'] / open_prices['short'])) - cost
+                open_prices['short'] = None
+
+    # 提取收益数据并计算总收益
+    _df_pnl = df.loc[:,['return_long','return_short']]
+    _df_pnl['return'] = np.where(
+                                (_df_pnl['return_long'].isna() & _df_pnl['return_short'].isna()),
+                                np.nan,
+                                _df_pnl['return_long'].fillna(0) + _df_pnl['return_short'].fillna(0)
+                            )
+    return _df_pnl
+
+def legacy_calculate_returns_all(df_x,df_y,product_list,cost = 0):
+    """
+    计算多品种的总体收益
+
+    参数:
+    df_x (DataFrame): 交易信号数据
+    df_y (DataFrame): 价格数据
+    product_list (list): 品种列表
+    cost (float): 交易成本，默认为0
+
+    返回:
+    _df_ret_all (DataFrame): 所有品种的总体收益
+    _df_ret_long (DataFrame): 所有品种的多头收益
+    _df_ret_short (DataFrame): 所有品种的空头收益
+    """
+    _df_ret_long = pd.DataFrame(index=df_y.index)
+    _df_ret_short = pd.DataFrame(index=df_y.index)
+    _df_ret_all = pd.DataFrame(index=df_y.index)
+
+    # 遍历每个品种计算收益
+    for product in tqdm(product_list, disable=True):
+        # 获取价格数据
+        if product not in df_y.columns:
+            warnings.warn(f"产品 {product} 在价格数据中不存在，跳过")
+            continue
+
+        base_price = df_y.loc[:,[product]]
+
+        # 获取信号数据 - 修复：兼容直接使用产品名或带_flag后缀
+        flag_column = f"{product}_flag"
+        if flag_column in df_x.columns:
+            factor_flag = df_x.loc[:,[flag_column]].dropna()
+        elif product in df_x.columns:
+            factor_flag = df_x.loc[:,[product]].dropna()
+        else:
+            warnings.warn(f"产品 {product} 的信号数据不存在 (检查了 '{product}' 和 '{flag_column}')，跳过")
+            continue
+
+        # 过滤日期
+        base_price = base_price[base_price.index >= '2018-01-01']
+        base_price.columns = ['price']
+        factor_flag.columns = ['position']
+
+        # 确保索引名称一致，以便合并
+        if base_price.index.name != factor_flag.index.name:
+            # 如果索引名称不同，让我们确保至少一个为'datetime'
+            if base_price.index.name != 'datetime':
+                base_price.index.name = 'datetime'
+            if factor_flag.index.name != 'datetime':
+                factor_flag.index.name = 'datetime'
+
+        # 合并价格和信号数据
+        try:
+            _df = pd.merge(base_price, factor_flag, left_index=True, right_index=True)
+        except Exception as e:
+            warnings.warn(f"合并产品 {product} 的价格和信号数据时出错: {str(e)}，尝试重置索引名称")
+            # 如果合并失败，尝试重置索引名称后再次合并
+            base_price_reset = base_price.reset_index()
+            factor_flag_reset = factor_flag.reset_index()
+            _df = pd.merge(base_price_reset, factor_flag_reset, on=base_price_reset.columns[0], how='right')
+            _df = _df.set_index(base_price_reset.columns[0])
+
+        _df.sort_index(inplace = True)
+
+        # 初始化收益列
+        _df['return_long'] = np.nan
+        _df['return_short'] = np.nan
+
+        # 计算收益
+        _df_ret = legacy_calculate_returns(df=_df, cost=cost)
+
+        # 将收益存入结果DataFrame
+        _df_ret_long[f'{product}_long'] = np.nan
+        _df_ret_short[f'{product}_short'] = np.nan
+        _df_ret_all[f'{product}_all'] = np.nan
+        _df_ret_long.loc[_df_ret.index, f'{product}_long'] = _df_ret['return_long']
+        _df_ret_short.loc[_df_ret.index, f'{product}_short'] = _df_ret['return_short']
+        _df_ret_all.loc[_df_ret.index, f'{product}_all'] = _df_ret['return']
+
+    return _df_ret_all,_df_ret_long,_df_ret_short
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+# ---------------------------------------------------------------------------
+
+def _random_positions(rng, n):
+    """
+    随机仓位标志: 包含连续重复开仓、多空交替、非1/-1/0的标志(2)和NaN
+    """
+    return rng.choice([1, -1, 0, 2, np.nan], size=n, p=[0.15, 0.15, 0.2, 0.05, 0.45])
+
+def _make_prices_flags(seed, n=2000, products=('AA', 'BB', 'CC', 'DD')):
+    """
+    生成价格和交易标志面板
+
+    价格从2018年之前开始(检查日期过滤)，含NaN价格和缺失的K线；交易标志使用完整的时间索引，
+    部分列使用不带_flag后缀的列名
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2017-12-25', periods=n, freq='1h', name='datetime')
+    price = pd.DataFrame({product: 100 * np.exp(np.cumsum(rng.normal(0, 0.01, size=n))) for product in products}, index=index)
+    for product in products:
+        price.loc[price.index[rng.choice(n, 20, replace=False)], product] = np.nan
+    flags = pd.DataFrame({(f'{product}_flag' if k % 2 == 0 else product): _random_positions(rng, n)
+                          for k, product in enumerate(products)}, index=index)
+    price = price.drop(index[rng.choice(n, 100, replace=False)])  # 信号时刻不在价格数据中
+    return price, flags
+
+
+# ---------------------------------------------------------------------------
+# 单品种
+# ---------------------------------------------------------------------------
+
+def test_calculate_returns_matches_legacy():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n = int(rng.integers(1, 60))
+        df = pd.DataFrame({'price': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, size=n))), 'position': _random_positions(rng, n)})
+        df.loc[rng.random(n) < 0.1, 'price'] = np.nan
+        df['return_long'] = np.nan
+        df['return_short'] = np.nan
+        cost = float(rng.choice([0, 0.0003]))
+        expected = legacy_calculate_returns(df.copy(), cost)
+        result = calculate_returns(df.copy(), cost)
+        pd.testing.assert_frame_equal(result, expected)
+
+
+# ---------------------------------------------------------------------------
+# 多品种
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+@pytest.mark.parametrize('cost', [0, 0.0003])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_calculate_returns_all_matches_legacy(seed, cost, n_jobs):
+    df_y, df_x = _make_prices_flags(seed)
+    products = ['AA', 'BB', 'CC', 'DD', 'EE']  # EE不在价格数据中，两种实现都跳过
+    with pytest.warns(UserWarning, match='EE'):
+        expected = legacy_calculate_returns_all(df_x, df_y, products, cost=cost)
+    with pytest.warns(UserWarning, match='EE'):
+        result = calculate_returns_all(df_x, df_y, products, cost=cost, progress=False, n_jobs=n_jobs)
+    for res, exp in zip(result, expected):
+        assert exp.notna().any().all()  # 每个品种确实产生了收益
+        pd.testing.assert_frame_equal(res, exp)
@@ -0,0 +1,85 @@
+"""
+HTML报告降采样的测试
+
+检查LTTB降采样后的序列:
+- 保留首尾点、全局最高最低点和所有开平仓K线，取值与原序列一致且按时间排序
+- 输出长度在max_points与max_points加上必保留点数之间，每个中间桶恰好保留一个点
+- 序列长度不超过max_points的DOWNSAMPLE_MIN_RATIO倍时原样返回
+- 价格图的持仓区间覆盖整个y轴范围
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from CTA_backtest.CTA_BC.preprocess._plot_pro import (
+    DOWNSAMPLE_MIN_RATIO, _create_price_signal_plot_single, _downsample_series, _lttb_indices, generate_report_for_product,
+)
+
+MAX_POINTS = 500
+
+
+def _make_series(seed, n):
+    """
+    随机游走价格和随机的开平仓标志，价格中有一段NaN
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2019-01-01', periods=n, freq='min')
+    series = pd.Series(np.cumsum(rng.normal(size=n)) + 100, index=index)
+    series.iloc[n // 3:n // 3 + 20] = np.nan
+    flag = pd.Series(np.nan, index=index)
+    flag.iloc[rng.choice(n, 200, replace=False)] = rng.choice([1, -1, 0], 200)
+    return series, flag.index[flag.notna().to_numpy()]
+
+@pytest.mark.parametrize('n', [5000, 20000, 100000])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_downsample_keeps_required_points(seed, n):
+    series, keep = _make_series(seed, n)
+    result = _downsample_series(series, MAX_POINTS, keep=keep)
+
+    assert result.index.is_monotonic_increasing and result.index.is_unique
+    pd.testing.assert_series_equal(result, series.loc[result.index])
+    assert MAX_POINTS <= len(result) <= MAX_POINTS + 2 + len(keep)
+    assert result.index[0] == series.index[0] and result.index[-1] == series.index[-1]
+    assert series.idxmax() in result.index and series.idxmin() in result.index
+    assert keep.isin(result.index).all()
+
+def test_downsample_skips_short_series():
+    series, keep = _make_series(0, DOWNSAMPLE_MIN_RATIO * MAX_POINTS)
+    assert _downsample_series(series, MAX_POINTS, keep=keep) is series
+    assert _downsample_series(series, None) is series
+    assert len(_downsample_series(series, MAX_POINTS - 1)) < len(series)
+
+@pytest.mark.parametrize('n, n_out', [(10, 5), (1001, 3), (100000, 5000), (12345, 678)])
+def test_lttb_one_point_per_bucket(n, n_out):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.uniform(0, 1e12, n))
+    y = np.cumsum(rng.normal(size=n))
+    rows = _lttb_indices(x, y, n_out)
+
+    assert len(rows) == n_out
+    assert rows[0] == 0 and rows[-1] == n - 1
+    assert np.all(np.diff(rows) > 0)
+    # 中间各桶恰好保留一个点
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64) + 1
+    np.testing.assert_array_equal(np.searchsorted(edges, rows[1:-1], side='right') - 1, np.arange(n_out - 2))
+    np.testing.assert_array_equal(_lttb_indices(x, y, n), np.arange(n))
+
+def test_regions_span_price_axis(tmp_path):
+    series, keep = _make_series(0, 5000)
+    flag = pd.Series(np.nan, index=series.index)
+    flag.loc[keep] = np.tile([1, 0, -1, 0], len(keep) // 4 + 1)[:len(keep)]
+    fig = _create_price_signal_plot_single(series, flag, MAX_POINTS)
+    y_low, y_high = fig.layout.yaxis.range
+    assert y_low < series.min() and y_high > series.max()
+    regions = [trace for trace in fig.data if trace.fill == 'toself']
+    assert len(regions) == 2
+    for trace in regions:
+        y = np.array([v for v in trace.y if v is not None], dtype=np.float64)
+        assert y.min() == y_low and y.max() == y_high
+
+    # 综合报告的价格行使用同样的y轴范围
+    pnl = pd.DataFrame({'all_pnl': 0.0, 'long_pnl': 0.0, 'short_pnl': 0.0}, index=series.index)
+    report = generate_report_for_product('AA', series, flag, series, None, pnl, {}, 'test', str(tmp_path),
+                                         drawdown_for_this_product=pd.DataFrame({'drawdown': 0.0}, index=series.index),
+                                         max_points=MAX_POINTS)
+    assert tuple(report.layout.yaxis.range) == (y_low, y_high)
@@ -0,0 +1,531 @@
+"""
+交易标志生成的回归测试
+
+以重构前逐点双重循环的实现(原样保留在本文件中)作为参考，在固定随机种子的合成信号上检查:
+- 线性时间状态机(numpy/numba两种后端)与旧实现的标志完全一致，包括阈值为NaN的区间和成交量过滤
+- 各交易模式的单品种函数与旧实现一致
+- create_trade_flag的面板计算(panel=True)与逐品种计算(panel=False)及旧实现一致
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from CTA_backtest.CTA_BC.trade.trade_boll import (
+    _run_state_machine, _state_machine_jit, clear_signal_ma_cache, create_trade_flag,
+    set_signal_ma_cache_limit, signal_ma_cache_nbytes,
+    trade_ori, trade_factor_mean, trade_ori_amtclean, trade_factor_mean_amtclean,
+)
+
+SEEDS = [0, 1, 2]
+LEN_MA = 50
+AMT_THRESHOLD = 20 * 1e8
+BACKENDS = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(_state_machine_jit is None, reason="numba is not installed"))]
+
+
+# ---------------------------------------------------------------------------
+# 旧实现: 逐点双重循环，原样保留作为参考
+# ---------------------------------------------------------------------------
+
+def _legacy_state_machine(signal_values, long_threshold, short_threshold, close_long_threshold, close_short_threshold, amt_ma22, amt_threshold):
+    flags = np.full(len(signal_values), np.nan)
+    close_num = 0
+    
+    # 使用向量化操作
+    for i in range(len(signal_values)):
+        if i <= close_num:
+            continue
+            
+        # 开多仓条件
+        if (signal_values[i] > long_threshold[i]) and (amt_ma22[i] > amt_threshold):
+            for j in range(i, len(signal_values)):
+                if signal_values[j] < close_long_threshold[j]:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                    
+        # 开空仓条件
+        elif (signal_values[i] < short_threshold[i]) and (amt_ma22[i] > amt_threshold):
+            for j in range(i, len(signal_values)):
+                if signal_values[j] > close_short_threshold[j]:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+    return flags
+
+
+# 重构前的单品种交易函数，原样保留
+
+def legacy_trade_ori(df, open_thre=2, close_thre=0.8, len_ma=500):
+    """
+    基础交易信号生成函数，根据信号强度开平仓
+    
+    参数:
+    df (DataFrame): 信号数据，包含一列信号值
+    open_thre (float): 开仓阈值系数，默认为2
+    close_thre (float): 平仓阈值系数，默认为0.8
+    len_ma (int): 移动平均窗口长度，默认为500
+    
+    返回:
+    DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
+    """
+    _df = df.copy()
+    _df.dropna(inplace=True)
+    _df.columns = ['signal']
+    _df['pre_signal'] = _df['signal'].shift(1)  # 信号前移一位，用于下一时刻交易
+    _df['signal_ma'] = (_df['pre_signal'].abs()).rolling(len_ma).mean()  # 计算信号绝对值的移动平均
+    _df.dropna(inplace=True)
+    
+    # 计算开仓和平仓阈值
+    _df['long_threshold'] = _df['signal_ma'] * open_thre  # 开多仓阈值
+    _df['short_threshold'] = -_df['signal_ma'] * open_thre  # 开空仓阈值
+    _df['close_long_threshold'] = -_df['signal_ma'] * close_thre  # 平多仓阈值
+    _df['close_short_threshold'] = _df['signal_ma'] * close_thre  # 平空仓阈值
+    
+    # 获取各阈值列的值
+    signal_values = _df['pre_signal'].values
+    long_threshold = _df['long_threshold'].values
+    short_threshold = _df['short_threshold'].values
+    close_long_threshold = _df['close_long_threshold'].values
+    close_short_threshold = _df['close_short_threshold'].values
+    
+    flags = np.full(len(_df), np.nan)  # 初始化交易标志数组
+    close_num = 0  # 记录最近一次平仓位置
+    
+    # 循环生成交易标志
+    for i in range(len(signal_values)):
+        if i <= close_num:
+            continue  # 跳过已处理的位置
+            
+        # 开多仓条件：信号值大于开多仓阈值
+        if signal_values[i] > long_threshold[i]:
+            for j in range(i, len(signal_values)):
+                # 平多仓条件：信号值小于平多仓阈值
+                if signal_values[j] < close_long_threshold[j]:
+                    flags[i] = 1  # 开多仓
+                    flags[j] = 0  # 平多仓
+                    close_num = j
+                    break
+                # 到达序列末尾，强制平仓
+                elif j == len(signal_values) - 1:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                    
+        # 开空仓条件：信号值小于开空仓阈值
+        elif signal_values[i] < short_threshold[i]:
+            for j in range(i, len(signal_values)):
+                # 平空仓条件：信号值大于平空仓阈值
+                if signal_values[j] > close_short_threshold[j]:
+                    flags[i] = -1  # 开空仓
+                    flags[j] = 0  # 平空仓
+                    close_num = j
+                    break
+                # 到达序列末尾，强制平仓
+                elif j == len(signal_values) - 1:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+    
+    _df['flag'] = flags
+    return _df.loc[:,['flag']]
+
+def legacy_trade_factor_mean(df,open_thre,close_thre,len_ma):
+    """
+    因子均值化交易信号生成函数，先对信号均值中心化再生成交易标志
+    
+    参数:
+    df (DataFrame): 信号数据，包含一列信号值
+    open_thre (float): 开仓阈值系数
+    close_thre (float): 平仓阈值系数
+    len_ma (int): 移动平均窗口长度
+    
+    返回:
+    DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
+    """
+    _df = df.copy()
+    _df.dropna(inplace = True)
+    _df.columns = ['signal']
+    _df['pre_signal'] = _df['signal'].shift(1) #收益率计算用的是open开仓，所以在这里需要shift1
+    _df['pre_signal'] = _df['pre_signal'] - _df['pre_signal'].mean()
+    _df['signal_ma'] = (_df['pre_signal'].abs()).rolling(len_ma).mean()
+    _df.dropna(inplace = True)
+    
+    _df['long_threshold'] = _df['signal_ma'] * open_thre
+    _df['short_threshold'] = -_df['signal_ma'] * open_thre
+    _df['close_long_threshold'] = -_df['signal_ma'] * close_thre
+    _df['close_short_threshold'] = _df['signal_ma'] * close_thre
+    
+    signal_values = _df['pre_signal'].values
+    long_threshold = _df['long_threshold'].values
+    short_threshold = _df['short_threshold'].values
+    close_long_threshold = _df['close_long_threshold'].values
+    close_short_threshold = _df['close_short_threshold'].values
+    
+    flags = np.full(len(_df), np.nan)
+    close_num = 0
+    
+    # 使用向量化操作
+    for i in range(len(signal_values)):
+        if i <= close_num:
+            continue
+            
+        # 开多仓条件
+        if signal_values[i] > long_threshold[i]:
+            for j in range(i, len(signal_values)):
+                if signal_values[j] < close_long_threshold[j]:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                    
+        # 开空仓条件
+        elif signal_values[i] < short_threshold[i]:
+            for j in range(i, len(signal_values)):
+                if signal_values[j] > close_short_threshold[j]:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+    
+    _df['flag'] = flags
+    return _df.loc[:,['flag']]
+
+
+def legacy_trade_ori_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , amt_threshold = 20 * 1e8):
+    """
+    考虑成交量的交易信号生成函数，只在成交量超过阈值时开仓
+    
+    参数:
+    df (DataFrame): 信号数据，包含一列信号值
+    df_amt (DataFrame): 成交量数据
+    open_thre (float): 开仓阈值系数，默认为2
+    close_thre (float): 平仓阈值系数，默认为0.8
+    len_ma (int): 移动平均窗口长度，默认为500
+    amt_threshold (float): 成交量阈值，默认为20*1e8
+    
+    返回:
+    DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
+    """
+    _df = df.copy()
+    _df.dropna(inplace=True)
+
+    _amt = df_amt.loc[:,_df.columns]
+    _amt.columns = ['amt_ma22']
+
+    _df.columns = ['signal']
+    _df['pre_signal'] = _df['signal'].shift(1)
+    _df['signal_ma'] = (_df['pre_signal'].abs()).rolling(len_ma).mean()
+    _df.dropna(inplace=True)
+    
+    _df['long_threshold'] = _df['signal_ma'] * open_thre
+    _df['short_threshold'] = -_df['signal_ma'] * open_thre
+    _df['close_long_threshold'] = -_df['signal_ma'] * close_thre
+    _df['close_short_threshold'] = _df['signal_ma'] * close_thre
+    
+    signal_values = _df['pre_signal'].values
+    long_threshold = _df['long_threshold'].values
+    short_threshold = _df['short_threshold'].values
+    close_long_threshold = _df['close_long_threshold'].values
+    close_short_threshold = _df['close_short_threshold'].values
+
+    _df = pd.merge(_df,_amt,on = 'datetime',how = 'left')
+    amt_ma22 = _df['amt_ma22'].values
+    
+    flags = np.full(len(_df), np.nan)
+    close_num = 0
+    
+    # 使用向量化操作
+    for i in range(len(signal_values)):
+        if i <= close_num:
+            continue
+            
+        # 开多仓条件
+        if (signal_values[i] > long_threshold[i]) and (amt_ma22[i] > amt_threshold):
+            for j in range(i, len(signal_values)):
+                if signal_values[j] < close_long_threshold[j]:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                    
+        # 开空仓条件
+        elif (signal_values[i] < short_threshold[i]) and (amt_ma22[i] > amt_threshold):
+            for j in range(i, len(signal_values)):
+                if signal_values[j] > close_short_threshold[j]:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+
+    _df['flag'] = flags
+    return _df.loc[:,['flag']]
+
+def legacy_trade_factor_mean_amtclean(df, df_amt , open_thre=2, close_thre=0.8, len_ma=500 , amt_threshold = 20 * 1e8):
+    """
+    考虑成交量的因子均值化交易信号生成函数，综合了均值中心化和成交量过滤
+    
+    参数:
+    df (DataFrame): 信号数据，包含一列信号值
+    df_amt (DataFrame): 成交量数据
+    open_thre (float): 开仓阈值系数，默认为2
+    close_thre (float): 平仓阈值系数，默认为0.8
+    len_ma (int): 移动平均窗口长度，默认为500
+    amt_threshold (float): 成交量阈值，默认为20*1e8
+    
+    返回:
+    DataFrame: 包含交易标志的DataFrame，1为开多，-1为开空，0为平仓
+    """
+    _df = df.copy()
+    _df.dropna(inplace=True)
+
+    _amt = df_amt.loc[:,_df.columns]
+    _amt.columns = ['amt_ma22']
+
+    _df.columns = ['signal']
+    _df['pre_signal'] = _df['signal'].shift(1) #收益率计算用的是open开仓，所以在这里需要shift1
+    _df['pre_signal'] = _df['pre_signal'] - _df['pre_signal'].mean()
+    _df['signal_ma'] = (_df['pre_signal'].abs()).rolling(len_ma).mean()
+    _df.dropna(inplace=True)
+    
+    _df['long_threshold'] = _df['signal_ma'] * open_thre
+    _df['short_threshold'] = -_df['signal_ma'] * open_thre
+    _df['close_long_threshold'] = -_df['signal_ma'] * close_thre
+    _df['close_short_threshold'] = _df['signal_ma'] * close_thre
+    
+    signal_values = _df['pre_signal'].values
+    long_threshold = _df['long_threshold'].values
+    short_threshold = _df['short_threshold'].values
+    close_long_threshold = _df['close_long_threshold'].values
+    close_short_threshold = _df['close_short_threshold'].values
+
+    _df = pd.merge(_df,_amt,on = 'datetime',how = 'left')
+    amt_ma22 = _df['amt_ma22'].values
+    
+    flags = np.full(len(_df), np.nan)
+    close_num = 0
+    
+    # 使用向量化操作
+    for i in range(len(signal_values)):
+        if i <= close_num:
+            continue
+            
+        # 开多仓条件
+        if (signal_values[i] > long_threshold[i]) and (amt_ma22[i] > amt_threshold):
+            for j in range(i, len(signal_values)):
+                if signal_values[j] < close_long_threshold[j]:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = 1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                    
+        # 开空仓条件
+        elif (signal_values[i] < short_threshold[i]) and (amt_ma22[i] > amt_threshold):
+            for j in range(i, len(signal_values)):
+                if signal_values[j] > close_short_threshold[j]:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+                elif j == len(signal_values) - 1:
+                    flags[i] = -1
+                    flags[j] = 0
+                    close_num = j
+                    break
+
+    _df['flag'] = flags
+    return _df.loc[:,['flag']]
+
+LEGACY_MODES = {
+    'trade_ori': (legacy_trade_ori, trade_ori, False),
+    'trade_factor_mean': (legacy_trade_factor_mean, trade_factor_mean, False),
+    'trade_ori_amtclean': (legacy_trade_ori_amtclean, trade_ori_amtclean, True),
+    'trade_factor_amtclean': (legacy_trade_factor_mean_amtclean, trade_factor_mean_amtclean, True),
+}
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+# ---------------------------------------------------------------------------
+
+def _make_panel(seed, n=3000, products=('AA', 'BB', 'CC', 'DD')):
+    """
+    生成带缺失区间的信号面板和成交量面板
+
+    各品种的起始时间不同，中间有连续的缺失信号；信号有持续性，保证出现多空交易和强制平仓
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2019-01-01', periods=n, freq='15min', name='datetime')
+    signal = {}
+    amt = {}
+    for k, product in enumerate(products):
+        values = pd.Series(rng.normal(size=n)).ewm(span=rng.integers(3, 30)).mean().to_numpy()
+        values[:rng.integers(0, 300)] = np.nan  # 上市时间不同
+        gap = rng.integers(500, n - 500)
+        values[gap:gap + rng.integers(1, 80)] = np.nan  # 停牌
+        values[rng.choice(n, 20, replace=False)] = np.nan
+        if k == len(products) - 1:
+            values[-rng.integers(1, 200):] = 0.0  # 末尾信号为0，最后一笔交易强制平仓
+        signal[product] = values
+        amount = rng.lognormal(np.log(AMT_THRESHOLD), 0.5, size=n)
+        amount[rng.choice(n, 50, replace=False)] = np.nan
+        amt[product] = amount
+    return pd.DataFrame(signal, index=index), pd.DataFrame(amt, index=index)
+
+def _assert_flags_equal(result, expected):
+    assert result.index.equals(expected.index)
+    np.testing.assert_array_equal(result.to_numpy(dtype=np.float64).ravel(), expected.to_numpy(dtype=np.float64).ravel())
+
+
+# ---------------------------------------------------------------------------
+# 状态机
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('use_amt', [False, True])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_state_machine_matches_legacy(seed, use_amt, backend):
+    rng = np.random.default_rng(seed)
+    n = 5000
+    signal_values = pd.Series(rng.normal(size=n)).ewm(span=10).mean().to_numpy()
+    band = pd.Series(np.abs(signal_values)).rolling(50).mean().to_numpy()
+    for _ in range(5):
+        start = rng.integers(0, n - 100)
+        band[start:start + rng.integers(1, 100)] = np.nan  # 阈值为NaN的区间: 不开仓也不平仓
+    signal_values[rng.choice(n, 30, replace=False)] = np.nan
+    long_threshold, short_threshold = band * 2, -band * 2
+    close_long_threshold, close_short_threshold = -band * 0.8, band * 0.8
+    if use_amt:
+        amt = rng.lognormal(np.log(AMT_THRESHOLD), 0.5, size=n)
+        amt[rng.choice(n, 50, replace=False)] = np.nan
+    else:
+        amt = np.full(n, np.inf)
+
+    expected = _legacy_state_machine(signal_values, long_threshold, short_threshold, close_long_threshold, close_short_threshold, amt, AMT_THRESHOLD)
+    result = _run_state_machine(signal_values, long_threshold, short_threshold, close_long_threshold, close_short_threshold,
+                                open_mask=amt > AMT_THRESHOLD if use_amt else None, backend=backend)
+    assert np.nansum(np.abs(expected)) > 0  # 确实产生了交易
+    np.testing.assert_array_equal(result, expected)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_state_machine_edge_cases(backend):
+    empty = np.array([], dtype=np.float64)
+    assert len(_run_state_machine(empty, empty, empty, empty, empty, backend=backend)) == 0
+    for values in ([5.0], [0.0, 5.0], [0.0, 5.0, 5.0], [0.0, -5.0, 5.0, -5.0]):
+        values = np.array(values)
+        ones = np.ones(len(values))
+        expected = _legacy_state_machine(values, ones, -ones, -ones * 0.5, ones * 0.5, ones, 0)
+        result = _run_state_machine(values, ones, -ones, -ones * 0.5, ones * 0.5, backend=backend)
+        np.testing.assert_array_equal(result, expected)
+
+
+# ---------------------------------------------------------------------------
+# 单品种交易函数
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('mode', list(LEGACY_MODES))
+@pytest.mark.parametrize('seed', SEEDS)
+def test_single_product_matches_legacy(seed, mode, backend):
+    df, df_amt = _make_panel(seed)
+    legacy_func, func, use_amt = LEGACY_MODES[mode]
+    for product in df.columns:
+        kwargs = dict(open_thre=2, close_thre=0.8, len_ma=LEN_MA)
+        if use_amt:
+            kwargs.update(df_amt=df_amt, amt_threshold=AMT_THRESHOLD)
+        expected = legacy_func(df.loc[:, [product]], **kwargs)
+        result = func(df.loc[:, [product]], backend=backend, **kwargs)
+        _assert_flags_equal(result, expected)
+
+
+# ---------------------------------------------------------------------------
+# 面板计算
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('use_cache', [False, True])
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('mode', list(LEGACY_MODES))
+@pytest.mark.parametrize('seed', SEEDS)
+def test_panel_matches_per_column(seed, mode, backend, use_cache):
+    clear_signal_ma_cache()
+    df, df_amt = _make_panel(seed)
+    products = list(df.columns)
+    legacy_func, _, use_amt = LEGACY_MODES[mode]
+    kwargs = dict(begin_date='2018-01-01', end_date='2030-01-01', mode=mode, ratio=1, df_amt=df_amt,
+                  amt_threshold=AMT_THRESHOLD, backend=backend, len_ma=LEN_MA)
+
+    panel = create_trade_flag(df, products, panel=True, use_cache=use_cache, **kwargs)
+    if use_cache:
+        # 第二次调用命中缓存，结果不变
+        pd.testing.assert_frame_equal(create_trade_flag(df, products, panel=True, use_cache=True, **kwargs), panel)
+    loop = create_trade_flag(df, products, panel=False, **kwargs)
+    pd.testing.assert_frame_equal(panel, loop.reindex(panel.index), check_freq=False)
+    assert loop.index.isin(panel.index).all()
+
+    for product in products:
+        legacy_kwargs = dict(open_thre=2, close_thre=0.8, len_ma=LEN_MA)
+        if use_amt:
+            legacy_kwargs.update(df_amt=df_amt, amt_threshold=AMT_THRESHOLD)
+        expected = legacy_func(df.loc[:, [product]], **legacy_kwargs)
+        column = panel[f'{product}_flag']
+        np.testing.assert_array_equal(column.reindex(expected.index).to_numpy(), expected['flag'].to_numpy())
+        assert column.drop(expected.index).isna().all()
+
+def test_signal_ma_cache_limited_by_bytes():
+    df, _ = _make_panel(0)
+    products = list(df.columns)
+    clear_signal_ma_cache()
+    expected = create_trade_flag(df, products, end_date='2030-01-01', len_ma=LEN_MA, use_cache=False)
+    column_bytes = len(df) * 8
+    try:
+        set_signal_ma_cache_limit(3 * column_bytes)
+        for len_ma in (LEN_MA, 60, 70):
+            create_trade_flag(df, products, end_date='2030-01-01', len_ma=len_ma)
+            assert signal_ma_cache_nbytes() <= 3 * column_bytes
+        # 淘汰后重新计算的结果不变
+        pd.testing.assert_frame_equal(create_trade_flag(df, products, end_date='2030-01-01', len_ma=LEN_MA), expected)
+        set_signal_ma_cache_limit(0)
+        assert signal_ma_cache_nbytes() == 0
+        create_trade_flag(df, products, end_date='2030-01-01', len_ma=LEN_MA)
+        assert signal_ma_cache_nbytes() == 0
+    finally:
+        set_signal_ma_cache_limit(64 * 1024 ** 2)
+        clear_signal_ma_cache()
@@ -0,0 +1,102 @@
+"""
+BackTest.update 增量计算的回归测试
+
+把同一份数据分批用fit/report + 多次update处理，结果应与用全部数据一次执行fit和report一致:
+交易标志完全相同，收益矩阵、累计收益曲线、交易台账和绩效指标在浮点误差范围内相同。覆盖的情况包括
+- 第一批数据短于len_ma(尚无交易标志)，以及只追加一根K线的更新
+- 中途才开始有信号的品种和中途停止更新的品种
+- 价格数据领先或落后于信号数据
+- 固定交易成本和包含冲击成本的CostModel
+- 'frame'和'sparse'两种交易标志存储方式
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from CTA_backtest.backtest import BackTest
+from CTA_backtest.CTA_BC.metrics.cal_cost import CostModel
+
+PRODUCTS = ['AA', 'BB', 'CC', 'DD']
+LEN_MA = 50
+N = 2000
+# 第一批数据的行数以及之后每次update截止的行数
+SPLITS = [30, 31, 200, 201, 900, 1500, 1999, N]
+COST_MODEL = CostModel({'AA': {'fee_ratio': 2e-4, 'slippage_ticks': 1, 'tick_size': 0.5}},
+                       default={'fee_ratio': 1e-4, 'impact_coef': 0.1})
+
+
+def _make_data(seed=0):
+    """
+    生成信号、价格和成交额数据；CC从第1200根K线才开始有信号，DD在第1400根K线之后停止更新信号
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2018-01-02 09:00', periods=N, freq='5min', name='datetime')
+    shape = (N, len(PRODUCTS))
+    x = pd.DataFrame(rng.standard_normal(shape).cumsum(0) * 0.1 + rng.standard_normal(shape), index=index, columns=PRODUCTS)
+    y = pd.DataFrame(100 * np.exp(rng.standard_normal(shape).cumsum(0) * 0.002), index=index, columns=PRODUCTS)
+    amt = pd.DataFrame(rng.uniform(0, 40e8, shape), index=index, columns=PRODUCTS)
+    x.iloc[:1200, 2] = np.nan
+    x.iloc[1400:, 3] = np.nan
+    x.iloc[500:510, 1] = np.nan
+    return x, y, amt
+
+def _price_slice(y, start, stop, lead):
+    """
+    价格数据相对信号数据的切片，lead>0时价格领先信号lead根K线，lead<0时落后
+    """
+    start = 0 if start == 0 else max(start + lead, 0)
+    stop = len(y) if stop == len(y) else stop + lead
+    return y.iloc[start:stop]
+
+def _assert_backtest_equal(result, expected):
+    flag, expected_flag = result.flag, expected.flag
+    assert flag.index.equals(expected_flag.index)
+    assert list(flag.columns) == list(expected_flag.columns)
+    np.testing.assert_array_equal(flag.to_numpy(), expected_flag.to_numpy())
+    for name in ('_df_ret_all', '_df_ret_long', '_df_ret_short', 'df_pnl'):
+        pd.testing.assert_frame_equal(getattr(result, name), getattr(expected, name), check_exact=False, rtol=0, atol=1e-10, check_freq=False)
+    pd.testing.assert_frame_equal(result.ledger, expected.ledger, check_exact=False, rtol=0, atol=1e-12)
+    assert list(result._dict) == list(expected._dict)
+    assert result._dict == pytest.approx(expected._dict, rel=1e-9, abs=1e-12, nan_ok=True)
+
+
+@pytest.mark.parametrize('flag_storage', ['frame', 'sparse'])
+@pytest.mark.parametrize('lead', [3, -3])
+@pytest.mark.parametrize('cost', [0.0003, COST_MODEL], ids=['fixed', 'cost_model'])
+@pytest.mark.parametrize('mode', ['trade_ori', 'trade_ori_amtclean'])
+def test_update_matches_full_refit(mode, cost, lead, flag_storage):
+    x, y, amt = _make_data()
+    kwargs = dict(end_date='2030-01-01', mode=mode, cost=cost, ratio=0.6, len_ma=LEN_MA, amt_threshold=15e8, flag_storage=flag_storage)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = BackTest()
+        expected.fit(x, PRODUCTS, 'full', df_amt=amt, **kwargs)
+        expected.report(y)
+
+        result = BackTest()
+        result.fit(x.iloc[:SPLITS[0]], PRODUCTS, 'stream', df_amt=amt.iloc[:SPLITS[0]], **kwargs)
+        result.report(_price_slice(y, 0, SPLITS[0], lead))
+        for start, stop in zip(SPLITS[:-1], SPLITS[1:]):
+            result.update(x.iloc[start:stop], _price_slice(y, start, stop, lead), amt.iloc[start:stop])
+
+    assert len(expected.ledger['product'].unique()) == len(PRODUCTS)  # 每个品种都有交易
+    _assert_backtest_equal(result, expected)
+
+def test_update_without_report_only_appends_flags():
+    x, y, amt = _make_data()
+    kwargs = dict(end_date='2030-01-01', ratio=0.6, len_ma=LEN_MA)
+    expected = BackTest()
+    expected.fit(x, PRODUCTS, 'full', **kwargs)
+
+    result = BackTest()
+    result.fit(x.iloc[:SPLITS[0]], PRODUCTS, 'stream', **kwargs)
+    for start, stop in zip(SPLITS[:-1], SPLITS[1:]):
+        result.update(x.iloc[start:stop])
+    pd.testing.assert_frame_equal(result.flag, expected.flag, check_freq=False)
+    # 执行report之后必须同时提供新的价格数据
+    result.report(y)
+    with pytest.raises(ValueError):
+        result.update(x.iloc[:0])